@@ -0,0 +1,176 @@
+'''Memory and latency of network event tracking during a render.
+
+Replays CDP event streams through the compact ``NetworkLog`` and through the former approach of keeping
+every ``Network.responseReceived`` params dict and scanning them for the main document status.
+
+Event streams are NDJSON files of CDP messages as received on the page websocket, one
+``{"method": ..., "params": ...}`` per line, for example recorded with ``chrome-remote-interface``.
+Without files a synthetic stream of a page with ``--requests`` subresources is used.
+
+    $ python benchmarks/network_log.py recorded/*.ndjson
+    $ python benchmarks/network_log.py --requests 500
+'''
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+from typing import Dict, Iterable, List, Tuple
+
+import ujson as json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from prerender.network import NetworkLog, is_response_ok  # noqa: E402
+
+NETWORK_EVENTS = ('Network.requestWillBeSent', 'Network.responseReceived', 'Network.loadingFailed')
+
+
+def synthetic_stream(url: str, requests: int) -> List[Dict]:
+    '''Events of a page at ``url`` loading ``requests`` subresources from a few hosts'''
+    hosts = ['cdn.example.com', 'static.example.com', 'www.googletagmanager.com', 'fonts.gstatic.com']
+    types = ['Script', 'Stylesheet', 'Image', 'XHR', 'Font']
+    entries = [('0', url, 'Document')]
+    entries.extend(('{}'.format(i + 1), 'https://{}/asset/{}'.format(hosts[i % len(hosts)], i), types[i % len(types)])
+                   for i in range(requests))
+    events = []
+    for request_id, request_url, resource_type in entries:
+        events.append({'method': 'Network.requestWillBeSent', 'params': {
+            'requestId': request_id, 'loaderId': 'L1', 'documentURL': url, 'type': resource_type,
+            'timestamp': 1.0, 'wallTime': 1.0, 'initiator': {'type': 'parser', 'url': url, 'lineNumber': 12},
+            'request': {'url': request_url, 'method': 'GET', 'mixedContentType': 'none',
+                        'initialPriority': 'High', 'referrerPolicy': 'no-referrer-when-downgrade',
+                        'headers': {'User-Agent': 'Mozilla/5.0 Prerender', 'Referer': url,
+                                    'Accept': '*/*', 'Accept-Language': 'en-US'}},
+        }})
+    for request_id, request_url, resource_type in entries:
+        events.append({'method': 'Network.responseReceived', 'params': {
+            'requestId': request_id, 'loaderId': 'L1', 'timestamp': 2.0, 'type': resource_type,
+            'response': {
+                'url': request_url, 'status': 200, 'statusText': 'OK', 'mimeType': 'text/html',
+                'connectionReused': True, 'connectionId': 42, 'remoteIPAddress': '93.184.216.34',
+                'remotePort': 443, 'fromDiskCache': False, 'fromServiceWorker': False,
+                'encodedDataLength': 1024, 'protocol': 'h2', 'securityState': 'secure',
+                'headers': {'content-type': 'text/html; charset=utf-8', 'cache-control': 'max-age=600',
+                            'date': 'Mon, 01 Jan 2018 00:00:00 GMT', 'server': 'ECS', 'etag': '"abcdef"',
+                            'content-length': '1024', 'x-cache': 'HIT', 'vary': 'Accept-Encoding'},
+                'requestHeaders': {':authority': 'example.com', ':method': 'GET', ':path': '/',
+                                   'accept-encoding': 'gzip, deflate, br', 'user-agent': 'Mozilla/5.0 Prerender'},
+                'timing': {name: 1.0 for name in (
+                    'requestTime', 'proxyStart', 'proxyEnd', 'dnsStart', 'dnsEnd', 'connectStart', 'connectEnd',
+                    'sslStart', 'sslEnd', 'workerStart', 'workerReady', 'sendStart', 'sendEnd', 'pushStart',
+                    'pushEnd', 'receiveHeadersEnd')},
+                'securityDetails': {
+                    'protocol': 'TLS 1.2', 'keyExchange': 'ECDHE_RSA', 'keyExchangeGroup': 'X25519',
+                    'cipher': 'AES_128_GCM', 'certificateId': 0, 'subjectName': 'www.example.org',
+                    'sanList': ['www.example.org', 'example.com', 'example.net', 'example.org'],
+                    'issuer': 'DigiCert SHA2 High Assurance Server CA', 'validFrom': 1448928000,
+                    'validTo': 1575201600, 'signedCertificateTimestampList': [],
+                    'certificateTransparencyCompliance': 'compliant'},
+            },
+        }})
+    return events
+
+
+def load_stream(path: str) -> List[Dict]:
+    with open(path) as f:
+        return [event for event in (json.loads(line) for line in f if line.strip())
+                if event.get('method') in NETWORK_EVENTS]
+
+
+def document_url(events: List[Dict]) -> str:
+    return next(event['params']['documentURL'] for event in events
+                if event['method'] == 'Network.requestWillBeSent')
+
+
+def replay_dicts(events: Iterable[Dict], url: str) -> Dict:
+    '''Former tracking, every response params dict is kept'''
+    responses_received: Dict = {}
+    for event in events:
+        if event['method'] != 'Network.requestWillBeSent':
+            responses_received[event['params']['requestId']] = event['params']
+    return responses_received
+
+
+def status_dicts(responses_received: Dict, url: str) -> Tuple[int, float]:
+    '''Former lookups, scanning every response for the document status and the success rate'''
+    succeeded = sum(1 if is_response_ok(params.get('response')) or params.get('blockedReason') == 'inspector'
+                    else 0 for params in responses_received.values())
+    status_code = 200
+    for params in tuple(responses_received.values()):
+        response = params.get('response')
+        if response and response['url'] == url:
+            status_code = response['status']
+            break
+    return status_code, succeeded / max(len(responses_received), 1)
+
+
+def replay_log(events: Iterable[Dict], url: str) -> NetworkLog:
+    network = NetworkLog()
+    now = time.time()
+    for event in events:
+        if event['method'] == 'Network.requestWillBeSent':
+            network.request_will_be_sent(event['params'], now)
+        else:
+            network.response_received(event['params'], now, url)
+    return network
+
+
+def status_log(network: NetworkLog, url: str) -> Tuple[int, float]:
+    status_code = network.document_status(url)
+    return status_code if status_code is not None else 200, network.success_rate()
+
+
+def retained_memory(replay, events: List[Dict], url: str) -> int:
+    '''Bytes held by the tracker once every event was replayed'''
+    # The page decodes events one at a time, only what the tracker keeps stays alive
+    encoded = [json.dumps(event) for event in events]
+    tracemalloc.start()
+    tracker = replay((json.loads(line) for line in encoded), url)
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tracker
+    return retained
+
+
+def measure(replay, status, events: List[Dict], url: str, repeat: int) -> Tuple[float, float, int]:
+    '''Mean replay time in milliseconds, mean status lookup time in microseconds and retained memory in bytes'''
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        tracker = replay(events, url)
+    replay_ms = (time.perf_counter() - start_time) * 1000 / repeat
+
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        status(tracker, url)
+    status_us = (time.perf_counter() - start_time) * 1000000 / repeat
+    return replay_ms, status_us, retained_memory(replay, events, url)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('streams', nargs='*', help='NDJSON files of recorded CDP events')
+    parser.add_argument('--requests', type=int, default=300, help='Subresources of the synthetic stream')
+    parser.add_argument('--repeat', type=int, default=200, help='Replays per measurement')
+    args = parser.parse_args()
+
+    if args.streams:
+        streams = [(path, load_stream(path)) for path in args.streams]
+    else:
+        url = 'https://www.example.com/'
+        streams = [('synthetic {} requests'.format(args.requests), synthetic_stream(url, args.requests))]
+
+    for name, events in streams:
+        url = document_url(events)
+        expected = status_dicts(replay_dicts(events, url), url)
+        assert status_log(replay_log(events, url), url) == expected, 'Trackers disagree on {}'.format(name)
+        print('{} ({} events)'.format(name, len(events)))
+        for label, replay, status in (('params dicts', replay_dicts, status_dicts),
+                                      ('NetworkLog', replay_log, status_log)):
+            replay_ms, status_us, memory = measure(replay, status, events, url, args.repeat)
+            print('  {:<13} {:8.3f} ms/render {:10.2f} us/status lookup {:10.1f} KB retained'.format(
+                label, replay_ms, status_us, memory / 1024))
+
+
+if __name__ == '__main__':
+    main()
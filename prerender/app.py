@@ -1,6 +1,10 @@
 import os
 import sys
 import time
+import gzip
+import uuid
+import base64
+import inspect
 import logging
 import logging.config
 import asyncio
@@ -8,22 +12,33 @@ import warnings
 from urllib.parse import urlparse
 from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import cpu_count
-from typing import Set, Optional, Tuple, Callable
+from typing import Set, Optional, Tuple, Callable, Dict, List, AnyStr, Sequence, Awaitable
 from email.utils import parsedate, formatdate
-from collections import defaultdict
+from collections import OrderedDict
 
 import raven
-import httpagentparser
+import aiohttp
+import ujson as json
 from sanic import Sanic
 from sanic import response
 from sanic.exceptions import NotFound
 from sanic_compress import Compress
 from raven_aiohttp import AioHttpTransport
-from failsafe import Failsafe, CircuitBreaker, CircuitOpen, RetriesExhausted
 
 from .prerender import Prerender, CONCURRENCY
-from .cache import cache
-from .exceptions import TemporaryBrowserFailure, TooManyResponseError
+from .supervisor import ChromeSupervisor, CHROME_PROCESSES
+from .cache import cache, negative_cache, cache_writer
+from .cache.base import FORMATS, CONTENT_TYPES
+from .breaker import CircuitBreaker, CircuitBreakers
+from .metrics import metrics
+from .singleflight import SingleFlight
+from .leases import RenderLocks, ENABLE_WORKER_COORDINATION, WORKER_LOCK_DIR
+from .cluster import Cluster, CLUSTER_PEERS, FORWARDED_HEADER
+from .static import StaticRenderer, ENABLE_STATIC_RENDER
+from .revalidate import Revalidator, ENABLE_ORIGIN_REVALIDATION, VALIDATORS_FORMAT
+from .httpclient import http_clients
+from .profiling import loop_monitor, profiler, dump_tasks, ENABLE_LOOP_MONITOR, PROFILE_INTERVAL
+from .exceptions import TemporaryBrowserFailure, TooManyResponseError, ClientDisconnected
 from .utils import apply_filters, remove_script_tags, remove_meta_fragment_tag, is_yesish
 
 
@@ -34,16 +49,32 @@ HTML_FILTERS: Tuple[Callable[[str], str]] = (remove_script_tags, remove_meta_fra
 ALLOWED_DOMAINS: Set = set(dm.strip() for dm in
                            os.getenv('ALLOWED_DOMAINS', '').split(',') if dm.strip())
 CACHE_LIVE_TIME: int = int(os.getenv('CACHE_LIVE_TIME', 3600))
+CACHE_STALE_TIME: int = int(os.getenv('CACHE_STALE_TIME', 0))
+PARTIAL_CACHE_LIVE_TIME: int = int(os.getenv('PARTIAL_CACHE_LIVE_TIME', 60))
+BATCH_CONCURRENCY: int = int(os.getenv('BATCH_CONCURRENCY', 4))
+BATCH_MAX_URLS: int = int(os.getenv('BATCH_MAX_URLS', 1000))
+_STATUS_TEXTS: Dict[int, str] = {
+    502: 'Bad Gateway',
+    503: 'Service unavailable',
+    504: 'Gateway timeout',
+}
+LAZY_BOOTSTRAP: bool = is_yesish(os.getenv('LAZY_BOOTSTRAP', '0'))
+READY_MIN_IDLE_PAGES: int = int(os.getenv('READY_MIN_IDLE_PAGES', 1))
+# Seconds between checks whether the client waiting for a render is still connected
+CLIENT_DISCONNECT_POLL_INTERVAL: float = float(os.getenv('CLIENT_DISCONNECT_POLL_INTERVAL', 0.5))
 SENTRY_DSN: Optional[str] = os.getenv('SENTRY_DSN')
 _ENABLE_CB = is_yesish(os.getenv('ENABLE_CIRCUIT_BREAKER', '0'))
-_CB_FAIL_MAX: int = int(os.getenv('CIRCUIT_BREAKER_FAIL_MAX', 5))
-_CB_RESET_TIMEOUT: int = int(os.getenv('CIRCUIT_BREAKER_RESET_TIMEOUT', 60))
-_BREAKERS = defaultdict(
-    lambda: Failsafe(circuit_breaker=CircuitBreaker(
-        maximum_failures=_CB_FAIL_MAX,
-        reset_timeout_seconds=_CB_RESET_TIMEOUT
-    ))
-)
+_CB_PER_ENDPOINT = is_yesish(os.getenv('CIRCUIT_BREAKER_PER_ENDPOINT', '0'))
+_BREAKERS = CircuitBreakers()
+# In-flight renders keyed by (url, format, proxy), shared by identical concurrent requests
+_RENDERS = SingleFlight()
+metrics.gauge('renders_in_flight', lambda: len(_RENDERS))
+# Renders in flight in the other worker processes, requests wait for them and read the result from cache
+_RENDER_LOCKS: Optional[RenderLocks] = RenderLocks(WORKER_LOCK_DIR) if ENABLE_WORKER_COORDINATION else None
+_STATIC: Optional[StaticRenderer] = StaticRenderer() if ENABLE_STATIC_RENDER else None
+_REVALIDATOR: Optional[Revalidator] = Revalidator() if ENABLE_ORIGIN_REVALIDATION else None
+# Stale renders being revalidated in the background, keyed by (url, format, proxy)
+_REVALIDATING: Set[Tuple[str, str, str]] = set()
 
 if SENTRY_DSN:
     sentry = raven.Client(
@@ -56,13 +87,92 @@ else:
     sentry = None
 
 
-def _save_to_cache(key: str, data: bytes, format: str = 'html') -> None:
-    try:
-        cache.set(key, data, CACHE_LIVE_TIME, format)
-    except Exception:
-        logger.exception('Error writing cache')
-        if sentry:
-            sentry.captureException()
+async def _save_to_cache(key: str, data: bytes, format: str = 'html', ttl: Optional[int] = None,
+                         wait: bool = False) -> None:
+    if ttl is None:
+        ttl = CACHE_LIVE_TIME + CACHE_STALE_TIME
+    await cache_writer.put(key, data, ttl, format, wait=wait)
+
+
+def _save_to_negative_cache(key: str, status_code: int, payload: bytes = None, format: str = 'html') -> None:
+    if negative_cache is None:
+        return
+    if 200 <= status_code < 300:
+        negative_cache.delete(key, format)
+    else:
+        negative_cache.set(key, status_code, payload, format)
+
+
+def _is_stale(modified_since: float) -> bool:
+    return CACHE_STALE_TIME > 0 and time.time() - modified_since >= CACHE_LIVE_TIME
+
+
+def _make_response(data: bytes, format: str, headers: Dict, status: int = 200, encoding: Optional[str] = None):
+    if encoding:
+        # Served as stored, HTML filters were applied before caching
+        headers.update({'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'})
+        return response.raw(data, headers=headers, status=status, content_type=CONTENT_TYPES[format])
+    if format == 'html':
+        return response.html(
+            apply_filters(data.decode('utf-8'), HTML_FILTERS),
+            headers=headers,
+            status=status
+        )
+    return response.raw(data, headers=headers, status=status)
+
+
+def _get_breakers(prerender: Prerender, hostname: str) -> List[CircuitBreaker]:
+    '''Circuit breakers guarding the target host, and the Chrome endpoints once none of them is left to render on'''
+    if not _ENABLE_CB:
+        return []
+    breakers = [_BREAKERS[hostname]]
+    if _CB_PER_ENDPOINT:
+        endpoint_breakers = [_endpoint_breaker(endpoint) for endpoint in prerender.endpoints]
+        if not any(breaker.allows_execution() for breaker in endpoint_breakers):
+            breakers.append(min(endpoint_breakers, key=lambda breaker: breaker.retry_after))
+    return breakers
+
+
+def _endpoint_breaker(endpoint: Tuple[str, int]) -> CircuitBreaker:
+    return _BREAKERS['chrome:{}:{}'.format(*endpoint)]
+
+
+def _endpoint_allowed(endpoint: Tuple[str, int]) -> bool:
+    return _endpoint_breaker(endpoint).allows_execution()
+
+
+def _record_endpoint(endpoint: Tuple[str, int], browser_failure: bool) -> None:
+    '''Record the outcome of a render on the breaker of the Chrome endpoint that served it'''
+    breaker = _endpoint_breaker(endpoint)
+    if browser_failure:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def _open_breaker(breakers: List[CircuitBreaker]) -> Tuple[Optional[CircuitBreaker], List[CircuitBreaker]]:
+    '''First of ``breakers`` rejecting the request, otherwise ``None`` and the half-open ones whose trial it took.
+
+    Trials must be released with ``_release_trials`` once the request is done, recorded or not.
+    '''
+    open_breaker = next((breaker for breaker in breakers if not breaker.allows_execution()), None)
+    if open_breaker is not None:
+        return open_breaker, []
+    return None, [breaker for breaker in breakers if breaker.acquire_trial()]
+
+
+def _release_trials(trials: List[CircuitBreaker]) -> None:
+    for breaker in trials:
+        breaker.release_trial()
+
+
+def _record_breakers(breakers: List[CircuitBreaker], failed: bool) -> None:
+    # Chrome endpoint breakers are recorded by the page that rendered, see ``_record_endpoint``
+    for breaker in breakers:
+        if failed:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
 
 
 app = Sanic(__name__)
@@ -72,6 +182,22 @@ app.config.from_object(dict(
 Compress(app)
 
 
+@app.route('/healthz')
+async def health_check(request):
+    return response.json({'status': 'ok'})
+
+
+@app.route('/readyz')
+async def readiness_check(request):
+    renderer = request.app.prerender
+    ready = CONCURRENCY <= 0 or renderer.idle_size >= min(READY_MIN_IDLE_PAGES, CONCURRENCY)
+    return response.json({
+        'ready': ready,
+        'pages': renderer.size,
+        'idle_pages': renderer.idle_size,
+    }, status=200 if ready else 503)
+
+
 @app.route('/browser/list')
 async def list_browser_pages(request):
     renderer = request.app.prerender
@@ -86,6 +212,131 @@ async def show_brower_version(request):
     return response.json(version, ensure_ascii=False, indent=2, escape_forward_slashes=False)
 
 
+@app.route('/browser/processes')
+async def list_browser_processes(request):
+    supervisor = request.app.chrome_supervisor
+    processes = supervisor.to_dict() if supervisor is not None else []
+    return response.json(processes, ensure_ascii=False, indent=2, escape_forward_slashes=False)
+
+
+@app.route('/breakers')
+async def show_circuit_breakers(request):
+    return response.json(_BREAKERS.to_dict(), ensure_ascii=False, indent=2, escape_forward_slashes=False)
+
+
+@app.route('/metrics')
+async def show_metrics(request):
+    return response.json(metrics.to_dict(), ensure_ascii=False, indent=2, escape_forward_slashes=False)
+
+
+@app.route('/deadlines')
+async def show_render_deadlines(request):
+    stats = request.app.prerender.host_stats.summary()
+    host = request.args.get('host')
+    if host:
+        stats = {host: stats[host]} if host in stats else {}
+    return response.json(stats, ensure_ascii=False, indent=2, escape_forward_slashes=False)
+
+
+@app.route('/blocklist', methods=['GET', 'PUT'])
+async def blocklist(request):
+    '''Learned blocklist, ``PUT`` ``{"host": "example.com", "action": "block"}`` to override the action of a host.
+
+    ``action`` is one of ``block``, ``timebox``, ``allow``, or ``null`` to go back to the learned action.
+    '''
+    learned = request.app.prerender.blocklist
+    if request.method == 'PUT':
+        try:
+            body = request.json or {}
+            learned.set_override(body['host'], body.get('action'))
+        except (KeyError, TypeError, ValueError):
+            return response.text('Bad Request', status=400)
+    return response.json(learned.to_dict(), ensure_ascii=False, indent=2)
+
+
+async def _purge(request, url: Optional[str] = None, format: Optional[str] = None, host: Optional[str] = None):
+    '''Invalidate ``url`` in ``format`` or in every format, or every URL of ``host``, on every cluster node'''
+    loop = asyncio.get_event_loop()
+    # Queued writes would bring purged renders back
+    await cache_writer.invalidate(url, format, host)
+    try:
+        if host:
+            deleted = await loop.run_in_executor(executor, cache.purge_host, host)
+        else:
+            deleted = await loop.run_in_executor(executor, cache.delete, url, format)
+            if format is None and _REVALIDATOR is not None:
+                await loop.run_in_executor(executor, cache.delete, url, VALIDATORS_FORMAT)
+    except NotImplementedError:
+        return response.text('Not Implemented', status=501)
+    if negative_cache is not None:
+        if host:
+            negative_cache.purge_host(host)
+        else:
+            for fmt in (format,) if format else FORMATS:
+                negative_cache.delete(url, fmt)
+    cluster = request.app.cluster
+    if cluster is not None:
+        cluster.invalidate_hot(url, format, host)
+        # Purges forwarded by a peer were already sent to every node
+        if not request.headers.get(FORWARDED_HEADER):
+            deleted += await cluster.purge_peers(url, format, host)
+    metrics.incr('cache_purges')
+    logger.info('Purged %d cache entries of %s', deleted, host or url)
+    return response.json({'deleted': deleted})
+
+
+@app.route('/cache', methods=['DELETE'])
+async def purge_cache(request):
+    url = request.args.get('url')
+    host = request.args.get('host')
+    format = request.args.get('format')
+    if not url and not host or format and format not in FORMATS:
+        return response.text('Bad Request', status=400)
+    return await _purge(request, url, format, host)
+
+
+@app.route('/static')
+async def show_static_hosts(request):
+    hosts = _STATIC.to_dict() if _STATIC is not None else {}
+    return response.json(hosts, ensure_ascii=False, indent=2)
+
+
+@app.route('/cluster')
+async def show_cluster(request):
+    cluster = request.app.cluster
+    if cluster is None:
+        return response.json({})
+    info = cluster.to_dict()
+    url = request.args.get('url')
+    if url:
+        info['owner'] = cluster.owner(url)
+    return response.json(info, escape_forward_slashes=False)
+
+
+@app.route('/browser/concurrency', methods=['GET', 'PUT'])
+async def browser_concurrency(request):
+    renderer = request.app.prerender
+    if request.method == 'PUT':
+        try:
+            body = request.json or {}
+            if 'concurrency' in body:
+                min_size = max_size = int(body['concurrency'])
+            else:
+                min_size = int(body.get('min', renderer.min_size))
+                max_size = int(body.get('max', max(renderer.max_size, min_size)))
+        except (TypeError, ValueError):
+            return response.text('Bad Request', status=400)
+        if min_size < 0 or max_size < min_size:
+            return response.text('Bad Request', status=400)
+        await renderer.resize(min_size, max_size)
+    return response.json({
+        'min': renderer.min_size,
+        'max': renderer.max_size,
+        'pages': renderer.size,
+        'idle_pages': renderer.idle_size,
+    })
+
+
 @app.route('/browser/disable', methods=['PUT'])
 async def disable_browser_rendering(request):
     global CONCURRENCY
@@ -102,17 +353,631 @@ async def enable_browser_rendering(request):
     return response.json({'message': 'success'})
 
 
-async def _render(prerender: Prerender, url: str, format: str = 'html', proxy: str = '') -> str:
-    '''Retry once after TemporaryBrowserFailure occurred.'''
+@app.route('/debug/loop')
+async def show_loop_lag(request):
+    info = loop_monitor.to_dict()
+    info['executor_pending'] = executor._work_queue.qsize()
+    return response.json(info, ensure_ascii=False, indent=2, escape_forward_slashes=False)
+
+
+@app.route('/debug/tasks')
+async def dump_asyncio_tasks(request):
+    '''Every Chrome page of the pool and every asyncio task with the stack of coroutines it is suspended in'''
+    return response.json({
+        'pages': request.app.prerender.page_states(),
+        'tasks': dump_tasks(),
+    }, ensure_ascii=False, indent=2, escape_forward_slashes=False)
+
+
+@app.route('/debug/profile', methods=['GET', 'POST'])
+async def sampling_profile(request):
+    '''``POST`` ``?seconds=30`` to start profiling, ``GET`` the collapsed stacks once done'''
+    if request.method == 'POST':
+        try:
+            seconds = float(request.args.get('seconds', 30))
+            interval = float(request.args.get('interval', PROFILE_INTERVAL))
+        except ValueError:
+            return response.text('Bad Request', status=400)
+        if seconds <= 0 or interval <= 0:
+            return response.text('Bad Request', status=400)
+        try:
+            profiler.start(seconds, interval)
+        except RuntimeError:
+            return response.json(profiler.to_dict(), status=409)
+        return response.json(profiler.to_dict(), status=202)
+
+    if profiler.started_at is None:
+        return response.text('Not Found', status=404)
+    if profiler.running:
+        return response.json(profiler.to_dict(), status=202)
+    filename = 'prerender-{}.collapsed'.format(time.strftime('%Y%m%d-%H%M%S', time.localtime(profiler.started_at)))
+    return response.text(profiler.collapsed(), headers={
+        'Content-Disposition': 'attachment; filename="{}"'.format(filename),
+    })
+
+
+async def _render(prerender: Prerender, url: str, format: str = 'html', proxy: str = '') -> Tuple[AnyStr, int, bool]:
+    outputs, status_code, partial = await _render_many(prerender, url, (format,), proxy)
+    return outputs[format], status_code, partial
+
+
+async def _render_many(prerender: Prerender, url: str, formats: Sequence[str],
+                       proxy: str = '') -> Tuple[Dict[str, AnyStr], int, bool]:
+    '''Retry once after TemporaryBrowserFailure occurred, record origin validators of complete renders.'''
+    if _REVALIDATOR is not None:
+        formats = tuple(formats) + (VALIDATORS_FORMAT,)
     for i in range(2):
         try:
-            return await prerender.render(url, format, proxy)
+            outputs, status_code, partial = await prerender.render_many(url, formats, proxy)
+            break
         except (TemporaryBrowserFailure, asyncio.TimeoutError) as e:
             if i < 1:
                 logger.warning('Temporary browser failure: %s, retry rendering %s in 1s', str(e), url)
                 await asyncio.sleep(1)
                 continue
             raise
+    validators = outputs.pop(VALIDATORS_FORMAT, None)
+    if _REVALIDATOR is not None and 200 <= status_code < 300 and not partial:
+        asyncio.ensure_future(_REVALIDATOR.record(url, validators, CACHE_LIVE_TIME + CACHE_STALE_TIME))
+    return outputs, status_code, partial
+
+
+async def _render_maybe_static(prerender: Prerender, url: str, format: str = 'html',
+                               proxy: str = '') -> Tuple[AnyStr, int, bool]:
+    '''Serve HTML of hosts learned to be server-rendered without Chrome, learning from sampled renders'''
+    if _STATIC is None or format != 'html':
+        return await _render(prerender, url, format, proxy)
+
+    host = urlparse(url).hostname
+    if _STATIC.is_static(host):
+        result = await _STATIC.fetch(url, proxy, prerender.user_agent)
+        if result is None:
+            return await _render(prerender, url, format, proxy)
+        metrics.incr('static_renders')
+        html, status_code = result
+        if _STATIC.should_sample():
+            asyncio.ensure_future(_verify_static(prerender, url, proxy, html))
+        return html, status_code, False
+
+    if not _STATIC.should_sample():
+        return await _render(prerender, url, format, proxy)
+    fetch = asyncio.ensure_future(_STATIC.fetch(url, proxy, prerender.user_agent))
+    try:
+        data, status_code, partial = await _render(prerender, url, format, proxy)
+    except BaseException:
+        fetch.cancel()
+        raise
+    result = await fetch
+    if status_code == 200 and not partial:
+        _STATIC.learn(host, result[0] if result is not None else None, data)
+    return data, status_code, partial
+
+
+async def _verify_static(prerender: Prerender, url: str, proxy: str, html: str) -> None:
+    try:
+        data, status_code, partial = await _render(prerender, url, 'html', proxy)
+    except Exception as e:
+        logger.info('Verifying static render of %s failed: %r', url, e)
+        return
+    if status_code == 200 and not partial:
+        _STATIC.learn(urlparse(url).hostname, html, data)
+
+
+async def _render_and_cache(prerender: Prerender, url: str, format: str, proxy: str,
+                            breakers: List[CircuitBreaker]) -> Tuple[AnyStr, int, bool]:
+    if _RENDER_LOCKS is None:
+        return await _render_and_save(prerender, url, format, proxy, breakers)
+
+    lock, waited = await _RENDER_LOCKS.acquire((url, format, proxy))
+    try:
+        if waited:
+            try:
+                data = await cache.get(url, format)
+            except Exception:
+                logger.exception('Error reading cache')
+                data = None
+            if data is not None:
+                metrics.incr('renders_shared_across_workers')
+                return (data.decode('utf-8') if format == 'html' else data), 200, False
+        return await _render_and_save(prerender, url, format, proxy, breakers, wait_for_cache=True)
+    finally:
+        if lock is not None:
+            lock.release(unlink=True)
+
+
+async def _render_and_save(prerender: Prerender, url: str, format: str, proxy: str,
+                           breakers: List[CircuitBreaker],
+                           wait_for_cache: bool = False) -> Tuple[AnyStr, int, bool]:
+    try:
+        data, status_code, partial = await _render_maybe_static(prerender, url, format, proxy)
+    except (asyncio.TimeoutError, TemporaryBrowserFailure):
+        _record_breakers(breakers, True)
+        _save_to_negative_cache(url, 504, format=format)
+        raise
+    except TooManyResponseError:
+        _record_breakers(breakers, True)
+        _save_to_negative_cache(url, 503, format=format)
+        raise
+
+    _record_breakers(breakers, status_code >= 500)
+    # Other workers waiting for this render read it from cache once the lock is released
+    await _save_render(url, format, data, status_code, partial, wait=wait_for_cache)
+    return data, status_code, partial
+
+
+async def _save_render(url: str, format: str, data: AnyStr, status_code: int, partial: bool,
+                       wait: bool = False) -> None:
+    # HTML is stored filtered so that it can be served as stored
+    payload = apply_filters(data, HTML_FILTERS).encode('utf-8') if format == 'html' else data
+    if 200 <= status_code < 300:
+        ttl = PARTIAL_CACHE_LIVE_TIME if partial else None
+        await _save_to_cache(url, payload, format, ttl, wait=wait)
+    _save_to_negative_cache(url, status_code, payload, format)
+
+
+async def _render_many_and_cache(prerender: Prerender, url: str, formats: Sequence[str], proxy: str,
+                                 breakers: List[CircuitBreaker]) -> Tuple[Dict[str, AnyStr], int, bool]:
+    if len(formats) == 1:
+        # Goes through the static render path like any single format render
+        data, status_code, partial = await _render_and_cache(prerender, url, formats[0], proxy, breakers)
+        return {formats[0]: data}, status_code, partial
+    if _RENDER_LOCKS is None:
+        return await _render_many_and_save(prerender, url, formats, proxy, breakers)
+
+    locks = []
+    try:
+        outputs = {}
+        # Locked in the same order by every worker so that they do not deadlock
+        for format in sorted(formats):
+            lock, waited = await _RENDER_LOCKS.acquire((url, format, proxy))
+            locks.append(lock)
+            if not waited:
+                continue
+            try:
+                data = await cache.get(url, format)
+            except Exception:
+                logger.exception('Error reading cache')
+                data = None
+            if data is not None:
+                metrics.incr('renders_shared_across_workers')
+                outputs[format] = data.decode('utf-8') if format == 'html' else data
+        missing = [format for format in formats if format not in outputs]
+        if not missing:
+            return outputs, 200, False
+        rendered, status_code, partial = await _render_many_and_save(prerender, url, missing, proxy, breakers,
+                                                                     wait_for_cache=True)
+        outputs.update(rendered)
+        return outputs, status_code, partial
+    finally:
+        for lock in locks:
+            if lock is not None:
+                lock.release(unlink=True)
+
+
+async def _render_many_and_save(prerender: Prerender, url: str, formats: Sequence[str], proxy: str,
+                                breakers: List[CircuitBreaker],
+                                wait_for_cache: bool = False) -> Tuple[Dict[str, AnyStr], int, bool]:
+    '''Render ``url`` in every one of ``formats`` from a single page load, caching each output'''
+    try:
+        outputs, status_code, partial = await _render_many(prerender, url, formats, proxy)
+    except (asyncio.TimeoutError, TemporaryBrowserFailure):
+        _record_breakers(breakers, True)
+        for format in formats:
+            _save_to_negative_cache(url, 504, format=format)
+        raise
+    except TooManyResponseError:
+        _record_breakers(breakers, True)
+        for format in formats:
+            _save_to_negative_cache(url, 503, format=format)
+        raise
+
+    _record_breakers(breakers, status_code >= 500)
+    metrics.incr('multi_format_renders')
+    metrics.incr('multi_format_outputs', len(outputs))
+    for format, data in outputs.items():
+        await _save_render(url, format, data, status_code, partial, wait=wait_for_cache)
+    return outputs, status_code, partial
+
+
+def _revalidate_in_background(prerender: Prerender, url: str, format: str, proxy: str,
+                              stale_data: Tuple[bytes, Optional[str]]) -> None:
+    key = (url, format, proxy)
+    if key in _REVALIDATING:
+        return
+    _REVALIDATING.add(key)
+    future = asyncio.ensure_future(_revalidate(prerender, url, format, proxy, stale_data))
+    future.add_done_callback(lambda _future: _REVALIDATING.discard(key))
+
+
+async def _revalidate(prerender: Prerender, url: str, format: str, proxy: str,
+                      stale_data: Tuple[bytes, Optional[str]]) -> None:
+    '''Keep a stale render when the origin document did not change, render it again otherwise'''
+    try:
+        if await _REVALIDATOR.unchanged(url, proxy, CACHE_LIVE_TIME + CACHE_STALE_TIME):
+            data, encoding = stale_data
+            await _save_to_cache(url, gzip.decompress(data) if encoding == 'gzip' else data, format)
+            logger.info('Revalidated %s with origin', url)
+            return
+        if CONCURRENCY <= 0:
+            return
+        breakers = _get_breakers(prerender, urlparse(url).hostname)
+        open_breaker, trials = _open_breaker(breakers)
+        if open_breaker is not None:
+            return
+        try:
+            await _shared_render(prerender, url, format, proxy, breakers)
+        finally:
+            _release_trials(trials)
+    except (asyncio.TimeoutError, TemporaryBrowserFailure, TooManyResponseError) as e:
+        logger.warning('Rendering stale %s again failed: %r', url, e)
+    except Exception:
+        logger.exception('Error revalidating %s', url)
+        if sentry:
+            sentry.captureException()
+
+
+async def _shared_render(prerender: Prerender, url: str, format: str, proxy: str,
+                         breakers: List[CircuitBreaker]) -> Tuple[AnyStr, int, bool]:
+    '''Render ``url`` once for all concurrent identical requests.
+
+    The render is cancelled when every request waiting for it disconnected.
+    '''
+    return await _RENDERS.run(
+        (url, format, proxy),
+        lambda: _render_and_cache(prerender, url, format, proxy, breakers)
+    )
+
+
+async def _shared_render_many(prerender: Prerender, url: str, formats: Sequence[str], proxy: str,
+                              breakers: List[CircuitBreaker]) -> Tuple[Dict[str, AnyStr], int, bool]:
+    return await _RENDERS.run(
+        (url, tuple(formats), proxy),
+        lambda: _render_many_and_cache(prerender, url, formats, proxy, breakers)
+    )
+
+
+async def _while_connected(request, awaitable: Awaitable):
+    '''Await ``awaitable``, cancelling it and raising ``ClientDisconnected`` if the client goes away first.
+
+    Sanic does not cancel request handlers when the connection is lost, the transport is polled instead.
+    '''
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait([task], timeout=CLIENT_DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            transport = request.transport
+            if transport is None or transport.is_closing():
+                task.cancel()
+                raise ClientDisconnected
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def _write(stream, data: bytes) -> None:
+    # ``StreamingHTTPResponse.write`` is a coroutine in newer Sanic versions
+    ret = stream.write(data)
+    if inspect.isawaitable(ret):
+        await ret
+
+
+async def _render_batch_item(prerender: Prerender, url: str, format: str, proxy: str,
+                             semaphore: asyncio.Semaphore) -> Dict:
+    start_time = time.time()
+    item = {'url': url, 'format': format, 'cache': 'miss'}
+    parsed_url = urlparse(url)
+    if not parsed_url.hostname:
+        item['status'] = 400
+    elif ALLOWED_DOMAINS and parsed_url.hostname not in ALLOWED_DOMAINS:
+        item['status'] = 403
+    else:
+        stale_data = None
+        try:
+            data = await cache.get(url, format)
+            if data is not None and CACHE_STALE_TIME > 0:
+                modified_since = await cache.modified_since(url, format)
+                if modified_since and _is_stale(modified_since):
+                    stale_data, data = data, None
+        except Exception:
+            logger.exception('Error reading cache')
+            if sentry:
+                sentry.captureException()
+            data = None
+        negative_entry = negative_cache.get(url, format) if negative_cache is not None else None
+        if data is not None:
+            item.update({'status': 200, 'cache': 'hit', 'data': data})
+        elif negative_entry is not None:
+            item.update({'status': negative_entry.status_code, 'cache': 'negative', 'data': negative_entry.payload})
+        elif CONCURRENCY <= 0:
+            item['status'] = 502
+        else:
+            async with semaphore:
+                render_start_time = time.time()
+                item['wait_ms'] = int((render_start_time - start_time) * 1000)
+                breakers = _get_breakers(prerender, parsed_url.hostname)
+                open_breaker, trials = _open_breaker(breakers)
+                try:
+                    if open_breaker is not None:
+                        if stale_data is not None:
+                            item.update({'status': 200, 'cache': 'stale', 'data': stale_data})
+                        else:
+                            item.update({'status': 503, 'retry_after': open_breaker.retry_after})
+                    else:
+                        data, status_code, partial = await _shared_render(prerender, url, format, proxy, breakers)
+                        if format == 'html':
+                            data = data.encode('utf-8')
+                        item.update({'status': status_code, 'data': data})
+                        if partial:
+                            item['partial'] = True
+                except (asyncio.TimeoutError, TemporaryBrowserFailure):
+                    item['status'] = 504
+                except TooManyResponseError:
+                    item['status'] = 503
+                except Exception:
+                    logger.exception('Internal Server Error for %s in batch', url)
+                    if sentry:
+                        sentry.captureException()
+                    item['status'] = 500
+                finally:
+                    _release_trials(trials)
+                item['render_ms'] = int((time.time() - render_start_time) * 1000)
+
+    data = item.get('data')
+    if data is not None and format == 'html':
+        item['data'] = apply_filters(data.decode('utf-8'), HTML_FILTERS).encode('utf-8')
+    item['elapsed_ms'] = int((time.time() - start_time) * 1000)
+    logger.info('Got %d for %s in batch in %dms', item['status'], url, item['elapsed_ms'])
+    return item
+
+
+async def _render_multi_items(prerender: Prerender, url: str, formats: Sequence[str], proxy: str,
+                              semaphore: asyncio.Semaphore, cluster: Optional[Cluster] = None) -> List[Dict]:
+    '''Serve ``url`` in every one of ``formats``, the ones missing from cache rendered from a single page load.
+
+    With ``cluster`` the missing ones are fetched from the node owning ``url``.
+    '''
+    start_time = time.time()
+    items = OrderedDict((format, {'url': url, 'format': format, 'cache': 'miss'}) for format in formats)
+    parsed_url = urlparse(url)
+    if not parsed_url.hostname:
+        status = 400
+    elif ALLOWED_DOMAINS and parsed_url.hostname not in ALLOWED_DOMAINS:
+        status = 403
+    else:
+        status = None
+    missing = []
+    stale = {}
+    for format, item in items.items():
+        if status is not None:
+            item['status'] = status
+            continue
+        try:
+            data = await cache.get(url, format)
+            if data is not None and CACHE_STALE_TIME > 0:
+                modified_since = await cache.modified_since(url, format)
+                if modified_since and _is_stale(modified_since):
+                    stale[format], data = data, None
+        except Exception:
+            logger.exception('Error reading cache')
+            if sentry:
+                sentry.captureException()
+            data = None
+        negative_entry = negative_cache.get(url, format) if negative_cache is not None else None
+        if data is not None:
+            item.update({'status': 200, 'cache': 'hit', 'data': data})
+        elif negative_entry is not None:
+            item.update({'status': negative_entry.status_code, 'cache': 'negative', 'data': negative_entry.payload})
+        else:
+            missing.append(format)
+
+    if missing and cluster is not None:
+        forwarded = await _forward_multi(cluster, url, missing, proxy)
+        if forwarded is not None:
+            for format, item in forwarded.items():
+                items[format].update(item)
+            missing = []
+
+    if missing and CONCURRENCY <= 0:
+        for format in missing:
+            items[format]['status'] = 502
+    elif missing:
+        async with semaphore:
+            render_start_time = time.time()
+            breakers = _get_breakers(prerender, parsed_url.hostname)
+            open_breaker, trials = _open_breaker(breakers)
+            try:
+                if open_breaker is not None:
+                    for format in missing:
+                        if format in stale:
+                            items[format].update({'status': 200, 'cache': 'stale', 'data': stale[format]})
+                        else:
+                            items[format].update({'status': 503, 'retry_after': open_breaker.retry_after})
+                else:
+                    outputs, status_code, partial = await _shared_render_many(prerender, url, missing, proxy, breakers)
+                    for format, data in outputs.items():
+                        items[format].update({'status': status_code, 'data': data})
+                        if format == 'html':
+                            items[format]['data'] = apply_filters(data, HTML_FILTERS).encode('utf-8')
+                        if partial:
+                            items[format]['partial'] = True
+            except (asyncio.TimeoutError, TemporaryBrowserFailure):
+                status = 504
+            except TooManyResponseError:
+                status = 503
+            except Exception:
+                logger.exception('Internal Server Error for %s in %s', url, ','.join(missing))
+                if sentry:
+                    sentry.captureException()
+                status = 500
+            finally:
+                _release_trials(trials)
+            render_ms = int((time.time() - render_start_time) * 1000)
+            for format in missing:
+                items[format].setdefault('status', status)
+                items[format]['render_ms'] = render_ms
+
+    elapsed_ms = int((time.time() - start_time) * 1000)
+    for item in items.values():
+        item['elapsed_ms'] = elapsed_ms
+    logger.info('Got %s for %s in %dms',
+                ', '.join('{} {}'.format(item['status'], format) for format, item in items.items()),
+                url,
+                elapsed_ms)
+    return list(items.values())
+
+
+async def _forward_multi(cluster: Cluster, url: str, formats: Sequence[str], proxy: str) -> Optional[Dict[str, Dict]]:
+    '''Items of ``url`` in ``formats`` from the node owning it, ``None`` when it is unreachable'''
+    path = 'multi/{}'.format(','.join(formats))
+    entry = cluster.get_hot(url, path)
+    owner = None
+    if entry is None:
+        try:
+            # Always NDJSON, whatever the client asked for, so that hot entries can serve any of them
+            owner, entry = await cluster.forward(url, path, headers={'X-Prerender-Proxy': proxy} if proxy else None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning('Forwarding %s to its owner failed: %r, rendering locally', url, e)
+            metrics.incr('cluster_forward_failures')
+            return None
+    if entry.status != 200:
+        return {format: {'status': entry.status} for format in formats}
+    items = {}
+    for line in entry.body.splitlines():
+        item = json.loads(line)
+        data, encoding = item.pop('data', None), item.pop('encoding', None)
+        if data is not None:
+            item['data'] = data.encode('utf-8') if encoding == 'utf-8' else base64.b64decode(data)
+        if owner is not None:
+            item['peer'] = owner
+        else:
+            item['cache'] = 'hot'
+        items[item['format']] = item
+    return items
+
+
+def _ndjson_line(item: Dict) -> bytes:
+    data = item.pop('data', None)
+    if data is not None:
+        if item['format'] == 'html':
+            item.update({'data': data.decode('utf-8'), 'encoding': 'utf-8'})
+        else:
+            item.update({'data': base64.b64encode(data).decode('ascii'), 'encoding': 'base64'})
+    return json.dumps(item, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8') + b'\n'
+
+
+def _multipart_part(item: Dict, boundary: str) -> bytes:
+    data = item.pop('data', None) or b''
+    headers = [
+        '--{}'.format(boundary),
+        'Content-Type: {}'.format(CONTENT_TYPES[item['format']] if data else 'text/plain'),
+        'Content-Location: {}'.format(item['url']),
+        'Content-Length: {}'.format(len(data)),
+        'X-Prerender-Status: {}'.format(item['status']),
+        'X-Prerender-Cache: {}'.format(item['cache']),
+        'X-Prerender-Elapsed: {}'.format(item['elapsed_ms']),
+    ]
+    return '\r\n'.join(headers).encode('utf-8') + b'\r\n\r\n' + data + b'\r\n'
+
+
+@app.route('/batch', methods=['POST'])
+async def batch_render(request):
+    '''Render many URLs, streaming results back in completion order.
+
+    Request body is a JSON object like
+    ``{"urls": [...], "format": "html", "concurrency": 4, "output": "ndjson"}``,
+    ``output`` can also be ``multipart``. With ``"formats": ["html", "png"]`` instead of ``format``
+    every URL is rendered in all of these formats from a single page load.
+    '''
+    try:
+        body = request.json or {}
+    except Exception:
+        return response.text('Bad Request', status=400)
+    urls = body.get('urls')
+    format = body.get('format', 'html')
+    formats = body.get('formats')
+    if not isinstance(urls, list) or not urls or format not in FORMATS:
+        return response.text('Bad Request', status=400)
+    if formats is not None:
+        if not isinstance(formats, list) or not formats or any(fmt not in FORMATS for fmt in formats):
+            return response.text('Bad Request', status=400)
+        formats = list(OrderedDict.fromkeys(formats))
+    if len(urls) > BATCH_MAX_URLS:
+        return response.text('Too many URLs, at most {} allowed'.format(BATCH_MAX_URLS), status=413)
+    try:
+        concurrency = int(body.get('concurrency', BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        return response.text('Bad Request', status=400)
+    concurrency = max(1, min(concurrency, CONCURRENCY or 1))
+    # Deduplicate URLs while preserving order
+    urls: List[str] = list(OrderedDict.fromkeys(str(url) for url in urls))
+
+    multipart = body.get('output') == 'multipart' or 'multipart/' in request.headers.get('Accept', '')
+    boundary = uuid.uuid4().hex
+    if multipart:
+        content_type = 'multipart/mixed; boundary={}'.format(boundary)
+    else:
+        content_type = 'application/x-ndjson'
+
+    prerender = request.app.prerender
+    proxy = request.headers.get('X-Prerender-Proxy', '')
+
+    async def _stream(stream):
+        semaphore = asyncio.Semaphore(concurrency)
+        if formats is not None:
+            tasks = [asyncio.ensure_future(_render_multi_items(prerender, url, formats, proxy, semaphore))
+                     for url in urls]
+        else:
+            tasks = [asyncio.ensure_future(_render_batch_item(prerender, url, format, proxy, semaphore))
+                     for url in urls]
+        try:
+            await _while_connected(request, _write_items(stream, tasks))
+        except ClientDisconnected:
+            logger.warning('Client disconnected from batch of %d URLs', len(urls))
+            metrics.incr('client_disconnects')
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _write_items(stream, tasks):
+        for fut in asyncio.as_completed(tasks):
+            result = await fut
+            for item in (result if isinstance(result, list) else [result]):
+                if multipart:
+                    await _write(stream, _multipart_part(item, boundary))
+                else:
+                    await _write(stream, _ndjson_line(item))
+        if multipart:
+            await _write(stream, '--{}--\r\n'.format(boundary).encode('utf-8'))
+
+    return response.stream(_stream, content_type=content_type)
+
+
+@app.route('/multi/<formats>/<url:path>')
+async def multi_render(request, formats, url):
+    '''Render ``/multi/<formats>/<url>``, ``formats`` being comma separated like ``html,pdf,png``.
+
+    Outputs are returned as NDJSON lines like ``/batch`` does, or as ``multipart/mixed`` parts
+    when the ``Accept`` header asks for it.
+    '''
+    formats = list(OrderedDict.fromkeys(fmt.strip() for fmt in formats.split(',') if fmt.strip()))
+    if not formats or any(fmt not in FORMATS for fmt in formats) or not url.startswith('http'):
+        return response.text('Bad Request', status=400)
+    if request.query_string:
+        url = url + '?' + request.query_string
+    proxy = request.headers.get('X-Prerender-Proxy', '')
+    cluster = request.app.cluster
+    if cluster is not None and (not urlparse(url).hostname or not cluster.should_forward(url, request.headers)):
+        cluster = None
+
+    items = await _render_multi_items(request.app.prerender, url, formats, proxy, asyncio.Semaphore(1), cluster)
+    if 'multipart/' in request.headers.get('Accept', ''):
+        boundary = uuid.uuid4().hex
+        body = b''.join(_multipart_part(item, boundary) for item in items)
+        body += '--{}--\r\n'.format(boundary).encode('utf-8')
+        return response.raw(body, content_type='multipart/mixed; boundary={}'.format(boundary))
+    return response.raw(b''.join(_ndjson_line(item) for item in items), content_type='application/x-ndjson')
 
 
 @app.exception(NotFound)
@@ -121,6 +986,8 @@ async def handle_request(request, exception):
     format = 'html'
     url = request.path
     headers = dict()
+    # Purging a URL without format prefix invalidates it in every format
+    explicit_format = not url.startswith('/http')
     if url.startswith('/http'):
         url = url[1:]
     elif url.startswith('/html/http'):
@@ -149,12 +1016,24 @@ async def handle_request(request, exception):
         if parsed_url.hostname not in ALLOWED_DOMAINS:
             return response.text('Forbiden', status=403)
 
+    if request.method in ('PURGE', 'DELETE'):
+        return await _purge(request, url, format if explicit_format else None)
+
     skip_cache = request.method == 'POST'
+    stale_data = None
     if not skip_cache:
         try:
-            data = await cache.get(url, format)
-            modified_since = await cache.modified_since(url) or time.time()
+            data, encoding = await cache.get_encoded(url, format, request.headers.get('Accept-Encoding', ''))
+            modified_since = await cache.modified_since(url, format) or time.time()
             headers['Last-Modified'] = formatdate(modified_since, usegmt=True)
+            etag = await cache.etag(url, format) if data is not None else None
+            if data is not None:
+                # Stored compressed bodies are served decoded to clients not accepting their encoding
+                headers['Vary'] = 'Accept-Encoding'
+            if etag:
+                # Content hash, identical renders of different URLs share it. Weak as it is shared by
+                # the gzip and the decoded body
+                headers['ETag'] = 'W/"{}"'.format(etag)
 
             try:
                 if_modified_since = parsedate(request.headers.get('If-Modified-Since'))
@@ -162,7 +1041,11 @@ async def handle_request(request, exception):
             except TypeError:
                 if_modified_since = 0
 
-            if modified_since and if_modified_since >= modified_since:
+            if data is not None and _is_stale(modified_since):
+                # Kept only as fallback when rendering is unavailable
+                stale_data, data = (data, encoding), None
+            elif etag and '"{}"'.format(etag) in request.headers.get('If-None-Match', '') \
+                    or modified_since and if_modified_since >= modified_since:
                 logger.info('Got 304 for %s in cache in %dms',
                             url,
                             int((time.time() - start_time) * 1000))
@@ -173,17 +1056,58 @@ async def handle_request(request, exception):
                 logger.info('Got 200 for %s in cache in %dms',
                             url,
                             int((time.time() - start_time) * 1000))
-                if format == 'html':
-                    return response.html(
-                        apply_filters(data.decode('utf-8'), HTML_FILTERS),
-                        headers=headers
-                    )
-                return response.raw(data, headers=headers)
+                return _make_response(data, format, headers, encoding=encoding)
         except Exception:
             logger.exception('Error reading cache')
             if sentry:
                 sentry.captureException()
 
+        negative_entry = negative_cache.get(url, format) if negative_cache is not None else None
+        if negative_entry is not None:
+            headers.update({'X-Prerender-Cache': 'negative', 'Retry-After': str(negative_entry.ttl)})
+            logger.info('Got %d for %s in negative cache in %dms',
+                        negative_entry.status_code,
+                        url,
+                        int((time.time() - start_time) * 1000))
+            if negative_entry.payload is None:
+                return response.text(_STATUS_TEXTS.get(negative_entry.status_code, ''),
+                                     status=negative_entry.status_code,
+                                     headers=headers)
+            return _make_response(negative_entry.payload, format, headers, negative_entry.status_code)
+
+    cluster = request.app.cluster
+    if cluster is not None and cluster.should_forward(url, request.headers):
+        hot_entry = cluster.get_hot(url, format) if not skip_cache else None
+        if hot_entry is not None:
+            headers.update(hot_entry.headers)
+            headers['X-Prerender-Cache'] = 'hot'
+            logger.info('Got %d for %s in hot cache in %dms',
+                        hot_entry.status,
+                        url,
+                        int((time.time() - start_time) * 1000))
+            return response.raw(hot_entry.body, headers=headers, status=hot_entry.status,
+                                content_type=hot_entry.content_type)
+        try:
+            owner, entry = await cluster.forward(url, format, request.method,
+                                                 {'X-Prerender-Proxy': proxy} if proxy else None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Owner unreachable, render here rather than failing the request
+            logger.warning('Forwarding %s to its owner failed: %r, rendering locally', url, e)
+            metrics.incr('cluster_forward_failures')
+        else:
+            headers.update(entry.headers)
+            headers['X-Prerender-Peer'] = owner
+            return response.raw(entry.body, headers=headers, status=entry.status, content_type=entry.content_type)
+
+    if stale_data is not None and _REVALIDATOR is not None:
+        # Served stale while the origin is checked in the background, rendered again only if it changed
+        _revalidate_in_background(request.app.prerender, url, format, proxy, stale_data)
+        headers.update({'X-Prerender-Cache': 'stale', 'Warning': '110 - "Response is Stale"'})
+        logger.info('Got 200 for %s stale in cache in %dms, revalidating',
+                    url,
+                    int((time.time() - start_time) * 1000))
+        return _make_response(stale_data[0], format, headers, encoding=stale_data[1])
+
     if CONCURRENCY <= 0:
         # Read from cache only
         logger.warning('Got 502 for %s in %dms, prerender unavailable',
@@ -191,31 +1115,45 @@ async def handle_request(request, exception):
                        int((time.time() - start_time) * 1000))
         return response.text('Bad Gateway', status=502)
 
+    breakers = _get_breakers(request.app.prerender, parsed_url.hostname)
+    open_breaker, trials = _open_breaker(breakers)
+    if open_breaker is not None:
+        logger.warning('Circuit breaker %s open for %s', open_breaker.name, url)
+        if stale_data is not None:
+            headers.update({'X-Prerender-Cache': 'stale', 'Warning': '110 - "Response is Stale"'})
+            return _make_response(stale_data[0], format, headers, encoding=stale_data[1])
+        headers['Retry-After'] = str(open_breaker.retry_after)
+        return response.text('Service unavailable', status=503, headers=headers)
+
     try:
-        if _ENABLE_CB:
-            user_agent = request.headers.get('user-agent', '')
-            _os, browser = httpagentparser.simple_detect(user_agent)
-            breaker = _BREAKERS[browser]
-            data, status_code = await breaker.run(lambda: _render(request.app.prerender, url, format, proxy))
-        else:
-            data, status_code = await _render(request.app.prerender, url, format, proxy)
+        data, status_code, partial = await _while_connected(
+            request, _shared_render(request.app.prerender, url, format, proxy, breakers))
         headers.update({'X-Prerender-Cache': 'miss', 'Last-Modified': formatdate(usegmt=True)})
-        logger.info('Got %d for %s in %dms',
+        headers.pop('ETag', None)
+        if partial:
+            headers['X-Prerender-Partial'] = '1'
+        logger.info('Got %d for %s in %dms%s',
                     status_code,
                     url,
-                    int((time.time() - start_time) * 1000))
+                    int((time.time() - start_time) * 1000),
+                    ', partial' if partial else '')
         if format == 'html':
-            if 200 <= status_code < 300:
-                executor.submit(_save_to_cache, url, data.encode('utf-8'), format)
             return response.html(
                 apply_filters(data, HTML_FILTERS),
                 headers=headers,
                 status=status_code
             )
-        if 200 <= status_code < 300:
-            executor.submit(_save_to_cache, url, data, format)
         return response.raw(data, headers=headers, status=status_code)
-    except (asyncio.TimeoutError, asyncio.CancelledError, TemporaryBrowserFailure, RetriesExhausted):
+    except ClientDisconnected:
+        logger.warning('Client disconnected while rendering %s in %dms',
+                       url,
+                       int((time.time() - start_time) * 1000))
+        metrics.incr('client_disconnects')
+        # Never sent, only logged
+        return response.text('Client Closed Request', status=499)
+    except asyncio.CancelledError:
+        raise
+    except (asyncio.TimeoutError, TemporaryBrowserFailure):
         logger.warning('Got 504 for %s in %dms',
                        url,
                        int((time.time() - start_time) * 1000))
@@ -225,9 +1163,6 @@ async def handle_request(request, exception):
                        url,
                        int((time.time() - start_time) * 1000))
         return response.text('Service unavailable', status=503)
-    except CircuitOpen:
-        logger.warning('Circuit breaker open for %s', browser)
-        return response.text('Service unavailable', status=503)
     except Exception:
         logger.exception('Internal Server Error for %s in %dms',
                          url,
@@ -235,11 +1170,19 @@ async def handle_request(request, exception):
         if sentry:
             sentry.captureException()
         return response.text('Internal Server Error', status=500)
+    finally:
+        _release_trials(trials)
 
 
 @app.listener('before_server_start')
 async def before_server_start(app: Sanic, loop):
     loop.set_default_executor(executor)
+    cache_writer.start(loop)
+    metrics.gauge('executor_pending', lambda: executor._work_queue.qsize())
+    if ENABLE_LOOP_MONITOR:
+        loop_monitor.start(loop)
+    if sentry:
+        cache_writer.on_error = sentry.captureException
 
     logging_config = {
         'version': 1,
@@ -266,16 +1209,53 @@ async def before_server_start(app: Sanic, loop):
     if app.debug or loop.get_debug():
         warnings.simplefilter('always', ResourceWarning)
 
-    app.prerender = Prerender(loop=loop)
-    if CONCURRENCY > 0:
+    app.chrome_supervisor = None
+    endpoints = None
+    if CHROME_PROCESSES > 0:
+        app.chrome_supervisor = ChromeSupervisor(CHROME_PROCESSES, loop=loop)
+        endpoints = await app.chrome_supervisor.start()
+
+    app.prerender = Prerender(loop=loop, endpoints=endpoints)
+    if _ENABLE_CB and _CB_PER_ENDPOINT:
+        app.prerender.on_render_result = _record_endpoint
+        app.prerender.endpoint_allowed = _endpoint_allowed
+    http_clients.loop = loop
+    app.cluster = Cluster() if CLUSTER_PEERS else None
+    if app.chrome_supervisor is not None:
+        app.chrome_supervisor.on_availability_change = app.prerender.set_endpoint_available
+    app.bootstrap_task = None
+    if CONCURRENCY > 0 and LAZY_BOOTSTRAP:
+        # Serve cache hits right away while Chrome pages are opened
+        app.bootstrap_task = asyncio.ensure_future(_bootstrap_in_background(app.prerender))
+    elif CONCURRENCY > 0:
         try:
             await app.prerender.bootstrap()
         except Exception:
             logger.error('Error bootstrapping Prerender, please start Chrome first.')
             await app.prerender.shutdown()
+            if app.chrome_supervisor is not None:
+                await app.chrome_supervisor.stop()
             raise
 
 
+async def _bootstrap_in_background(prerender: Prerender) -> None:
+    while True:
+        try:
+            await prerender.bootstrap()
+            logger.info('Prerender bootstrapped with %d pages', prerender.size)
+            return
+        except Exception:
+            logger.exception('Error bootstrapping Prerender, retrying in 5s')
+            await asyncio.sleep(5)
+
+
 @app.listener('after_server_stop')
 async def after_server_stop(app: Sanic, loop):
+    if app.bootstrap_task is not None:
+        app.bootstrap_task.cancel()
     await app.prerender.shutdown()
+    await cache_writer.close()
+    await http_clients.close()
+    loop_monitor.stop()
+    if app.chrome_supervisor is not None:
+        await app.chrome_supervisor.stop()
@@ -0,0 +1,176 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from .utils import is_yesish
+
+
+logger = logging.getLogger(__name__)
+
+ENABLE_LEARNED_BLOCKLIST: bool = is_yesish(os.environ.get('ENABLE_LEARNED_BLOCKLIST', '0'))
+# Readiness delay in milliseconds that counts against a host
+BLOCKLIST_MIN_DELAY: float = float(os.environ.get('BLOCKLIST_MIN_DELAY', 500))
+BLOCKLIST_THRESHOLD: float = float(os.environ.get('BLOCKLIST_THRESHOLD', 3))
+BLOCKLIST_HALF_LIFE: float = float(os.environ.get('BLOCKLIST_HALF_LIFE', 3600))
+# How long renders wait for requests to time-boxed hosts, in milliseconds
+BLOCKLIST_TIMEBOX: float = float(os.environ.get('BLOCKLIST_TIMEBOX', 1000))
+BLOCKLIST_MAX_HOSTS: int = int(os.environ.get('BLOCKLIST_MAX_HOSTS', 10000))
+BLOCKLIST_ALWAYS: List[str] = [host.strip() for host in
+                               os.environ.get('BLOCKLIST_ALWAYS', '').split(',') if host.strip()]
+BLOCKLIST_NEVER: List[str] = [host.strip() for host in
+                              os.environ.get('BLOCKLIST_NEVER', '').split(',') if host.strip()]
+# Resource types whose requests never change the DOM, hosts only requested for these are blocked
+# outright instead of time-boxed
+NON_DOM_RESOURCE_TYPES: Set[str] = {'Image', 'Media', 'Font', 'Ping', 'CSPViolationReport', 'Manifest'}
+
+BLOCK = 'block'
+TIMEBOX = 'timebox'
+ALLOW = 'allow'
+
+
+# Second-level labels under which country code TLDs register domains, like co.uk, com.cn or ne.jp
+_SECOND_LEVEL_LABELS: Set[str] = {'ac', 'co', 'com', 'edu', 'gob', 'gov', 'ltd', 'me', 'mil', 'ne', 'net', 'nic',
+                                  'or', 'org', 'plc', 'sch'}
+
+
+def site(host: str) -> str:
+    '''Registrable domain of ``host``, to tell first-party hosts from third-party ones.
+
+    Short of a public suffix list, a second-level label like ``co`` or ``com`` under a country code TLD
+    is taken as part of the suffix. IP addresses are sites of their own.
+    '''
+    labels = host.lower().rstrip('.').split('.')
+    if labels[-1].isdigit() or ':' in host:
+        return host
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in _SECOND_LEVEL_LABELS:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+class HostScore:
+    __slots__ = ('score', 'updated_at', 'delays', 'last_delay', 'resource_types', 'listed')
+
+    def __init__(self) -> None:
+        # Exponentially decaying count of renders delayed by the host
+        self.score: float = 0
+        self.updated_at: float = 0
+        self.delays: int = 0
+        # Last readiness delay caused by the host, in milliseconds
+        self.last_delay: float = 0
+        self.resource_types: Set[str] = set()
+        # Listed once the score reaches the threshold, until it decays below half of it
+        self.listed: bool = False
+
+    def decayed(self, now: float) -> float:
+        return self.score * 0.5 ** ((now - self.updated_at) / BLOCKLIST_HALF_LIFE)
+
+
+class LearnedBlocklist:
+    '''Third-party hosts that repeatedly delay page readiness.
+
+    After every render the host whose last response arrived at least ``BLOCKLIST_MIN_DELAY`` ms after
+    every other host's is blamed for the delay. Once the decaying score of a host reaches ``BLOCKLIST_THRESHOLD``,
+    renders stop waiting for it after ``BLOCKLIST_TIMEBOX`` ms, or block it altogether when it was only requested
+    for resources that cannot change the DOM, until the score decays below half the threshold.
+    Operator overrides always win over learned actions.
+    '''
+
+    def __init__(self, learn: bool = ENABLE_LEARNED_BLOCKLIST, max_hosts: int = BLOCKLIST_MAX_HOSTS) -> None:
+        self.learn = learn
+        self.max_hosts = max_hosts
+        self._hosts: OrderedDict = OrderedDict()
+        self.overrides: Dict[str, str] = {}
+        # Actions are recomputed at most once a second, every render asks for them
+        self._actions: Optional[Tuple[List[str], Set[str]]] = None
+        self._actions_time: float = 0
+        for host in BLOCKLIST_NEVER:
+            self.overrides[host] = ALLOW
+        for host in BLOCKLIST_ALWAYS:
+            self.overrides[host] = BLOCK
+
+    def set_override(self, host: str, action: Optional[str]) -> None:
+        if action is None:
+            self.overrides.pop(host, None)
+        elif action in (BLOCK, TIMEBOX, ALLOW):
+            self.overrides[host] = action
+        else:
+            raise ValueError('Invalid blocklist action {!r}'.format(action))
+        self._actions = None
+
+    def action(self, host: str, now: Optional[float] = None) -> Optional[str]:
+        override = self.overrides.get(host)
+        if override is not None:
+            return override if override != ALLOW else None
+        host_score = self._hosts.get(host)
+        if host_score is None or not host_score.listed:
+            return None
+        if host_score.decayed(now or time.time()) < BLOCKLIST_THRESHOLD / 2:
+            host_score.listed = False
+            logger.info('Host %s no longer delays readiness, removing it from blocklist', host)
+            return None
+        if host_score.resource_types and host_score.resource_types <= NON_DOM_RESOURCE_TYPES:
+            return BLOCK
+        return TIMEBOX
+
+    def actions(self) -> Tuple[List[str], Set[str]]:
+        '''Hosts to block and hosts to time-box right now'''
+        now = time.time()
+        if self._actions is not None and now - self._actions_time < 1:
+            return self._actions
+        blocked = []
+        timeboxed = set()
+        for host in set(self.overrides) | set(self._hosts):
+            action = self.action(host, now)
+            if action == BLOCK:
+                blocked.append(host)
+            elif action == TIMEBOX:
+                timeboxed.add(host)
+        self._actions = blocked, timeboxed
+        self._actions_time = now
+        return self._actions
+
+    def record(self, page_host: str, hosts: Dict[str, Tuple[float, Set[str]]]) -> None:
+        '''Blame the host that delayed readiness of a render of ``page_host`` if any.
+
+        ``hosts`` maps requested hosts to the time their last response arrived and their resource types.
+        '''
+        if not self.learn or len(hosts) < 2:
+            return
+        ordered = sorted(hosts.items(), key=lambda item: item[1][0])
+        host, (last_time, resource_types) = ordered[-1]
+        delay = (last_time - ordered[-2][1][0]) * 1000
+        if delay < BLOCKLIST_MIN_DELAY or site(host) == site(page_host) or host in self.overrides:
+            return
+
+        now = time.time()
+        host_score = self._hosts.get(host)
+        if host_score is None:
+            host_score = self._hosts[host] = HostScore()
+            while len(self._hosts) > self.max_hosts:
+                self._hosts.popitem(last=False)
+        else:
+            self._hosts.move_to_end(host)
+        host_score.score = host_score.decayed(now) + 1
+        host_score.updated_at = now
+        host_score.delays += 1
+        host_score.last_delay = delay
+        host_score.resource_types |= resource_types
+        if not host_score.listed and round(host_score.score, 6) >= BLOCKLIST_THRESHOLD:
+            host_score.listed = True
+            self._actions = None
+            logger.info('Host %s delayed readiness %d times, last time by %dms rendering %s, adding it to blocklist',
+                        host, host_score.delays, delay, page_host)
+
+    def to_dict(self) -> Dict:
+        now = time.time()
+        return {
+            'overrides': dict(self.overrides),
+            'learned': {host: {'score': round(host_score.decayed(now), 3),
+                               'action': self.action(host, now),
+                               'delays': host_score.delays,
+                               'last_delay': host_score.last_delay,
+                               'resource_types': sorted(host_score.resource_types)}
+                        for host, host_score in self._hosts.items()},
+        }
@@ -0,0 +1,136 @@
+import os
+import time
+import logging
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Callable
+
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_BREAKER_FAIL_MAX: int = int(os.getenv('CIRCUIT_BREAKER_FAIL_MAX', 5))
+CIRCUIT_BREAKER_RESET_TIMEOUT: int = int(os.getenv('CIRCUIT_BREAKER_RESET_TIMEOUT', 60))
+CIRCUIT_BREAKER_MAX_ENTRIES: int = int(os.getenv('CIRCUIT_BREAKER_MAX_ENTRIES', 10000))
+CIRCUIT_BREAKER_HISTORY: int = int(os.getenv('CIRCUIT_BREAKER_HISTORY', 100))
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name: str,
+                 maximum_failures: int = CIRCUIT_BREAKER_FAIL_MAX,
+                 reset_timeout: int = CIRCUIT_BREAKER_RESET_TIMEOUT,
+                 on_transition: Optional[Callable[['CircuitBreaker', str, str], None]] = None) -> None:
+        self.name = name
+        self.maximum_failures = maximum_failures
+        self.reset_timeout = reset_timeout
+        self.failures: int = 0
+        self.opened_at: float = 0
+        # When the single request let through by the half-open breaker started, 0 when none is in flight
+        self.trial_at: float = 0
+        self._state: str = self.CLOSED
+        self._on_transition = on_transition
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout:
+            self._transition(self.HALF_OPEN)
+        return self._state
+
+    @property
+    def retry_after(self) -> int:
+        if self._state == self.CLOSED:
+            return 0
+        return max(int(self.opened_at + self.reset_timeout - time.time()) + 1, 1)
+
+    def allows_execution(self) -> bool:
+        '''Whether a request may go through, without side effects'''
+        state = self.state
+        if state == self.HALF_OPEN:
+            # Exactly one trial request goes through, others keep failing fast
+            # until it finishes or another reset timeout elapsed.
+            return not self.trial_at or time.time() - self.trial_at >= self.reset_timeout
+        return state != self.OPEN
+
+    def acquire_trial(self) -> bool:
+        '''Take the trial of a half-open breaker, once every breaker guarding the request allows it'''
+        if self.state != self.HALF_OPEN:
+            return False
+        self.trial_at = time.time()
+        return True
+
+    def release_trial(self) -> None:
+        '''Let another request try once the trial ended without an outcome, cancelled or served from cache'''
+        self.trial_at = 0
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.trial_at = 0
+        if self._state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_at = 0
+        if self._state != self.CLOSED or self.failures >= self.maximum_failures:
+            self.opened_at = time.time()
+            if self._state != self.OPEN:
+                self._transition(self.OPEN)
+
+    def _transition(self, state: str) -> None:
+        old_state, self._state = self._state, state
+        logger.warning('Circuit breaker %s changed from %s to %s', self.name, old_state, state)
+        if self._on_transition is not None:
+            self._on_transition(self, old_state, state)
+
+    def to_dict(self) -> Dict:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'opened_at': self.opened_at or None,
+            'retry_after': self.retry_after,
+        }
+
+
+class CircuitBreakers:
+    '''Circuit breakers keyed by failure domain, such as target host or Chrome endpoint.'''
+
+    def __init__(self, max_entries: int = CIRCUIT_BREAKER_MAX_ENTRIES, history: int = CIRCUIT_BREAKER_HISTORY) -> None:
+        self.max_entries = max_entries
+        self._breakers: OrderedDict = OrderedDict()
+        self.transitions: deque = deque(maxlen=history)
+
+    def __getitem__(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, on_transition=self._record_transition)
+            self._breakers[name] = breaker
+            self._evict()
+        else:
+            self._breakers.move_to_end(name)
+        return breaker
+
+    def _evict(self) -> None:
+        if len(self._breakers) <= self.max_entries:
+            return
+        for name, breaker in tuple(self._breakers.items()):
+            if breaker.state == CircuitBreaker.CLOSED:
+                del self._breakers[name]
+                if len(self._breakers) <= self.max_entries:
+                    return
+
+    def _record_transition(self, breaker: CircuitBreaker, old_state: str, state: str) -> None:
+        self.transitions.append({
+            'breaker': breaker.name,
+            'from': old_state,
+            'to': state,
+            'time': time.time(),
+        })
+
+    def to_dict(self) -> Dict:
+        return {
+            'breakers': {name: breaker.to_dict() for name, breaker in self._breakers.items()
+                         if breaker.state != CircuitBreaker.CLOSED or breaker.failures},
+            'transitions': list(self.transitions),
+        }
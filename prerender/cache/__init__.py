@@ -1,6 +1,10 @@
 import os
+from typing import Optional
 
 from .base import CacheBackend
+from .negative import NegativeCache
+from .writer import WriteBehindQueue
+from ..utils import is_yesish
 
 
 CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'dummy')
@@ -18,3 +22,11 @@ else:
     from .dummy import DummyCache
 
     cache = DummyCache()
+
+# Started with the server, writes synchronously until then
+cache_writer = WriteBehindQueue(cache)
+
+if is_yesish(os.environ.get('ENABLE_NEGATIVE_CACHE', '0')):
+    negative_cache: Optional[NegativeCache] = NegativeCache()
+else:
+    negative_cache = None
@@ -1,4 +1,24 @@
-from typing import Optional
+import os
+import hashlib
+from typing import Optional, Tuple, List, Dict
+
+from ..utils import is_yesish
+
+
+# Store identical payloads once, cache keys point to payloads addressed by content hash
+ENABLE_CACHE_DEDUP: bool = is_yesish(os.environ.get('ENABLE_CACHE_DEDUP', '0'))
+FORMATS: Tuple[str] = ('html', 'mhtml', 'pdf', 'jpeg', 'png')
+CONTENT_TYPES: Dict[str, str] = {
+    'html': 'text/html; charset=utf-8',
+    'mhtml': 'multipart/related',
+    'pdf': 'application/pdf',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+
+
+def content_digest(payload: bytes) -> str:
+    return hashlib.sha256(payload).hexdigest()
 
 
 class CacheBackend:
@@ -10,3 +30,28 @@ class CacheBackend:
 
     async def modified_since(self, key: str, format: str = 'html') -> Optional[float]:
         raise NotImplementedError
+
+    async def etag(self, key: str, format: str = 'html') -> Optional[str]:
+        '''Content hash of ``key``, ``None`` when unknown'''
+        return None
+
+    async def get_encoded(self, key: str, format: str = 'html',
+                          accept_encoding: str = '') -> Tuple[Optional[bytes], Optional[str]]:
+        '''Get ``key`` as stored when it is stored in one of ``accept_encoding``, returns data and its encoding.
+
+        Encoding is ``None`` when data is returned decoded.
+        '''
+        return await self.get(key, format), None
+
+    def set_many(self, items: List[Tuple[str, bytes, Optional[int], str]]) -> None:
+        '''Store ``(key, payload, ttl, format)`` items, backends able to commit them at once override it'''
+        for key, payload, ttl, format in items:
+            self.set(key, payload, ttl, format)
+
+    def delete(self, key: str, format: Optional[str] = None) -> int:
+        '''Delete ``key`` in ``format``, or in every format when it is ``None``, returns deleted entries count'''
+        raise NotImplementedError
+
+    def purge_host(self, host: str) -> int:
+        '''Delete every entry of ``host``, returns deleted entries count'''
+        raise NotImplementedError
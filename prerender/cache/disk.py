@@ -1,41 +1,143 @@
 import os
+import time
 import lzma
 import asyncio
+import logging
 import functools
-from typing import Optional
+from urllib.parse import urlparse
+from typing import Optional, Tuple, List, Dict, Iterable, Callable
 from aiofiles.os import stat
 
 import diskcache
 
-from .base import CacheBackend
+from .base import CacheBackend, FORMATS, ENABLE_CACHE_DEDUP, content_digest
 
 
+logger = logging.getLogger(__name__)
+
 CACHE_ROOT_DIR: str = os.environ.get('CACHE_ROOT_DIR', '/tmp/prerender')
+CACHE_SHARDS: int = int(os.environ.get('CACHE_SHARDS', 8))
+CACHE_SIZE_LIMIT: int = int(os.environ.get('CACHE_SIZE_LIMIT', 1024)) * 2 ** 20
+CACHE_EVICTION_POLICY: str = os.environ.get('CACHE_EVICTION_POLICY', 'lru')
+_EVICTION_POLICIES = {
+    'lru': 'least-recently-used',
+    'lfu': 'least-frequently-used',
+    'lrs': 'least-recently-stored',
+    'none': 'none',
+}
+_BLOB_PREFIX = 'blob:'
 
 
 class DiskCache(CacheBackend):
+    '''Sharded disk cache, writers of different shards do not contend on the same SQLite database.
+
+    Entries are ``(compressed payload, stored_at)`` tagged with their host so that a whole host can be purged at once.
+    With ``ENABLE_CACHE_DEDUP`` entries are ``(digest, stored_at)`` pointers to compressed payloads
+    stored once per content hash, a payload expires with the longest lived entry pointing to it.
+    '''
+
     def __init__(self) -> None:
-        self._cache = diskcache.Cache(CACHE_ROOT_DIR)
+        if CACHE_EVICTION_POLICY not in _EVICTION_POLICIES:
+            raise ValueError('Invalid CACHE_EVICTION_POLICY {!r}, expected one of {}'.format(
+                CACHE_EVICTION_POLICY, ', '.join(_EVICTION_POLICIES)))
+        if os.path.exists(os.path.join(CACHE_ROOT_DIR, 'cache.db')):
+            logger.warning('Unsharded disk cache found in %s is no longer used, delete %s and its two hex digit '
+                           'directories to reclaim space', CACHE_ROOT_DIR, os.path.join(CACHE_ROOT_DIR, 'cache.db'))
+        self._cache = diskcache.FanoutCache(
+            CACHE_ROOT_DIR,
+            shards=CACHE_SHARDS,
+            size_limit=CACHE_SIZE_LIMIT,
+            eviction_policy=_EVICTION_POLICIES[CACHE_EVICTION_POLICY],
+            tag_index=True,
+        )
 
     async def get(self, key: str, format: str = 'html') -> Optional[bytes]:
         loop = asyncio.get_event_loop()
-        cache_get = self._cache.get
-        data = await loop.run_in_executor(None, cache_get, key + format)
+        data = await loop.run_in_executor(None, self._load, key + format)
         if data is not None:
             res = await loop.run_in_executor(None, lzma.decompress, data)
             return res
 
+    def _load(self, cache_key: str) -> Optional[bytes]:
+        value = self._cache.get(cache_key)
+        if isinstance(value, tuple):
+            if isinstance(value[0], bytes):
+                return value[0]
+            # Payload may have been evicted, which is a cache miss as well
+            return self._cache.get(_BLOB_PREFIX + value[0])
+        # Stored by earlier versions without their time
+        return value
+
     def set(self, key: str, payload: bytes, ttl: int = None, format: str = 'html') -> None:
-        compressed = lzma.compress(payload)
-        self._cache.set(key + format, compressed, expire=ttl)
+        self.set_many([(key, payload, ttl, format)])
+
+    def set_many(self, items: List[Tuple[str, bytes, Optional[int], str]]) -> None:
+        blobs: Dict[str, Tuple[bytes, Optional[int]]] = {}
+        entries = []
+        for key, payload, ttl, format in items:
+            compressed = lzma.compress(payload)
+            tag = urlparse(key).hostname
+            if not ENABLE_CACHE_DEDUP:
+                entries.append((key + format, (compressed, time.time()), ttl, tag))
+                continue
+            digest = content_digest(payload)
+            blob_key = _BLOB_PREFIX + digest
+            previous = blobs.get(blob_key)
+            # Identical payloads in the same batch are stored once with the longest TTL
+            if previous is None or previous[1] is not None and (ttl is None or ttl > previous[1]):
+                blobs[blob_key] = (compressed, ttl)
+            entries.append((key + format, (digest, time.time()), ttl, tag))
+        # Payloads first so that no entry points to a payload not written yet, then one transaction per shard
+        # for the writes of that shard: FanoutCache.transact() would lock every shard for the whole batch
+        for shard, shard_blobs in self._by_shard(blobs.items(), lambda blob: blob[0]):
+            with shard.transact(retry=True):
+                for blob_key, (compressed, ttl) in shard_blobs:
+                    self._store_blob(shard, blob_key, compressed, ttl)
+        for shard, shard_entries in self._by_shard(entries, lambda entry: entry[0]):
+            with shard.transact(retry=True):
+                for cache_key, value, ttl, tag in shard_entries:
+                    shard.set(cache_key, value, expire=ttl, tag=tag, retry=True)
+
+    def _by_shard(self, items: Iterable, get_key: Callable) -> Iterable[Tuple[diskcache.Cache, List]]:
+        # Same routing as FanoutCache
+        shards: Dict[int, List] = {}
+        for item in items:
+            shards.setdefault(self._cache._hash(get_key(item)) % self._cache._count, []).append(item)
+        return ((self._cache._shards[index], shard_items) for index, shard_items in shards.items())
+
+    def _store_blob(self, shard: diskcache.Cache, blob_key: str, compressed: bytes, ttl: Optional[int]) -> None:
+        blob, expire_time = shard.get(blob_key, read=True, expire_time=True, retry=True)
+        if blob is None:
+            shard.set(blob_key, compressed, expire=ttl, retry=True)
+            return
+        if hasattr(blob, 'close'):
+            blob.close()
+        if expire_time is not None and (ttl is None or time.time() + ttl > expire_time):
+            shard.touch(blob_key, expire=ttl, retry=True)
 
     async def modified_since(self, key: str, format: str = 'html') -> Optional[float]:
         loop = asyncio.get_event_loop()
         cache_read = functools.partial(self._cache.get, read=True)
-        file = await loop.run_in_executor(None, cache_read, key + format)
-        if not file:
+        value = await loop.run_in_executor(None, cache_read, key + format)
+        if isinstance(value, tuple):
+            return value[1]
+        if not hasattr(value, 'name'):
+            # Missing, or stored inline by earlier versions without their time
             return
-        filename = file.name
-        file.close()
+        filename = value.name
+        value.close()
         stats = await stat(filename)
         return stats.st_mtime
+
+    async def etag(self, key: str, format: str = 'html') -> Optional[str]:
+        loop = asyncio.get_event_loop()
+        value = await loop.run_in_executor(None, self._cache.get, key + format)
+        if isinstance(value, tuple) and isinstance(value[0], str):
+            return value[0]
+
+    def delete(self, key: str, format: Optional[str] = None) -> int:
+        formats = FORMATS if format is None else (format,)
+        return sum(1 for fmt in formats if self._cache.delete(key + fmt, retry=True))
+
+    def purge_host(self, host: str) -> int:
+        return self._cache.evict(host, retry=True)
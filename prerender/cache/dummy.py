@@ -13,3 +13,9 @@ class DummyCache(CacheBackend):
 
     async def modified_since(self, key: str, format: str = 'html') -> Optional[float]:
         return None
+
+    def delete(self, key: str, format: Optional[str] = None) -> int:
+        return 0
+
+    def purge_host(self, host: str) -> int:
+        return 0
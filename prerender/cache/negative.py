@@ -0,0 +1,103 @@
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+from typing import Optional, Dict
+
+
+NEGATIVE_CACHE_MAX_ENTRIES: int = int(os.environ.get('NEGATIVE_CACHE_MAX_ENTRIES', 10000))
+NEGATIVE_CACHE_MAX_TTL: int = int(os.environ.get('NEGATIVE_CACHE_MAX_TTL', 3600))
+NEGATIVE_CACHE_BACKOFF: float = float(os.environ.get('NEGATIVE_CACHE_BACKOFF', 2))
+NEGATIVE_CACHE_TTLS: Dict[str, int] = {
+    'timeout': int(os.environ.get('NEGATIVE_CACHE_TIMEOUT_TTL', 30)),
+    'unavailable': int(os.environ.get('NEGATIVE_CACHE_UNAVAILABLE_TTL', 30)),
+    'redirect': int(os.environ.get('NEGATIVE_CACHE_REDIRECT_TTL', 300)),
+    'not_found': int(os.environ.get('NEGATIVE_CACHE_NOT_FOUND_TTL', 300)),
+    'client_error': int(os.environ.get('NEGATIVE_CACHE_CLIENT_ERROR_TTL', 60)),
+    'server_error': int(os.environ.get('NEGATIVE_CACHE_SERVER_ERROR_TTL', 30)),
+}
+
+
+def outcome_class(status_code: int) -> Optional[str]:
+    if status_code == 504:
+        return 'timeout'
+    if status_code == 503:
+        return 'unavailable'
+    if status_code == 404:
+        return 'not_found'
+    if 300 <= status_code < 400:
+        return 'redirect'
+    if 400 <= status_code < 500:
+        return 'client_error'
+    if status_code >= 500:
+        return 'server_error'
+    return None
+
+
+class NegativeEntry:
+    __slots__ = ('host', 'status_code', 'payload', 'failures', 'expires_at')
+
+    def __init__(self, host: str, status_code: int, payload: Optional[bytes], failures: int,
+                 expires_at: float) -> None:
+        self.host = host
+        self.status_code = status_code
+        self.payload = payload
+        self.failures = failures
+        self.expires_at = expires_at
+
+    @property
+    def ttl(self) -> int:
+        return max(int(self.expires_at - time.time()), 0)
+
+
+class NegativeCache:
+    '''In-memory short-TTL cache of failed renders.
+
+    TTL grows by ``NEGATIVE_CACHE_BACKOFF`` every time the same URL fails again,
+    failure history is forgotten once a URL has not failed for ``NEGATIVE_CACHE_MAX_TTL`` seconds.
+    '''
+
+    def __init__(self, max_entries: int = NEGATIVE_CACHE_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: str, format: str = 'html') -> Optional[NegativeEntry]:
+        entry = self._entries.get(key + format)
+        if entry is None:
+            return
+        now = time.time()
+        if entry.expires_at > now:
+            return entry
+        if entry.expires_at + NEGATIVE_CACHE_MAX_TTL <= now:
+            del self._entries[key + format]
+
+    def set(self, key: str, status_code: int, payload: Optional[bytes] = None, format: str = 'html') -> None:
+        outcome = outcome_class(status_code)
+        ttl = NEGATIVE_CACHE_TTLS.get(outcome, 0)
+        if ttl <= 0:
+            return
+        if outcome not in ('not_found', 'redirect'):
+            payload = None
+
+        previous = self._entries.pop(key + format, None)
+        now = time.time()
+        if previous is not None and previous.expires_at + NEGATIVE_CACHE_MAX_TTL <= now:
+            # Not failed for a while, even though never read since
+            previous = None
+        failures = previous.failures + 1 if previous is not None else 1
+        ttl = min(ttl * NEGATIVE_CACHE_BACKOFF ** (failures - 1), NEGATIVE_CACHE_MAX_TTL)
+        self._entries[key + format] = NegativeEntry(
+            urlparse(key).hostname, status_code, payload, failures, now + ttl
+        )
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str, format: str = 'html') -> None:
+        self._entries.pop(key + format, None)
+
+    def purge_host(self, host: str) -> None:
+        for key in [key for key, entry in self._entries.items() if entry.host == host]:
+            del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,15 +1,17 @@
 import os
 import io
+import gzip
 import asyncio
 from time import mktime
 from urllib.parse import urlparse, quote_plus
-from typing import Optional
+from typing import Optional, Tuple, Dict
 
 import minio
 import urllib3
 import certifi
 
-from .base import CacheBackend
+from ..utils import accepts_encoding
+from .base import CacheBackend, FORMATS, CONTENT_TYPES, ENABLE_CACHE_DEDUP, content_digest
 
 
 S3_SERVER = os.environ.get('S3_SERVER', 's3.amazonaws.com')
@@ -17,9 +19,33 @@ S3_ACCESS_KEY = os.environ.get('S3_ACCESS_KEY')
 S3_SECRET_KEY = os.environ.get('S3_SECRET_KEY')
 S3_REGION = os.environ.get('S3_REGION')
 S3_BUCKET = os.environ.get('S3_BUCKET', 'prerender')
+S3_COMPRESS_FORMATS = [fmt.strip() for fmt in
+                       os.environ.get('S3_COMPRESS_FORMATS', 'html,mhtml').split(',') if fmt.strip()]
+S3_COMPRESS_LEVEL = int(os.environ.get('S3_COMPRESS_LEVEL', 6))
+# Leading bytes of each non-HTML format, objects stored under the HTML key by earlier versions are only
+# served in the format they hold
+_LEGACY_SIGNATURES: Dict[str, Tuple[bytes, ...]] = {
+    'mhtml': (b'From:', b'MIME-Version:'),
+    'pdf': (b'%PDF',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'png': (b'\x89PNG',),
+}
+
+
+def _metadata(headers: Dict, name: str) -> Optional[str]:
+    '''User metadata ``name`` from object headers, minio versions differ in header name case'''
+    name = 'x-amz-meta-' + name
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
 
 
 class S3Cache(CacheBackend):
+    '''S3 cache, with ``ENABLE_CACHE_DEDUP`` objects are empty pointers to payloads stored once
+    under ``_blobs/`` by content hash. Every pointer has a reference marker under ``_refs/<hash>/``
+    and a payload is deleted with its last reference.
+    '''
+
     def __init__(self) -> None:
         http_client = urllib3.PoolManager(
             timeout=urllib3.Timeout.DEFAULT_TIMEOUT,
@@ -42,22 +68,86 @@ class S3Cache(CacheBackend):
         )
 
     async def get(self, key: str, format: str = 'html') -> Optional[bytes]:
+        data, _encoding = await self.get_encoded(key, format)
+        return data
+
+    async def get_encoded(self, key: str, format: str = 'html',
+                          accept_encoding: str = '') -> Tuple[Optional[bytes], Optional[str]]:
         path = self._filename(key, format)
         loop = asyncio.get_event_loop()
         try:
-            res = await loop.run_in_executor(None, self.client.get_object, S3_BUCKET, path)
-        except (minio.error.NoSuchKey, asyncio.CancelledError):
-            return
-        return res.data
+            data, encoding, digest = await loop.run_in_executor(None, self._read, path)
+            if digest:
+                data, encoding, _digest = await loop.run_in_executor(None, self._read, self._blob_path(digest))
+        except minio.error.NoSuchKey:
+            if format == 'html':
+                return None, None
+            try:
+                return await loop.run_in_executor(None, self._read_legacy, key, format), None
+            except (minio.error.NoSuchKey, asyncio.CancelledError):
+                return None, None
+        except asyncio.CancelledError:
+            return None, None
+        if encoding and not accepts_encoding(accept_encoding, encoding):
+            data = await loop.run_in_executor(None, gzip.decompress, data)
+            encoding = None
+        return data, encoding
+
+    def _read(self, path: str) -> Tuple[bytes, Optional[str], Optional[str]]:
+        '''Read object at ``path``, returns its data, encoding and the content hash it points to'''
+        res = self.client.get_object(S3_BUCKET, path)
+        try:
+            # Read whole, the payload is cached, filtered and decompressed in memory afterwards anyway
+            data = res.read()
+            # Objects stored before compression was introduced have no encoding
+            encoding = _metadata(res.headers, 'encoding')
+            digest = _metadata(res.headers, 'blob')
+        finally:
+            res.close()
+            res.release_conn()
+        return data, encoding, digest
+
+    def _read_legacy(self, key: str, format: str) -> Optional[bytes]:
+        '''Object stored by earlier versions under the HTML key of ``key``, when it holds ``format``'''
+        data, encoding, digest = self._read(self._filename(key, 'html'))
+        # Earlier versions stored neither compressed objects nor pointers
+        if encoding or digest or not data.startswith(_LEGACY_SIGNATURES[format]):
+            return None
+        return data
 
     def set(self, key: str, payload: bytes, ttl: int = None, format: str = 'html') -> None:
         path = self._filename(key, format)
+        metadata = {'url': key, 'ttl': ttl}
+        if not ENABLE_CACHE_DEDUP:
+            self._put(path, payload, format, metadata)
+            return
+
+        digest = content_digest(payload)
+        previous = self._pointer(path)
+        blob_path = self._blob_path(digest)
+        try:
+            self.client.stat_object(S3_BUCKET, blob_path)
+        except minio.error.NoSuchKey:
+            self._put(blob_path, payload, format, {'ttl': ttl})
+        self.client.put_object(S3_BUCKET, self._ref_path(digest, path), io.BytesIO(b''), 0)
+        metadata['blob'] = digest
+        self.client.put_object(S3_BUCKET, path, io.BytesIO(b''), 0,
+                               content_type=CONTENT_TYPES.get(format, 'application/octet-stream'), metadata=metadata)
+        if previous and previous != digest:
+            self._unref(previous, path)
+
+    def _put(self, path: str, payload: bytes, format: str, metadata: Dict) -> None:
+        if format in S3_COMPRESS_FORMATS:
+            payload = gzip.compress(payload, S3_COMPRESS_LEVEL)
+            metadata['encoding'] = 'gzip'
+        # Payloads larger than the minimum part size are uploaded by parts from the stream
         self.client.put_object(
             S3_BUCKET,
             path,
             io.BytesIO(payload),
             len(payload),
-            metadata={'url': key, 'ttl': ttl}
+            content_type=CONTENT_TYPES.get(format, 'application/octet-stream'),
+            metadata=metadata
         )
 
     async def modified_since(self, key: str, format: str = 'html') -> Optional[float]:
@@ -65,13 +155,80 @@ class S3Cache(CacheBackend):
         loop = asyncio.get_event_loop()
         try:
             res = await loop.run_in_executor(None, self.client.stat_object, S3_BUCKET, path)
-        except (minio.error.NoSuchKey, asyncio.CancelledError):
+        except minio.error.NoSuchKey:
+            if format == 'html':
+                return
+            # Object found by ``get`` under the legacy key
+            try:
+                res = await loop.run_in_executor(None, self.client.stat_object, S3_BUCKET,
+                                                 self._filename(key, 'html'))
+            except (minio.error.NoSuchKey, asyncio.CancelledError):
+                return
+        except asyncio.CancelledError:
             return
         return mktime(res.last_modified)
 
+    async def etag(self, key: str, format: str = 'html') -> Optional[str]:
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(None, self._pointer, self._filename(key, format))
+        except asyncio.CancelledError:
+            return
+
+    def delete(self, key: str, format: Optional[str] = None) -> int:
+        formats = FORMATS if format is None else (format,)
+        paths = set(self._filename(key, fmt) for fmt in formats)
+        if format is not None and format != 'html':
+            try:
+                if self._read_legacy(key, format) is not None:
+                    paths.add(self._filename(key, 'html'))
+            except minio.error.NoSuchKey:
+                pass
+        for path in paths:
+            self._remove(path)
+        return len(paths)
+
+    def purge_host(self, host: str) -> int:
+        paths = [obj.object_name for obj in self.client.list_objects(S3_BUCKET, prefix=host + '/', recursive=True)]
+        if ENABLE_CACHE_DEDUP:
+            for path in paths:
+                self._remove(path)
+            return len(paths)
+        for error in self.client.remove_objects(S3_BUCKET, paths):
+            raise error
+        return len(paths)
+
+    def _remove(self, path: str) -> None:
+        digest = self._pointer(path) if ENABLE_CACHE_DEDUP else None
+        self.client.remove_object(S3_BUCKET, path)
+        if digest:
+            self._unref(digest, path)
+
+    def _pointer(self, path: str) -> Optional[str]:
+        '''Content hash object at ``path`` points to'''
+        try:
+            res = self.client.stat_object(S3_BUCKET, path)
+        except minio.error.NoSuchKey:
+            return
+        return _metadata(res.metadata or {}, 'blob')
+
+    def _unref(self, digest: str, path: str) -> None:
+        self.client.remove_object(S3_BUCKET, self._ref_path(digest, path))
+        refs = self.client.list_objects(S3_BUCKET, prefix='_refs/{}/'.format(digest), recursive=True)
+        if next(iter(refs), None) is None:
+            self.client.remove_object(S3_BUCKET, self._blob_path(digest))
+
+    def _blob_path(self, digest: str) -> str:
+        return '_blobs/{}/{}'.format(digest[:2], digest)
+
+    def _ref_path(self, digest: str, path: str) -> str:
+        return '_refs/{}/{}'.format(digest, quote_plus(path))
+
     def _filename(self, url, format):
         parsed_url = urlparse(url)
         encoded_name = quote_plus(parsed_url.path)
         if parsed_url.query:
             encoded_name += '?{}'.format(quote_plus(parsed_url.query))
+        if format != 'html':
+            encoded_name += '.{}'.format(format)
         return os.path.join(parsed_url.hostname, encoded_name)
@@ -0,0 +1,216 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from urllib.parse import urlparse
+from typing import List, Optional, Callable, Tuple
+
+from .base import CacheBackend
+from ..metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_WRITE_QUEUE_MAX_BYTES: int = int(os.environ.get('CACHE_WRITE_QUEUE_MAX_BYTES', 256)) * 2 ** 20
+CACHE_WRITE_QUEUE_POLICY: str = os.environ.get('CACHE_WRITE_QUEUE_POLICY', 'drop-oldest')
+CACHE_WRITE_BATCH_SIZE: int = int(os.environ.get('CACHE_WRITE_BATCH_SIZE', 32))
+CACHE_WRITE_UNCHANGED_WINDOW: int = int(os.environ.get('CACHE_WRITE_UNCHANGED_WINDOW', 60))
+CACHE_WRITE_FLUSH_TIMEOUT: float = float(os.environ.get('CACHE_WRITE_FLUSH_TIMEOUT', 30))
+_MAX_RECENT_WRITES = 10000
+
+
+class _Write:
+    __slots__ = ('key', 'format', 'payload', 'ttl', 'digest', 'waiters')
+
+    def __init__(self, key: str, format: str, payload: bytes, ttl: Optional[int], digest: bytes) -> None:
+        self.key = key
+        self.format = format
+        self.payload = payload
+        self.ttl = ttl
+        self.digest = digest
+        self.waiters: List[asyncio.Future] = []
+
+
+class WriteBehindQueue:
+    '''Write renders to ``backend`` in the background, in batches, from a queue bounded in bytes.
+
+    Writes of a key still queued are replaced by newer ones, writes of a payload identical to the one
+    written with the same TTL less than ``CACHE_WRITE_UNCHANGED_WINDOW`` seconds ago are skipped. Once the queue is full
+    ``CACHE_WRITE_QUEUE_POLICY`` decides whether the oldest queued writes are dropped (``drop-oldest``),
+    the new one is dropped (``drop-new``) or the writer waits for room (``block``).
+    '''
+
+    def __init__(self, backend: CacheBackend,
+                 max_bytes: int = CACHE_WRITE_QUEUE_MAX_BYTES,
+                 policy: str = CACHE_WRITE_QUEUE_POLICY,
+                 batch_size: int = CACHE_WRITE_BATCH_SIZE) -> None:
+        if policy not in ('drop-oldest', 'drop-new', 'block'):
+            raise ValueError('Invalid cache write queue policy {!r}'.format(policy))
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.batch_size = max(batch_size, 1)
+        self.on_error: Optional[Callable[[], None]] = None
+        self.size: int = 0
+        self.loop = None
+        self._pending: OrderedDict = OrderedDict()
+        # Digest, TTL and time of recent writes per key, to skip rewriting unchanged payloads
+        self._recent: OrderedDict = OrderedDict()
+        # Writes taken from the queue and being written
+        self._batch: List[_Write] = []
+        self._changed: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Future] = None
+        metrics.gauge('cache_write_queue_bytes', lambda: self.size)
+        metrics.gauge('cache_write_queue_entries', lambda: len(self._pending))
+
+    def start(self, loop) -> None:
+        self.loop = loop
+        self._changed = asyncio.Condition(loop=loop)
+        self._task = asyncio.ensure_future(self._run(), loop=loop)
+
+    async def put(self, key: str, payload: bytes, ttl: Optional[int] = None, format: str = 'html',
+                  wait: bool = False) -> None:
+        '''Queue a write, with ``wait`` return only once it is written, dropped or skipped'''
+        if self._task is None:
+            # Not started, write synchronously like a plain cache
+            self._write_batch([_Write(key, format, payload, ttl, b'')])
+            return
+
+        digest = hashlib.sha1(payload).digest()
+        recent = self._recent.get((key, format))
+        if (recent is not None and recent[:2] == (digest, ttl)
+                and time.time() - recent[2] < CACHE_WRITE_UNCHANGED_WINDOW):
+            metrics.incr('cache_writes_unchanged')
+            return
+
+        write = _Write(key, format, payload, ttl, digest)
+        future = None
+        if wait:
+            future = self.loop.create_future()
+            write.waiters.append(future)
+        async with self._changed:
+            previous = self._pending.pop((key, format), None)
+            if previous is not None:
+                self.size -= len(previous.payload)
+            if not self._make_room(len(payload)):
+                if self.policy != 'block':
+                    metrics.incr('cache_writes_dropped')
+                    if previous is not None:
+                        # Keep the queued write rather than losing both
+                        self._pending[(key, format)] = previous
+                        self.size += len(previous.payload)
+                    self._resolve(write)
+                    return
+                await self._changed.wait_for(lambda: self._make_room(len(payload)))
+            if previous is not None:
+                metrics.incr('cache_writes_coalesced')
+                write.waiters.extend(previous.waiters)
+            newer = self._pending.get((key, format))
+            if newer is not None:
+                # Replaced by a newer write while waiting for room
+                metrics.incr('cache_writes_coalesced')
+                newer.waiters.extend(write.waiters)
+            else:
+                self._pending[(key, format)] = write
+                self.size += len(payload)
+                self._changed.notify_all()
+        if future is not None:
+            await future
+
+    def _make_room(self, nbytes: int) -> bool:
+        if self.size + nbytes <= self.max_bytes or not self._pending:
+            # A single payload larger than the queue is still written
+            return True
+        if self.policy != 'drop-oldest':
+            return False
+        while self._pending and self.size + nbytes > self.max_bytes:
+            _key, dropped = self._pending.popitem(last=False)
+            self.size -= len(dropped.payload)
+            metrics.incr('cache_writes_dropped')
+            self._resolve(dropped)
+        return True
+
+    def _resolve(self, write: _Write) -> None:
+        for future in write.waiters:
+            if not future.done():
+                future.set_result(None)
+
+    async def _run(self) -> None:
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self._pending)
+                batch = []
+                while self._pending and len(batch) < self.batch_size:
+                    batch.append(self._pending.popitem(last=False)[1])
+                self._batch = batch
+            written = False
+            try:
+                written = await self.loop.run_in_executor(None, self._write_batch, batch)
+            finally:
+                async with self._changed:
+                    self.size -= sum(len(write.payload) for write in batch)
+                    if written:
+                        self._remember(batch)
+                    self._batch = []
+                    self._changed.notify_all()
+                for write in batch:
+                    self._resolve(write)
+
+    def _write_batch(self, batch: List[_Write]) -> bool:
+        try:
+            self.backend.set_many([(write.key, write.payload, write.ttl, write.format) for write in batch])
+        except Exception:
+            logger.exception('Error writing cache')
+            if self.on_error is not None:
+                self.on_error()
+            return False
+        metrics.incr('cache_writes', len(batch))
+        metrics.incr('cache_write_batches')
+        return True
+
+    def _remember(self, batch: List[_Write]) -> None:
+        now = time.time()
+        for write in batch:
+            self._recent[(write.key, write.format)] = (write.digest, write.ttl, now)
+            self._recent.move_to_end((write.key, write.format))
+        while len(self._recent) > _MAX_RECENT_WRITES:
+            self._recent.popitem(last=False)
+
+    async def invalidate(self, key: Optional[str] = None, format: Optional[str] = None,
+                         host: Optional[str] = None) -> None:
+        '''Drop queued writes of ``key`` in ``format`` or in every format, or of every key of ``host``.
+
+        Waits for such writes already being written, so that deleting the key from the backend afterwards
+        leaves nothing behind, and forgets their digests so that an identical render is written again.
+        '''
+        def matches(write_key: Tuple[str, str]) -> bool:
+            if host is not None:
+                return urlparse(write_key[0]).hostname == host
+            return write_key[0] == key and (format is None or write_key[1] == format)
+
+        if self._task is not None:
+            async with self._changed:
+                for write_key in [write_key for write_key in self._pending if matches(write_key)]:
+                    write = self._pending.pop(write_key)
+                    self.size -= len(write.payload)
+                    self._resolve(write)
+                self._changed.notify_all()
+                await self._changed.wait_for(
+                    lambda: not any(matches((write.key, write.format)) for write in self._batch))
+        for write_key in [write_key for write_key in self._recent if matches(write_key)]:
+            del self._recent[write_key]
+
+    async def close(self, timeout: float = CACHE_WRITE_FLUSH_TIMEOUT) -> None:
+        '''Flush queued writes, waiting at most ``timeout`` seconds'''
+        if self._task is None:
+            return
+        try:
+            async with self._changed:
+                await asyncio.wait_for(self._changed.wait_for(lambda: not self._pending and not self.size),
+                                       timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Cache write queue not flushed in %.1fs, dropping %d writes', timeout, len(self._pending))
+        self._task.cancel()
+        self._task = None
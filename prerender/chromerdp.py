@@ -1,5 +1,4 @@
 import os
-import math
 import time
 import base64
 import logging
@@ -7,7 +6,7 @@ import inspect
 import asyncio
 from asyncio import Future
 from functools import partial
-from typing import List, Dict, AnyStr, Callable, Optional, Any
+from typing import List, Dict, AnyStr, Callable, Optional, Any, Tuple, Sequence, Set
 
 import ujson as json
 import aiohttp
@@ -15,12 +14,60 @@ import websockets
 from multidict import CIMultiDict
 
 from .mhtml import MHTML
+from .network import NetworkLog, VALIDATORS_FORMAT
+from .httpclient import http_clients
 from .exceptions import TemporaryBrowserFailure, TooManyResponseError
+from .utils import is_yesish
 from .constants import BLOCKED_URLS
 
 
 logger = logging.getLogger(__name__)
 PAGE_DONE_CHECK_TIMEOUT: int = int(os.getenv('PAGE_DONE_CHECK_TIMEOUT', 200))
+# Viewport emulated on every page, 0 keeps the size of the Chrome window
+VIEWPORT_WIDTH: int = int(os.getenv('VIEWPORT_WIDTH', 0))
+VIEWPORT_HEIGHT: int = int(os.getenv('VIEWPORT_HEIGHT', 0))
+# Viewport height while lazy content is loaded, the taller the fewer scroll steps
+LAZY_VIEWPORT_HEIGHT: int = int(os.getenv('LAZY_VIEWPORT_HEIGHT', 5000))
+LAZY_CONTENT_TIMEOUT: float = float(os.getenv('LAZY_CONTENT_TIMEOUT', 10))
+LAZY_MAX_STEPS: int = int(os.getenv('LAZY_MAX_STEPS', 50))
+SCREENSHOT_FULL_PAGE: bool = is_yesish(os.getenv('SCREENSHOT_FULL_PAGE', '0'))
+SCREENSHOT_MAX_HEIGHT: int = int(os.getenv('SCREENSHOT_MAX_HEIGHT', 16384))
+# Formats capturing content below the fold, which is often loaded lazily, screenshots only with the whole page
+LAZY_CONTENT_FORMATS = ('mhtml', 'pdf') + (('jpeg', 'png') if SCREENSHOT_FULL_PAGE else ())
+PAGE_SIZE_JS = ('[Math.max(document.body ? document.body.scrollWidth : 0, document.documentElement.scrollWidth), '
+                'Math.max(document.body ? document.body.scrollHeight : 0, document.documentElement.scrollHeight)]')
+
+LAZY_CONTENT_BINDING = '__prerenderLazyContentLoaded'
+# Injected in every document. Makes ``loading="lazy"`` elements eager and scrolls through the page
+# one viewport per frame so that IntersectionObserver based loaders fire, then reports through the binding.
+LAZY_CONTENT_SCRIPT = '''
+(() => {
+  if (window.__prerenderLoadLazyContent) return;
+  window.__prerenderLoadLazyContent = (maxSteps) => {
+    for (const el of document.querySelectorAll('[loading="lazy"]')) el.setAttribute('loading', 'eager');
+    const pageHeight = () => Math.max(
+      document.body ? document.body.scrollHeight : 0, document.documentElement.scrollHeight);
+    const nextFrame = (callback) => requestAnimationFrame(() => setTimeout(callback, 0));
+    let steps = 0;
+    const step = () => {
+      const y = Math.min(window.scrollY + window.innerHeight, pageHeight());
+      window.scrollTo(0, y);
+      steps++;
+      // Content loaded by the previous steps may have grown the page, keep going until its bottom
+      if (y + window.innerHeight < pageHeight() && steps < maxSteps) {
+        nextFrame(step);
+        return;
+      }
+      nextFrame(() => {
+        window.scrollTo(0, 0);
+        window.%s(JSON.stringify({steps: steps, height: pageHeight()}));
+      });
+    };
+    window.scrollTo(0, 0);
+    nextFrame(step);
+  };
+})();
+''' % LAZY_CONTENT_BINDING
 
 
 class ChromeRemoteDebugger:
@@ -29,6 +76,9 @@ class ChromeRemoteDebugger:
         self._session = aiohttp.ClientSession(loop=loop)
         self.loop = loop
         self.user_agent = user_agent
+        self.endpoint: Tuple[str, int] = (host, port)
+        # False while the Chrome behind this debugger is restarting
+        self.available: bool = True
 
     async def pages(self) -> List[Dict]:
         async with self._session.get('{}/json/list'.format(self._debugger_url)) as res:
@@ -73,9 +123,10 @@ class Page:
         self.id: str = page_info['id']
         self.websocket_debugger_url: str = page_info['webSocketDebuggerUrl']
         self.iteration: int = 0
-        # TODO: detech window height using `Browser.getWindowForTarget` when it is available
-        self._window_height: int = 600
-        self._http = aiohttp.ClientSession(loop=loop)
+        # Set while a replacement page is being opened / once it is ready and this page should be closed
+        self.retiring: bool = False
+        self.retired: bool = False
+        self.metrics: Dict[str, float] = {}
         self._reset()
 
     def _reset(self) -> None:
@@ -86,22 +137,31 @@ class Page:
         self._request_id: int = 0
 
         self._render_future = self.loop.create_future()
+        self._lazy_content_future: Optional[Future] = None
         self._mhtml = MHTML()
 
         self._requests_sent: int = 0
-        self._responses_received: Dict = {}
+        self._network = NetworkLog()
         self._res_body_request_ids: Dict = {}
         self._last_active_time: float = 0
+        # Longest quiet period between two page activities during rendering, in seconds
+        self.max_idle_gap: float = 0
+        self._idle_timeout: int = PAGE_DONE_CHECK_TIMEOUT
         self._url: Optional[str] = None
+        self._render_started_at: Optional[float] = None
         self._intercept_requests: bool = False
         self._proxy: str = ''
 
+    @property
+    def debugger(self) -> ChromeRemoteDebugger:
+        return self._debugger
+
     @property
     def _next_request_id(self) -> int:
         self._request_id += 1
         return self._request_id
 
-    async def attach(self, proxy: str = '') -> None:
+    async def attach(self, proxy: str = '', blocked_urls: Optional[List[str]] = None) -> None:
         logger.debug('Connecting to %s', self.websocket_debugger_url)
         self.websocket = await websockets.connect(
             self.websocket_debugger_url,
@@ -113,10 +173,11 @@ class Page:
         self.on('Inspector.detached', self._on_inspector_detached)
         self.on('Inspector.targetCrashed', self._on_inspector_target_crashed)
         self.on('Log.entryAdded', self._on_log_entry_added)
+        self.on('Runtime.bindingCalled', self._on_binding_called)
         self.on('Network.requestWillBeSent', self._on_request_will_be_sent)
         self.on('Network.responseReceived', self._on_response_received)
         self.on('Network.loadingFailed', self._on_response_received)
-        self.on('Network.requestIntercepted', self._on_request_intercepted)
+        self.on('Fetch.requestPaused', self._on_request_paused)
 
         self.on('Network.dataReceived', self._update_last_active_time)
         self.on('Network.resourceChangedPriority', self._update_last_active_time)
@@ -140,8 +201,10 @@ class Page:
         await asyncio.wait_for(self._enable_events(), timeout=5)
         if self.user_agent is not None:
             await self.set_user_agent(self.user_agent)
-        await self.set_blocked_urls(BLOCKED_URLS)
+        await self.set_blocked_urls(BLOCKED_URLS if blocked_urls is None else blocked_urls)
         await self.set_request_interception(bool(proxy))
+        await self._install_lazy_content_script()
+        await self.set_viewport()
 
     async def detach(self) -> None:
         self._ws_task.cancel()
@@ -216,16 +279,40 @@ class Page:
             'params': {'urls': urls}
         })
 
+    async def set_viewport(self, width: int = VIEWPORT_WIDTH, height: int = VIEWPORT_HEIGHT) -> None:
+        '''Emulate a ``width`` x ``height`` viewport, 0 keeps the size of the Chrome window'''
+        if width or height:
+            command = {
+                'method': 'Emulation.setDeviceMetricsOverride',
+                'params': {'width': width, 'height': height, 'deviceScaleFactor': 0, 'mobile': False},
+            }
+        else:
+            command = {'method': 'Emulation.clearDeviceMetricsOverride'}
+        await (await self.send(command))
+
+    async def _install_lazy_content_script(self) -> None:
+        futures = await asyncio.gather(
+            self.send({
+                'method': 'Page.addScriptToEvaluateOnNewDocument',
+                'params': {'source': LAZY_CONTENT_SCRIPT},
+            }),
+            self.send({
+                'method': 'Runtime.addBinding',
+                'params': {'name': LAZY_CONTENT_BINDING},
+            }),
+        )
+        await asyncio.gather(*futures)
+
     async def set_request_interception(self, enable: bool = True) -> None:
         if enable == self._intercept_requests:
             return
         self._intercept_requests = enable
-        patterns = [{'urlPattern': '*'}] if enable else []
+        if enable:
+            intercept = {'method': 'Fetch.enable', 'params': {'patterns': [{'urlPattern': '*'}]}}
+        else:
+            intercept = {'method': 'Fetch.disable'}
         futures = await asyncio.gather(
-            self.send({
-                'method': 'Network.setRequestInterception',
-                'params': {'patterns': patterns}
-            }),
+            self.send(intercept),
             self.send({
                 'method': 'Network.setCacheDisabled',
                 'params': {'cacheDisabled': enable}
@@ -243,6 +330,20 @@ class Page:
         })
         return await future
 
+    async def get_metrics(self) -> Dict[str, float]:
+        futures = await asyncio.gather(
+            self.send({'method': 'Performance.enable'}),
+            self.send({'method': 'Performance.getMetrics'}),
+        )
+        _enabled, obj = await asyncio.gather(*futures)
+        await (await self.send({'method': 'Performance.disable'}))
+        self.metrics = {item['name']: item['value'] for item in obj['result']['metrics']}
+        return self.metrics
+
+    async def stop_loading(self) -> Dict:
+        future = await self.send({'method': 'Page.stopLoading'})
+        return await future
+
     async def evaluate(self, expr: str) -> Dict:
         future = await self.send({
             'method': 'Runtime.evaluate',
@@ -260,9 +361,10 @@ class Page:
     async def _wait_responses_ready(self) -> None:
         iterations = 0
         while True:
-            if self._requests_sent > 0 and len(self._responses_received) >= self._requests_sent \
+            if self._requests_sent > 0 \
+                    and len(self._network) + self._network.expired_timeboxed(time.time()) >= self._requests_sent \
                     and len(self._res_body_request_ids) == 0 \
-                    and (time.time() - self._last_active_time) * 1000 >= PAGE_DONE_CHECK_TIMEOUT:
+                    and (time.time() - self._last_active_time) * 1000 >= self._idle_timeout:
                 iterations += 1
                 # Prefer window.prerenderReady
                 res = await self.evaluate('typeof window.prerenderReady === "undefined"')
@@ -274,12 +376,7 @@ class Page:
             # Wait pending browser rendering for a while
             await asyncio.sleep(0.1)
 
-        succeed_res = sum([
-            1 if is_response_ok(resp.get('response')) or resp.get('blockedReason') == 'inspector' else 0
-            for resp in self._responses_received.values()
-        ])
-        success_rate = succeed_res / len(self._responses_received)
-        if success_rate < 0.8:
+        if self._network.success_rate() < 0.8:
             raise TooManyResponseError
 
     async def _listen(self) -> None:
@@ -299,55 +396,88 @@ class Page:
             for task in tasks:
                 task.cancel()
 
-    async def render(self, url: str, format: str = 'html') -> AnyStr:
-        self.on('Page.loadEventFired', partial(self._on_page_load_event_fired, format=format))
-        self.on('Network.loadingFinished', partial(self._on_loading_finished, format=format))
+    def host_activity(self) -> Dict[str, Tuple[float, Set[str]]]:
+        '''Time of the last response and resource types of every host requested, pending requests count as now'''
+        return self._network.host_activity(time.time())
+
+    async def render(self, url: str, format: str = 'html', idle_timeout: Optional[int] = None) -> Tuple[AnyStr, int]:
+        outputs, status_code = await self.render_many(url, (format,), idle_timeout)
+        return outputs[format], status_code
+
+    async def render_many(self, url: str, formats: Sequence[str] = ('html',),
+                          idle_timeout: Optional[int] = None, timeboxed_hosts: Optional[Set[str]] = None,
+                          timebox: float = 0) -> Tuple[Dict[str, AnyStr], int]:
+        '''Navigate to ``url`` once and capture it in every one of ``formats`` when ready.
+
+        Readiness does not wait more than ``timebox`` milliseconds for requests to ``timeboxed_hosts``.
+        '''
+        self.on('Page.loadEventFired', partial(self._on_page_load_event_fired, formats=formats))
+        self.on('Network.loadingFinished', partial(self._on_loading_finished, formats=formats))
         try:
             self._url = url
+            self._render_started_at = time.time()
+            if idle_timeout is not None:
+                self._idle_timeout = idle_timeout
+            self._network = NetworkLog(timeboxed_hosts or (), timebox)
             await self.navigate(url)
             return await self._render_future
         finally:
             self._url = None
+            self._render_started_at = None
             self._callbacks.clear()
             self._futures.clear()
             await self._disable_events()
 
-    def _update_last_active_time(self, _obj: Dict) -> None:
-        self._last_active_time = time.time()
+    def _update_last_active_time(self, _obj: Optional[Dict] = None) -> None:
+        now = time.time()
+        if self._last_active_time:
+            self.max_idle_gap = max(self.max_idle_gap, now - self._last_active_time)
+        self._last_active_time = now
 
-    async def _on_request_intercepted(self, obj: Dict) -> None:
+    async def _on_request_paused(self, obj: Dict) -> None:
+        '''Fetch requests of proxied renders through the proxy with the shared HTTP client'''
+        request_id = obj['params']['requestId']
         resource_type = obj['params']['resourceType'].lower()
-        if resource_type in ('document', 'xhr', 'image', 'script', 'fetch'):
-            request = obj['params']['request']
-            method = request['method']
-            url = request['url']
-            headers = request['headers']
-            kwargs = {'headers': headers}
-            post_data = request.get('postData')
-            if post_data:
-                kwargs['data'] = post_data
-            resp = await self._http.request(method, url, **kwargs)
-            raw_resp = await create_raw_response(resp)
-            await self.send({
-                'method': 'Network.continueInterceptedRequest',
-                'params': {
-                    'interceptionId': obj['params']['interceptionId'],
-                    'rawResponse': raw_resp,
-                }
-            })
-        else:
+        if resource_type not in ('document', 'xhr', 'image', 'script', 'fetch'):
+            await self.send({'method': 'Fetch.continueRequest', 'params': {'requestId': request_id}})
+            return
+
+        request = obj['params']['request']
+        kwargs = {'headers': request['headers']}
+        post_data = request.get('postData')
+        if post_data:
+            kwargs['data'] = post_data
+        try:
+            status, reason, headers, body = await http_clients.fetch_base64(
+                request['method'], request['url'], self._proxy, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning('Fetching %s through proxy %s failed: %r', request['url'], self._proxy, e)
             await self.send({
-                'method': 'Network.continueInterceptedRequest',
-                'params': {'interceptionId': obj['params']['interceptionId']}
+                'method': 'Fetch.failRequest',
+                'params': {'requestId': request_id,
+                           'errorReason': 'TimedOut' if isinstance(e, asyncio.TimeoutError) else 'Failed'}
             })
+            return
+        await self.send({
+            'method': 'Fetch.fulfillRequest',
+            'params': {
+                'requestId': request_id,
+                'responseCode': status,
+                'responsePhrase': reason,
+                'responseHeaders': headers,
+                'body': body,
+            }
+        })
 
     def _on_request_will_be_sent(self, obj: Dict) -> None:
         document_url = obj['params']['documentURL']
         redirect = obj['params'].get('redirectResponse')
         if not redirect and document_url[len(self._url):] == '/':
             redirect = {'url': self._url, 'headers': {'location': document_url}}
-        self._last_active_time = time.time()
-        if not redirect and document_url == self._url:
+        self._update_last_active_time()
+        counted = not redirect and document_url == self._url
+        self._network.request_will_be_sent(obj['params'], self._last_active_time, timeboxed=counted)
+        if counted:
             self._requests_sent += 1
         elif not redirect and document_url != self._url and self._requests_sent == 0:
             # https://www.baidu.com Chrome navigate to https://www.baidu.com/
@@ -358,14 +488,13 @@ class Page:
                 self._url = CIMultiDict(redirect['headers'])['location']
 
     def _on_response_received(self, obj: Dict) -> None:
-        self._responses_received[obj['params']['requestId']] = obj['params']
-        self._last_active_time = time.time()
+        self._update_last_active_time()
+        request = self._network.response_received(obj['params'], self._last_active_time, self._url)
         logger.debug('Requests sent: %d, responses received: %d',
-                     self._requests_sent, len(self._responses_received))
+                     self._requests_sent, len(self._network))
 
-        resp = obj['params'].get('response')
-        if resp and not is_response_ok(resp):
-            logger.warning('%s got status code %d', resp['url'], resp['status'])
+        if request.status is not None and request.status >= 400:
+            logger.warning('%s got status code %d', request.url, request.status)
 
     def _on_inspector_detached(self, obj: Dict) -> None:
         # Chrome page destroyed
@@ -377,7 +506,7 @@ class Page:
 
     def _on_log_entry_added(self, obj: Dict) -> None:
         # Log browser console logs for debugging
-        self._last_active_time = time.time()
+        self._update_last_active_time()
         entry = obj['params']['entry']
         log_func = getattr(logger, entry['level'], None)
         if log_func:
@@ -390,14 +519,14 @@ class Page:
                      entry['level'],
                      entry['text'])
 
-    async def _on_loading_finished(self, obj: Dict, *, format: str) -> None:
-        self._last_active_time = time.time()
-        if format == 'mhtml':
+    async def _on_loading_finished(self, obj: Dict, *, formats: Sequence[str]) -> None:
+        self._update_last_active_time()
+        if 'mhtml' in formats:
             await self.get_response_body(obj['params']['requestId'])
 
-    async def _on_page_load_event_fired(self, obj: Dict, *, format: str) -> None:
-        if format in ('mhtml', 'pdf'):
-            await self._scroll_to_bottom()
+    async def _on_page_load_event_fired(self, obj: Dict, *, formats: Sequence[str]) -> None:
+        if any(format in LAZY_CONTENT_FORMATS for format in formats):
+            await self._load_lazy_content()
 
         done, pending = await asyncio.wait([
             self._evaluate_prerender_ready(),
@@ -408,28 +537,69 @@ class Page:
         for task in done:
             task.result()  # To trigger exception if any
 
+        result = await self.capture_many(formats)
+        self._render_future.set_result(result)
+
+    async def capture(self, format: str = 'html') -> Tuple[AnyStr, int]:
+        '''Capture the page in its current state, ready or not'''
+        outputs, status_code = await self.capture_many((format,))
+        return outputs[format], status_code
+
+    async def capture_many(self, formats: Sequence[str] = ('html',)) -> Tuple[Dict[str, AnyStr], int]:
+        '''Capture the page in its current state in every one of ``formats``'''
         status_code = await self.get_status_code()
         if status_code == 304:
             status_code = 200
-        if format == 'html':
-            html = await self.get_html()
-            self._render_future.set_result((html, status_code))
-        elif format == 'mhtml':
-            self._render_future.set_result((bytes(self._mhtml), status_code))
-        elif format == 'pdf':
-            data = await self.print_to_pdf()
-            self._render_future.set_result((data, status_code))
-        elif format == 'jpeg' or format == 'png':
-            data = await self.screenshot(format)
-            self._render_future.set_result((data, status_code))
-
-    async def _scroll_to_bottom(self) -> None:
-        # scroll to bottom to ensure images loaded
-        height = await self.get_page_height()
-        for i in range(math.ceil(height / self._window_height)):
-            scroll_y = min(self._window_height * (i + 1), height)
-            await self.evaluate('window.scrollTo(0, {})'.format(scroll_y))
-            await asyncio.sleep(0.01)
+        outputs = {}
+        for format in formats:
+            if format == 'html':
+                outputs[format] = await self.get_html()
+            elif format == 'mhtml':
+                outputs[format] = bytes(self._mhtml)
+            elif format == 'pdf':
+                outputs[format] = await self.print_to_pdf()
+            elif format == 'jpeg' or format == 'png':
+                outputs[format] = await self.screenshot(format)
+            elif format == VALIDATORS_FORMAT:
+                outputs[format] = self._network.document_validators(self._url)
+            else:
+                raise ValueError('invalid format {}'.format(format))
+        return outputs, status_code
+
+    def _on_binding_called(self, obj: Dict) -> None:
+        future = self._lazy_content_future
+        if obj['params']['name'] == LAZY_CONTENT_BINDING and future is not None and not future.done():
+            future.set_result(json.loads(obj['params']['payload']))
+
+    async def _load_lazy_content(self) -> None:
+        '''Load content below the fold, scrolled through by the injected script in a tall viewport'''
+        self._lazy_content_future = self.loop.create_future()
+        start_time = time.time()
+        # Runtime events, the binding call among them, only while lazy content loads: every console call
+        # and execution context would be an event otherwise
+        await (await self.send({'method': 'Runtime.enable'}))
+        await self.set_viewport(VIEWPORT_WIDTH, LAZY_VIEWPORT_HEIGHT)
+        try:
+            # The script guards against being run twice, it is only missing from documents
+            # loaded before it was injected
+            res = await self.evaluate('{}; window.__prerenderLoadLazyContent({})'.format(
+                LAZY_CONTENT_SCRIPT, LAZY_MAX_STEPS))
+            if 'exceptionDetails' in res['result']:
+                logger.warning('Loading lazy content of %s failed: %s', self._url,
+                               res['result']['exceptionDetails'].get('text'))
+                return
+            try:
+                result = await asyncio.wait_for(asyncio.shield(self._lazy_content_future),
+                                                timeout=LAZY_CONTENT_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning('Loading lazy content of %s timed out after %.1fs', self._url, LAZY_CONTENT_TIMEOUT)
+                return
+            logger.debug('Loaded lazy content of %s in %d steps in %dms, page height %dpx', self._url,
+                         result['steps'], int((time.time() - start_time) * 1000), result['height'])
+        finally:
+            self._lazy_content_future = None
+            await self.set_viewport()
+            await (await self.send({'method': 'Runtime.disable'}))
 
     async def get_html(self) -> str:
         future = await self.send({
@@ -459,9 +629,9 @@ class Page:
         if body is not None:
             base64_encoded = obj['result']['base64Encoded']
             request_id = self._res_body_request_ids[req_id]
-            response = self._responses_received[request_id]['response']
+            request = self._network.requests[request_id]
             encoding = 'base64-encoded' if base64_encoded else 'quoted-printable'
-            self._mhtml.add(response['url'], response['mimeType'], body, encoding)
+            self._mhtml.add(request.url, request.mime_type, body, encoding)
         self._res_body_request_ids.pop(req_id)
 
     async def print_to_pdf(self) -> bytes:
@@ -472,68 +642,56 @@ class Page:
         data = base64.b64decode(obj['result']['data'])
         return data
 
-    async def screenshot(self, format: str = 'png') -> bytes:
+    async def screenshot(self, format: str = 'png', full_page: bool = SCREENSHOT_FULL_PAGE) -> bytes:
+        params = {'format': format, 'fromSurface': True}
+        if full_page:
+            future = await self.send({
+                'method': 'Runtime.evaluate',
+                'params': {'expression': PAGE_SIZE_JS, 'returnByValue': True}
+            })
+            width, height = (await future)['result']['result']['value']
+            params.update({
+                'captureBeyondViewport': True,
+                'clip': {'x': 0, 'y': 0, 'width': width, 'height': min(height, SCREENSHOT_MAX_HEIGHT), 'scale': 1},
+            })
         future = await self.send({
             'method': 'Page.captureScreenshot',
-            'params': {'format': format, 'fromSurface': True}
+            'params': params,
         })
         obj = await future
         data = base64.b64decode(obj['result']['data'])
         return data
 
-    async def get_page_height(self) -> int:
-        js = ('Math.max(document.body.scrollHeight, document.body.offsetHeight, '
-              'document.documentElement.clientHeight, document.documentElement.scrollHeight, '
-              'document.documentElement.offsetHeight)')
-        res = await self.evaluate(js)
-        return res['result']['result']['value']
-
     async def close(self) -> None:
-        await self._http.close()
         await self._debugger.close_page(self.id)
 
     async def get_status_code(self) -> int:
         res = await self.evaluate('window.prerenderStatusCode')
         status = res['result']['result'].get('value')
         if status is None or status == 'undefined':
-            for item in tuple(self._responses_received.values()):
-                res = item.get('response')
-                if not res:
-                    await asyncio.sleep(0)  # Let others run
-                    continue
-                if res['url'] == self._url:
-                    return res['status']
-            return 200
+            status_code = self._network.document_status(self._url)
+            return status_code if status_code is not None else 200
         try:
             return int(status)
         except (TypeError, ValueError):
             return 200
 
+    def to_dict(self) -> Dict:
+        '''State of the page for diagnostics, ``url`` and ``elapsed`` are ``None`` unless it is rendering'''
+        started_at = self._render_started_at
+        return {
+            'id': self.id,
+            'url': self._url,
+            'elapsed': round(time.time() - started_at, 3) if started_at is not None else None,
+            'iteration': self.iteration,
+            'requests': len(self._network),
+            'max_idle_gap': round(self.max_idle_gap, 3),
+            'retiring': self.retiring,
+            'retired': self.retired,
+        }
+
     def __repr__(self) -> str:
         return '<Page #{}>'.format(self.id)
 
     def __hash__(self) -> int:
         return hash(repr(self))
-
-
-def is_response_ok(response):
-    if not response:
-        return False
-    status = response['status']
-    return status < 400
-
-
-async def create_raw_response(resp) -> str:
-    import base64
-
-    body = await resp.read()
-    raw_resp = []
-    CRLF = '\r\n'
-    status_line = f'HTTP 1.1 {resp.status} {resp.reason}{CRLF}'
-    raw_resp.append(status_line.encode('utf-8'))
-    for (name, value) in resp.raw_headers:
-        raw_resp.append(f'{name}: {value}{CRLF}'.encode('utf-8'))
-    raw_resp.append(CRLF.encode('utf-8'))
-    raw_resp.append(body)
-    raw_buf = b''.join(raw_resp)
-    return base64.b64encode(raw_buf).decode('ascii')
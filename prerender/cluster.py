@@ -0,0 +1,184 @@
+import os
+import time
+import bisect
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from urllib.parse import urlparse, urlunparse
+from typing import List, Dict, Tuple, Optional
+
+from .metrics import metrics
+from .httpclient import http_clients
+
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_PEERS: List[str] = [peer.strip().rstrip('/') for peer in
+                            os.environ.get('CLUSTER_PEERS', '').split(',') if peer.strip()]
+CLUSTER_SELF: str = os.environ.get('CLUSTER_SELF', '').strip().rstrip('/')
+CLUSTER_VIRTUAL_NODES: int = int(os.environ.get('CLUSTER_VIRTUAL_NODES', 100))
+CLUSTER_FORWARD_TIMEOUT: float = float(os.environ.get('CLUSTER_FORWARD_TIMEOUT', 40))
+CLUSTER_HOT_CACHE_SIZE: int = int(os.environ.get('CLUSTER_HOT_CACHE_SIZE', 100))
+CLUSTER_HOT_CACHE_TTL: int = int(os.environ.get('CLUSTER_HOT_CACHE_TTL', 60))
+# Set on requests forwarded to the owner node, which renders them itself instead of forwarding again
+FORWARDED_HEADER: str = 'X-Prerender-Forwarded'
+
+
+def canonical_url(url: str) -> str:
+    '''URL used to pick the owner node, scheme and host are case insensitive and fragments never reach servers'''
+    parsed = urlparse(url)
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path or '/',
+                       parsed.params, parsed.query, ''))
+
+
+def _hash(value: str) -> int:
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing:
+    '''Consistent hash ring, adding or removing a node only moves the keys of that node'''
+
+    def __init__(self, nodes: List[str], virtual_nodes: int = CLUSTER_VIRTUAL_NODES) -> None:
+        self.nodes = list(nodes)
+        points = sorted((_hash('{}#{}'.format(node, i)), node) for node in nodes for i in range(virtual_nodes))
+        self._hashes = [point for point, _node in points]
+        self._nodes = [node for _point, node in points]
+
+    def get_node(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class HotEntry:
+    __slots__ = ('status', 'body', 'content_type', 'headers', 'expires_at')
+
+    def __init__(self, status: int, body: bytes, content_type: str, headers: Dict[str, str],
+                 expires_at: float) -> None:
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers
+        self.expires_at = expires_at
+
+
+class Cluster:
+    '''Forward cache misses to the node owning the URL, so that every URL is rendered and cached on one node.
+
+    Responses from owners are kept in a small in-memory hot cache for ``CLUSTER_HOT_CACHE_TTL`` seconds.
+    '''
+
+    def __init__(self, peers: List[str] = CLUSTER_PEERS, me: str = CLUSTER_SELF) -> None:
+        if me not in peers:
+            raise ValueError('CLUSTER_SELF {!r} is not one of CLUSTER_PEERS'.format(me))
+        self.me = me
+        self.ring = HashRing(peers)
+        self._hot: OrderedDict = OrderedDict()
+
+    def owner(self, url: str) -> str:
+        return self.ring.get_node(canonical_url(url))
+
+    def is_owner(self, url: str) -> bool:
+        return self.owner(url) == self.me
+
+    def should_forward(self, url: str, headers: Dict[str, str]) -> bool:
+        '''Whether a request for ``url`` with ``headers`` goes to another node.
+
+        Requests already forwarded by a peer are always handled here, even when nodes disagree on the owner
+        because their ``CLUSTER_PEERS`` differ, so that requests never bounce between nodes.
+        '''
+        return not headers.get(FORWARDED_HEADER) and not self.is_owner(url)
+
+    def get_hot(self, url: str, format: str) -> Optional[HotEntry]:
+        key = (canonical_url(url), format)
+        entry = self._hot.get(key)
+        if entry is None:
+            return
+        if entry.expires_at <= time.time():
+            del self._hot[key]
+            return
+        self._hot.move_to_end(key)
+        return entry
+
+    def _set_hot(self, url: str, format: str, entry: HotEntry) -> None:
+        if CLUSTER_HOT_CACHE_SIZE <= 0:
+            return
+        key = (canonical_url(url), format)
+        self._hot.pop(key, None)
+        self._hot[key] = entry
+        while len(self._hot) > CLUSTER_HOT_CACHE_SIZE:
+            self._hot.popitem(last=False)
+
+    def invalidate_hot(self, url: Optional[str] = None, format: Optional[str] = None,
+                       host: Optional[str] = None) -> int:
+        '''Drop hot entries of ``url`` in ``format`` or in every format, or of every URL of ``host``'''
+        if host:
+            host = host.lower()
+            keys = [key for key in self._hot if urlparse(key[0]).hostname == host]
+        else:
+            canonical = canonical_url(url)
+            keys = [key for key in self._hot if key[0] == canonical and (format is None or key[1] == format)]
+        for key in keys:
+            del self._hot[key]
+        return len(keys)
+
+    async def purge_peers(self, url: Optional[str] = None, format: Optional[str] = None,
+                          host: Optional[str] = None) -> int:
+        '''Purge ``url`` or ``host`` on every other node, returns the number of cache entries they deleted.
+
+        Every node may hold hot entries of any URL, and renders of URLs whose owner was unreachable,
+        so purges go to all peers rather than to the owner only.
+        '''
+        params = {name: value for name, value in (('url', url), ('format', format), ('host', host)) if value}
+        peers = [peer for peer in self.ring.nodes if peer != self.me]
+        results = await asyncio.gather(*[self._purge_peer(peer, params) for peer in peers], return_exceptions=True)
+        deleted = 0
+        for peer, result in zip(peers, results):
+            if isinstance(result, Exception):
+                logger.warning('Purging %s on peer %s failed: %r', host or url, peer, result)
+                metrics.incr('cluster_purge_failures')
+            else:
+                deleted += result
+        return deleted
+
+    async def _purge_peer(self, peer: str, params: Dict[str, str]) -> int:
+        async with http_clients.peers().delete('{}/cache'.format(peer), params=params,
+                                               headers={FORWARDED_HEADER: self.me},
+                                               timeout=CLUSTER_FORWARD_TIMEOUT) as res:
+            res.raise_for_status()
+            return (await res.json()).get('deleted', 0)
+
+    async def forward(self, url: str, format: str, method: str = 'GET',
+                      headers: Optional[Dict[str, str]] = None) -> Tuple[str, HotEntry]:
+        '''Fetch ``url`` rendered as ``format`` from its owner node'''
+        owner = self.owner(url)
+        headers = dict(headers or {})
+        headers[FORWARDED_HEADER] = self.me
+        start_time = time.time()
+        async with http_clients.peers().request(method, '{}/{}/{}'.format(owner, format, url),
+                                                headers=headers, timeout=CLUSTER_FORWARD_TIMEOUT,
+                                                allow_redirects=False) as res:
+            body = await res.read()
+            entry = HotEntry(
+                res.status,
+                body,
+                res.headers.get('Content-Type', 'application/octet-stream'),
+                {name: value for name, value in res.headers.items()
+                 if name in ('Last-Modified', 'Retry-After') or name.startswith('X-Prerender-')},
+                time.time() + CLUSTER_HOT_CACHE_TTL,
+            )
+        metrics.incr('cluster_forwards')
+        logger.info('Got %d for %s from peer %s in %dms',
+                    res.status, url, owner, int((time.time() - start_time) * 1000))
+        if res.status == 200 and method == 'GET':
+            self._set_hot(url, format, entry)
+        return owner, entry
+
+    def to_dict(self) -> Dict:
+        return {
+            'self': self.me,
+            'peers': self.ring.nodes,
+            'hot_entries': len(self._hot),
+        }
@@ -9,3 +9,7 @@ class TemporaryBrowserFailure(PrerenderException):
 
 class TooManyResponseError(PrerenderException):
     pass
+
+
+class ClientDisconnected(PrerenderException):
+    pass
@@ -0,0 +1,120 @@
+import os
+import base64
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiohttp
+
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_SIZE: int = int(os.environ.get('HTTP_POOL_SIZE', 100))
+HTTP_POOL_SIZE_PER_HOST: int = int(os.environ.get('HTTP_POOL_SIZE_PER_HOST', 8))
+HTTP_DNS_CACHE_TTL: int = int(os.environ.get('HTTP_DNS_CACHE_TTL', 300))
+HTTP_KEEPALIVE_TIMEOUT: float = float(os.environ.get('HTTP_KEEPALIVE_TIMEOUT', 30))
+HTTP_CONNECT_TIMEOUT: float = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT: float = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+# Sessions of distinct proxies kept open, the least recently used one is closed beyond that
+HTTP_MAX_PROXY_SESSIONS: int = int(os.environ.get('HTTP_MAX_PROXY_SESSIONS', 32))
+# Concurrent requests forwarded to each cluster peer, each one waits for a whole render
+HTTP_PEER_POOL_SIZE_PER_HOST: int = int(os.environ.get('HTTP_PEER_POOL_SIZE_PER_HOST', 256))
+# Seconds requests still using the session of an evicted proxy have to finish before it is closed
+_EVICTED_SESSION_GRACE = 60
+# Multiple of 3 so that chunks are base64 encoded independently
+_STREAM_CHUNK_SIZE = 3 * 2 ** 16
+# Headers describing the body as received, not as decoded by aiohttp
+_HOP_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive')
+
+
+class HttpClients:
+    '''Pooled HTTP client sessions shared by the whole process, one per proxy.
+
+    Connections are kept alive and reused across pages and renders, with at most
+    ``HTTP_POOL_SIZE_PER_HOST`` of them per host and DNS lookups cached for ``HTTP_DNS_CACHE_TTL`` seconds.
+    At most ``HTTP_MAX_PROXY_SESSIONS`` proxies have a session at once. Cluster peers have a session of their
+    own so that forwarded renders neither compete with origin requests nor are bounded by their per host limit.
+    '''
+
+    def __init__(self, loop=None) -> None:
+        self.loop = loop
+        self._sessions: OrderedDict = OrderedDict()
+        self._peer_session: Optional[aiohttp.ClientSession] = None
+        self._evicted: Set[aiohttp.ClientSession] = set()
+
+    def _new_session(self, limit: int, limit_per_host: int, read_timeout: Optional[float]) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            loop=self.loop,
+        )
+        timeout = aiohttp.ClientTimeout(connect=HTTP_CONNECT_TIMEOUT, sock_read=read_timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, loop=self.loop)
+
+    def get(self, proxy: str = '') -> aiohttp.ClientSession:
+        '''Session for requests made through ``proxy``, empty for direct requests'''
+        session = self._sessions.get(proxy)
+        if session is None or session.closed:
+            session = self._sessions[proxy] = self._new_session(HTTP_POOL_SIZE, HTTP_POOL_SIZE_PER_HOST,
+                                                                HTTP_READ_TIMEOUT)
+        self._sessions.move_to_end(proxy)
+        proxies = [key for key in self._sessions if key]
+        for key in proxies[:max(len(proxies) - HTTP_MAX_PROXY_SESSIONS, 0)]:
+            self._evict(self._sessions.pop(key))
+        return session
+
+    def peers(self) -> aiohttp.ClientSession:
+        '''Session for requests forwarded to cluster peers, timed out by the caller as renders vary in length'''
+        if self._peer_session is None or self._peer_session.closed:
+            self._peer_session = self._new_session(0, HTTP_PEER_POOL_SIZE_PER_HOST, None)
+        return self._peer_session
+
+    def _evict(self, session: aiohttp.ClientSession) -> None:
+        self._evicted.add(session)
+
+        async def _close() -> None:
+            await asyncio.sleep(_EVICTED_SESSION_GRACE)
+            self._evicted.discard(session)
+            if not session.closed:
+                await session.close()
+
+        asyncio.ensure_future(_close(), loop=self.loop)
+
+    async def fetch_base64(self, method: str, url: str, proxy: str = '',
+                           **kwargs) -> Tuple[int, str, List[Dict[str, str]], str]:
+        '''Request ``url``, returns status code, reason, headers and the base64 encoded body.
+
+        The body is encoded as it is streamed in, the raw body is never buffered whole.
+        '''
+        async with self.get(proxy).request(method, url, proxy=proxy or None, allow_redirects=False,
+                                           **kwargs) as res:
+            chunks = []
+            pending = b''
+            async for data in res.content.iter_chunked(_STREAM_CHUNK_SIZE):
+                pending += data
+                size = len(pending) - len(pending) % 3
+                if size:
+                    chunks.append(base64.b64encode(pending[:size]).decode('ascii'))
+                    pending = pending[size:]
+            chunks.append(base64.b64encode(pending).decode('ascii'))
+            headers = [{'name': name.decode('latin-1'), 'value': value.decode('latin-1')}
+                       for name, value in res.raw_headers if name.decode('latin-1').lower() not in _HOP_HEADERS]
+            return res.status, res.reason or '', headers, ''.join(chunks)
+
+    async def close(self) -> None:
+        sessions = list(self._sessions.values()) + list(self._evicted)
+        if self._peer_session is not None:
+            sessions.append(self._peer_session)
+        self._sessions.clear()
+        self._evicted.clear()
+        self._peer_session = None
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+
+
+http_clients = HttpClients()
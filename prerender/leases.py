@@ -0,0 +1,165 @@
+import os
+import glob
+import time
+import fcntl
+import random
+import asyncio
+import hashlib
+import logging
+from typing import Hashable, Optional, Tuple
+
+from .utils import is_yesish
+
+
+logger = logging.getLogger(__name__)
+
+ENABLE_WORKER_COORDINATION: bool = is_yesish(os.environ.get('ENABLE_WORKER_COORDINATION', '0'))
+WORKER_LOCK_DIR: str = os.environ.get(
+    'WORKER_LOCK_DIR',
+    os.path.join(os.environ.get('CACHE_ROOT_DIR', '/tmp/prerender'), 'locks')
+)
+LEASE_POLL_INTERVAL: float = float(os.environ.get('LEASE_POLL_INTERVAL', 0.05))
+RENDER_LOCK_TIMEOUT: float = float(os.environ.get('RENDER_LOCK_TIMEOUT', 60))
+# Worker processes expected to share Chrome, live workers are counted when more of them are running.
+# Defaults to gunicorn's ``WEB_CONCURRENCY`` so that workers starting together size their pools right away.
+WORKER_COUNT: int = int(os.environ.get('WORKER_COUNT', os.environ.get('WEB_CONCURRENCY', 1)))
+
+
+class FileLock:
+    '''Non-blocking exclusive ``flock`` on ``path``, released by the kernel when the process dies'''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    self._fd = fd
+                    return True
+            except FileNotFoundError:
+                pass
+            # Previous holder unlinked the file after we opened it, lock the new one instead
+            os.close(fd)
+
+    def release(self, unlink: bool = False) -> None:
+        if self._fd is None:
+            return
+        if unlink:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+class PageLeases:
+    '''Render slots per Chrome endpoint shared by every worker process on this machine.
+
+    A render holds one of ``budget`` slot locks of its Chrome, so that the number of
+    concurrent renders per Chrome stays the same however many workers are running.
+    '''
+
+    def __init__(self, directory: str = WORKER_LOCK_DIR, budget: int = 1) -> None:
+        self.directory = directory
+        self.budget = max(budget, 1)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, endpoint: Tuple[str, int], slot: int) -> str:
+        return os.path.join(self.directory, 'page-{}-{}-{}.lock'.format(endpoint[0], endpoint[1], slot))
+
+    def try_acquire(self, endpoint: Tuple[str, int]) -> Optional[FileLock]:
+        slots = list(range(self.budget))
+        random.shuffle(slots)
+        for slot in slots:
+            lock = FileLock(self._path(endpoint, slot))
+            if lock.try_acquire():
+                return lock
+
+    async def acquire(self, endpoint: Tuple[str, int], timeout: float) -> FileLock:
+        loop = asyncio.get_event_loop()
+        deadline = time.time() + timeout
+        while True:
+            lock = await loop.run_in_executor(None, self.try_acquire, endpoint)
+            if lock is not None:
+                return lock
+            if time.time() >= deadline:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(LEASE_POLL_INTERVAL)
+
+
+class Workers:
+    '''Worker processes of this machine, each holding a lock file for as long as it lives'''
+
+    def __init__(self, directory: str = WORKER_LOCK_DIR) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock: Optional[FileLock] = None
+
+    def register(self) -> None:
+        if self._lock is None:
+            lock = FileLock(os.path.join(self.directory, 'worker-{}.lock'.format(os.getpid())))
+            if lock.try_acquire():
+                self._lock = lock
+
+    def unregister(self) -> None:
+        if self._lock is not None:
+            self._lock.release(unlink=True)
+            self._lock = None
+
+    def count(self) -> int:
+        '''Live worker processes, at least ``WORKER_COUNT``. Lock files of dead workers are removed'''
+        alive = 0
+        for path in glob.glob(os.path.join(self.directory, 'worker-*.lock')):
+            lock = FileLock(path)
+            try:
+                acquired = lock.try_acquire()
+            except FileNotFoundError:
+                continue
+            if acquired:
+                lock.release(unlink=True)
+            else:
+                alive += 1
+        return max(alive, WORKER_COUNT, 1)
+
+
+class RenderLocks:
+    '''Per-URL render locks shared by every worker process on this machine'''
+
+    def __init__(self, directory: str = WORKER_LOCK_DIR) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: Hashable) -> str:
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, 'render-{}.lock'.format(digest))
+
+    async def acquire(self, key: Hashable, timeout: float = RENDER_LOCK_TIMEOUT) -> Tuple[Optional[FileLock], bool]:
+        '''Lock rendering ``key``, returns the lock and whether another process was rendering it meanwhile.
+
+        The lock is ``None`` when the other process did not finish in ``timeout`` seconds.
+        '''
+        loop = asyncio.get_event_loop()
+        lock = FileLock(self._path(key))
+        deadline = time.time() + timeout
+        waited = False
+        while not await loop.run_in_executor(None, lock.try_acquire):
+            waited = True
+            if time.time() >= deadline:
+                logger.warning('Render lock of %s held for more than %.1fs, rendering anyway', key, timeout)
+                return None, waited
+            await asyncio.sleep(LEASE_POLL_INTERVAL)
+        return lock, waited
@@ -0,0 +1,26 @@
+from collections import defaultdict
+from typing import Dict, Callable, Union
+
+
+class Metrics:
+    '''Process-wide counters and gauges, exposed at ``/metrics``'''
+
+    def __init__(self) -> None:
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._gauges: Dict[str, Callable[[], Union[int, float]]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        self._counters[name] += value
+
+    def gauge(self, name: str, func: Callable[[], Union[int, float]]) -> None:
+        '''Register a gauge whose value is read from ``func`` on demand'''
+        self._gauges[name] = func
+
+    def to_dict(self) -> Dict:
+        values = dict(self._counters)
+        for name, func in self._gauges.items():
+            values[name] = func()
+        return values
+
+
+metrics = Metrics()
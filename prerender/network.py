@@ -0,0 +1,141 @@
+from urllib.parse import urlparse
+from typing import Dict, Optional, Set, Tuple, Iterable
+
+
+# Capture format of the validators of the main document response, stored next to renders to revalidate them
+VALIDATORS_FORMAT = 'origin'
+
+
+def is_response_ok(response: Optional[Dict]) -> bool:
+    if not response:
+        return False
+    status = response['status']
+    return status < 400
+
+
+class Request:
+    '''What readiness, success rate, MHTML and the learned blocklist need to know about a request'''
+    __slots__ = ('url', 'resource_type', 'mime_type', 'started_at', 'finished_at', 'status', 'ok')
+
+    def __init__(self, url: str, resource_type: Optional[str], started_at: float) -> None:
+        self.url = url
+        self.resource_type = resource_type
+        self.mime_type: Optional[str] = None
+        self.started_at = started_at
+        self.finished_at: Optional[float] = None
+        # Status code of the response, ``None`` when loading failed
+        self.status: Optional[int] = None
+        self.ok: bool = False
+
+    @property
+    def host(self) -> Optional[str]:
+        # Parsed only when needed, parsing every URL as events arrive is the bulk of tracking cost
+        return urlparse(self.url).hostname
+
+
+class NetworkLog:
+    '''Network activity of a render, built from ``Network.requestWillBeSent``, ``Network.responseReceived``
+    and ``Network.loadingFailed`` events.
+
+    Only a compact record is kept per request instead of the events themselves, response counts are
+    maintained as events arrive and the main document response is tracked as it is received.
+    '''
+
+    def __init__(self, timeboxed_hosts: Iterable[str] = (), timebox: float = 0) -> None:
+        self.requests: Dict[str, Request] = {}
+        # Requests with a response or failed, and those that succeeded
+        self.finished: int = 0
+        self.succeeded: int = 0
+        self.timeboxed_hosts: Set[str] = set(timeboxed_hosts)
+        self.timebox = timebox
+        # Pending requests to time-boxed hosts and when they started
+        self._timeboxed: Dict[str, float] = {}
+        # URL, status code and validators of the main document response
+        self._document: Optional[Tuple[str, int, Dict[str, Optional[str]]]] = None
+
+    def __len__(self) -> int:
+        return self.finished
+
+    def request_will_be_sent(self, params: Dict, now: float, timeboxed: bool = False) -> Request:
+        request_id = params['requestId']
+        request = self.requests.get(request_id)
+        url = params['request']['url']
+        if request is None or request.finished_at is not None:
+            request = self.requests[request_id] = Request(url, params.get('type'), now)
+        else:
+            # Redirected
+            request.url = url
+        if timeboxed and self.timeboxed_hosts and request.host in self.timeboxed_hosts:
+            self._timeboxed[request_id] = now
+        return request
+
+    def response_received(self, params: Dict, now: float, document_url: Optional[str] = None) -> Request:
+        '''Record a ``Network.responseReceived`` or ``Network.loadingFailed`` event, the last one wins'''
+        request_id = params['requestId']
+        request = self.requests.get(request_id)
+        if request is None:
+            request = self.requests[request_id] = Request('', params.get('type'), now)
+        if request.finished_at is None:
+            self.finished += 1
+        elif request.ok:
+            self.succeeded -= 1
+        request.finished_at = now
+        self._timeboxed.pop(request_id, None)
+
+        response = params.get('response')
+        if response:
+            request.url = response['url']
+            request.mime_type = response.get('mimeType')
+            request.status = response['status']
+            if document_url is not None and request.url == document_url \
+                    and (self._document is None or self._document[0] != document_url):
+                headers = {name.lower(): value for name, value in response.get('headers', {}).items()}
+                self._document = (document_url, request.status, {
+                    'etag': headers.get('etag'),
+                    'last_modified': headers.get('last-modified'),
+                })
+        else:
+            request.status = None
+        request.ok = is_response_ok(response) or params.get('blockedReason') == 'inspector'
+        if request.ok:
+            self.succeeded += 1
+        return request
+
+    def document_status(self, url: str) -> Optional[int]:
+        '''Status code of the response of ``url``, the main document'''
+        if self._document is not None and self._document[0] == url:
+            return self._document[1]
+        return None
+
+    def document_validators(self, url: str) -> Optional[Dict[str, Optional[str]]]:
+        '''``ETag`` and ``Last-Modified`` of the response of ``url``, the main document'''
+        if self._document is not None and self._document[0] == url:
+            return self._document[2]
+        return None
+
+    def success_rate(self) -> float:
+        return self.succeeded / self.finished if self.finished else 1
+
+    def expired_timeboxed(self, now: float) -> int:
+        '''Pending requests to time-boxed hosts started more than ``timebox`` milliseconds ago'''
+        if not self._timeboxed:
+            return 0
+        started_before = now - self.timebox / 1000
+        return sum(1 for started_at in self._timeboxed.values() if started_at <= started_before)
+
+    def host_activity(self, now: float) -> Dict[str, Tuple[float, Set[str]]]:
+        '''Time of the last response and resource types of every host requested, pending requests count as ``now``'''
+        activity: Dict[str, Tuple[float, Set[str]]] = {}
+        for request in self.requests.values():
+            host = request.host
+            if host is None:
+                continue
+            finished_at = request.finished_at if request.finished_at is not None else now
+            previous = activity.get(host)
+            if previous is None:
+                activity[host] = previous = (finished_at, set())
+            elif finished_at > previous[0]:
+                activity[host] = previous = (finished_at, previous[1])
+            if request.resource_type:
+                previous[1].add(request.resource_type)
+        return activity
@@ -1,32 +1,101 @@
 import os
+import math
+import time
 import asyncio
 import logging
+from urllib.parse import urlparse
 from multiprocessing import cpu_count
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, AnyStr, Sequence, Set, Callable
 
 from websockets.exceptions import InvalidHandshake, ConnectionClosed
 
+from .utils import is_yesish
 from .chromerdp import ChromeRemoteDebugger, Page
 from .exceptions import TemporaryBrowserFailure
+from .stats import HostStats, HOST_STATS_FILE, HOST_STATS_SAVE_INTERVAL
+from .blocklist import LearnedBlocklist, BLOCKLIST_TIMEBOX
+from .constants import BLOCKED_URLS
+from .metrics import metrics
+from .leases import PageLeases, Workers, ENABLE_WORKER_COORDINATION, WORKER_LOCK_DIR
 
 logger = logging.getLogger(__name__)
 
 PRERENDER_TIMEOUT: int = int(os.environ.get('PRERENDER_TIMEOUT', 30))
+ENABLE_PARTIAL_RENDER: bool = is_yesish(os.environ.get('ENABLE_PARTIAL_RENDER', '0'))
+PRERENDER_SOFT_TIMEOUT: float = float(os.environ.get('PRERENDER_SOFT_TIMEOUT', PRERENDER_TIMEOUT))
+PARTIAL_CAPTURE_TIMEOUT: float = float(os.environ.get('PARTIAL_CAPTURE_TIMEOUT', 5))
+ENABLE_HEDGING: bool = is_yesish(os.environ.get('ENABLE_HEDGING', '0'))
+HEDGE_QUANTILE: float = float(os.environ.get('HEDGE_QUANTILE', 0.95))
+HEDGE_MIN_DELAY: float = float(os.environ.get('HEDGE_MIN_DELAY', 1))
+HEDGE_BUDGET: float = float(os.environ.get('HEDGE_BUDGET', 0.05))
+HEDGE_BURST: float = float(os.environ.get('HEDGE_BURST', 5))
 CONCURRENCY: int = int(os.environ.get('CONCURRENCY', cpu_count() * 2))
 MAX_ITERATIONS: int = int(os.environ.get('MAX_ITERATIONS', 200))
+PAGE_MEMORY_CHECK_INTERVAL: int = int(os.environ.get('PAGE_MEMORY_CHECK_INTERVAL', 10))
+PAGE_MAX_JS_HEAP_SIZE: int = int(os.environ.get('PAGE_MAX_JS_HEAP_SIZE', 256)) * 2 ** 20
+PAGE_MAX_NODES: int = int(os.environ.get('PAGE_MAX_NODES', 100000))
+PAGE_MAX_DOCUMENTS: int = int(os.environ.get('PAGE_MAX_DOCUMENTS', 20))
 CHROME_HOST: str = os.environ.get('CHROME_HOST', 'localhost')
 CHROME_PORT: int = int(os.environ.get('CHROME_PORT', 9222))
 USER_AGENT: Optional[str] = os.environ.get('USER_AGENT')
+BOOTSTRAP_CONCURRENCY: int = int(os.environ.get('BOOTSTRAP_CONCURRENCY', 8))
+POOL_MIN_SIZE: int = int(os.environ.get('POOL_MIN_SIZE', CONCURRENCY))
+POOL_MAX_SIZE: int = int(os.environ.get('POOL_MAX_SIZE', CONCURRENCY))
+POOL_SCALE_INTERVAL: float = float(os.environ.get('POOL_SCALE_INTERVAL', 1))
+POOL_SCALE_UP_STEP: int = int(os.environ.get('POOL_SCALE_UP_STEP', 2))
+POOL_SCALE_DOWN_COOLDOWN: float = float(os.environ.get('POOL_SCALE_DOWN_COOLDOWN', 60))
+POOL_SCALE_MAX_LATENCY: float = float(os.environ.get('POOL_SCALE_MAX_LATENCY', 0))
+WORKER_PAGE_BUDGET: int = int(os.environ.get('WORKER_PAGE_BUDGET', CONCURRENCY))
+WORKER_REBALANCE_INTERVAL: float = float(os.environ.get('WORKER_REBALANCE_INTERVAL', 10))
 
 
 class Prerender:
-    def __init__(self, host: str = CHROME_HOST, port: int = CHROME_PORT, loop=None) -> None:
+    def __init__(self, host: str = CHROME_HOST, port: int = CHROME_PORT, loop=None,
+                 endpoints: Optional[List[Tuple[str, int]]] = None) -> None:
+        '''Render pages with the Chrome listening on ``host``:``port``, or on every one of ``endpoints``'''
+        if endpoints:
+            host, port = endpoints[0]
         self.host = host
         self.port = port
         self.loop = loop
-        self._rdp = ChromeRemoteDebugger(host, port, loop=loop)
+        self._debuggers: List[ChromeRemoteDebugger] = [
+            ChromeRemoteDebugger(host, port, loop=loop) for host, port in endpoints or [(host, port)]
+        ]
+        self._rdp = self._debuggers[0]
+        # User agent of Chrome pages, known once bootstrapped unless set by ``USER_AGENT``
+        self.user_agent: Optional[str] = USER_AGENT or None
+        # Called with the Chrome endpoint a page rendered on and whether Chrome itself failed the render
+        self.on_render_result: Optional[Callable[[Tuple[str, int], bool], None]] = None
+        # Whether renders should rather go to another Chrome than this endpoint, such as while its breaker is open
+        self.endpoint_allowed: Optional[Callable[[Tuple[str, int]], bool]] = None
         self._pages = set()
         self._idle_pages: asyncio.Queue = asyncio.Queue(loop=self.loop)
+        self.host_stats = HostStats(PRERENDER_TIMEOUT)
+        # Third-party hosts delaying readiness, blocked or time-boxed in renders
+        self.blocklist = LearnedBlocklist()
+        self._save_stats_task: Optional[asyncio.Future] = None
+        # Hedged renders allowed right now, refilled by ``HEDGE_BUDGET`` on every render
+        self._hedge_tokens: float = HEDGE_BURST
+        # Pages being opened per Chrome, so that concurrently opened pages are spread evenly
+        self._opening: Dict[ChromeRemoteDebugger, int] = {debugger: 0 for debugger in self._debuggers}
+        self.bootstrapped: bool = False
+        self.min_size: int = POOL_MIN_SIZE
+        self.max_size: int = max(POOL_MAX_SIZE, POOL_MIN_SIZE)
+        # Renders waiting for an idle page, and when a render last had to wait
+        self._waiting: int = 0
+        self._last_busy_time: float = 0
+        self._autoscale_task: Optional[asyncio.Future] = None
+        # Concurrent renders per Chrome shared with the other worker processes
+        self._leases: Optional[PageLeases] = None
+        self._workers: Optional[Workers] = None
+        self._rebalance_task: Optional[asyncio.Future] = None
+        if ENABLE_WORKER_COORDINATION:
+            self._leases = PageLeases(WORKER_LOCK_DIR, WORKER_PAGE_BUDGET)
+            self._workers = Workers(WORKER_LOCK_DIR)
+            self._workers.register()
+        metrics.gauge('pool_size', lambda: self.size)
+        metrics.gauge('pool_idle', lambda: self.idle_size)
+        metrics.gauge('pool_waiting', lambda: self._waiting)
 
     async def bootstrap(self) -> None:
         if USER_AGENT:
@@ -37,43 +106,372 @@ class Prerender:
                 user_agent = 'Prerender {}'.format(version['User-Agent'])
             except Exception:
                 user_agent = None
-        self._rdp.user_agent = user_agent
+        self.user_agent = user_agent
+        for debugger in self._debuggers:
+            debugger.user_agent = user_agent
 
-        for i in range(CONCURRENCY):
-            page = await self._rdp.new_page()
+        if self._save_stats_task is None:
+            await self.loop.run_in_executor(None, self.host_stats.load, HOST_STATS_FILE)
+            self._save_stats_task = asyncio.ensure_future(self._save_stats_periodically(), loop=self.loop)
+
+        if self._workers is not None:
+            await self._apply_worker_share()
+            if self._rebalance_task is None:
+                self._rebalance_task = asyncio.ensure_future(self._rebalance_workers(), loop=self.loop)
+
+        # Bootstrapping may be retried after a failure, only open the missing pages
+        await self._open_pages(self.min_size - self.size)
+        self.bootstrapped = True
+        if self._autoscale_task is None and self.max_size > self.min_size:
+            self._autoscale_task = asyncio.ensure_future(self._autoscale(), loop=self.loop)
+
+    async def _apply_worker_share(self) -> None:
+        '''Bound the pool by this worker's share of ``WORKER_PAGE_BUDGET`` pages per Chrome.
+
+        Leases only bound concurrent renders, without this every worker would keep its own full pool open
+        and Chrome would hold workers x pool size pages.
+        '''
+        workers = await self.loop.run_in_executor(None, self._workers.count)
+        share = max(math.ceil(WORKER_PAGE_BUDGET * len(self._debuggers) / workers), 1)
+        min_size = min(POOL_MIN_SIZE, share)
+        max_size = min(max(POOL_MAX_SIZE, POOL_MIN_SIZE), share)
+        if (min_size, max_size) == (self.min_size, self.max_size):
+            return
+        logger.info('%d workers sharing %d pages per Chrome', workers, WORKER_PAGE_BUDGET)
+        if self.bootstrapped:
+            await self.resize(min_size, max_size)
+        else:
+            self.min_size, self.max_size = min_size, max_size
+
+    async def _rebalance_workers(self) -> None:
+        while True:
+            await asyncio.sleep(WORKER_REBALANCE_INTERVAL)
+            try:
+                await self._apply_worker_share()
+            except Exception:
+                logger.exception('Error sizing pool for worker processes')
+
+    @property
+    def size(self) -> int:
+        '''Number of usable pages, busy or idle'''
+        return sum(1 for page in self._pages if not page.retired)
+
+    @property
+    def idle_size(self) -> int:
+        return self._idle_pages.qsize()
+
+    async def _open_pages(self, count: int) -> None:
+        semaphore = asyncio.Semaphore(BOOTSTRAP_CONCURRENCY, loop=self.loop)
+
+        async def _open_page() -> None:
+            async with semaphore:
+                page = await self._new_page()
             await self._idle_pages.put(page)
-            self._pages.add(page)
+
+        if count > 0:
+            await asyncio.gather(*[_open_page() for _ in range(count)])
+            logger.info('Opened %d pages, %d pages in pool', count, self.size)
+
+    @property
+    def endpoints(self) -> List[Tuple[str, int]]:
+        return [debugger.endpoint for debugger in self._debuggers]
+
+    def _pick_debugger(self) -> ChromeRemoteDebugger:
+        '''The available Chrome with the fewest pages'''
+        counts = dict(self._opening)
+        for page in self._pages:
+            if not page.retired and page.debugger in counts:
+                counts[page.debugger] += 1
+        candidates = [debugger for debugger in self._debuggers if debugger.available] or self._debuggers
+        return min(candidates, key=lambda debugger: counts[debugger])
+
+    async def _new_page(self) -> Page:
+        debugger = self._pick_debugger()
+        self._opening[debugger] += 1
+        try:
+            page = await debugger.new_page()
+        finally:
+            self._opening[debugger] -= 1
+        self._pages.add(page)
+        return page
+
+    async def set_endpoint_available(self, endpoint: Tuple[str, int], available: bool) -> None:
+        '''Move pages away from a Chrome going down, and back once it is available again'''
+        debugger = next((debugger for debugger in self._debuggers if debugger.endpoint == endpoint), None)
+        if debugger is None:
+            return
+        debugger.available = available
+        if not available:
+            # Pages of this Chrome are closed once returned to the pool
+            pages = [page for page in self._pages if page.debugger is debugger and not page.retired]
+            for page in pages:
+                page.retired = True
+            if any(other.available for other in self._debuggers):
+                try:
+                    await self._open_pages(len(pages))
+                except Exception:
+                    logger.exception('Error opening pages to replace pages of %r', debugger)
+            return
+
+        live_pages = [page for page in self._pages if not page.retired]
+        await self._open_pages(self.min_size - len(live_pages))
+        # Rebalance pages moved to other Chromes while this one was down
+        fair_share = self.size // len(self._debuggers)
+        moved = fair_share - sum(1 for page in self._pages if page.debugger is debugger and not page.retired)
+        for page in live_pages:
+            if moved <= 0:
+                break
+            if page.debugger is not debugger and not page.retiring:
+                self._recycle_page(page)
+                moved -= 1
 
     async def pages(self) -> List[Dict]:
-        return await self._rdp.pages()
+        pages = []
+        for debugger in self._debuggers:
+            pages.extend(await debugger.pages())
+        return pages
+
+    def page_states(self) -> List[Dict]:
+        '''State of every page of the pool, longest running renders first'''
+        states = [page.to_dict() for page in self._pages]
+        return sorted(states, key=lambda state: state['elapsed'] or 0, reverse=True)
 
     async def version(self) -> Dict:
         return await self._rdp.version()
 
+    async def resize(self, min_size: int, max_size: int) -> None:
+        '''Change pool size bounds, opening or closing pages right away'''
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size)
+        if self.size < self.min_size:
+            await self._open_pages(self.min_size - self.size)
+        elif self.size > self.max_size:
+            self._retire_pages(self.size - self.max_size)
+        if self._autoscale_task is None and self.max_size > self.min_size and self.bootstrapped:
+            self._autoscale_task = asyncio.ensure_future(self._autoscale(), loop=self.loop)
+        logger.info('Pool resized to %d-%d pages, %d pages in pool', self.min_size, self.max_size, self.size)
+
+    def _retire_pages(self, count: int) -> None:
+        '''Close ``count`` pages, idle pages first, busy pages once they are returned to the pool'''
+        while count > 0 and not self._idle_pages.empty():
+            page = self._idle_pages.get_nowait()
+            self._idle_pages.task_done()
+            if page.retired:
+                asyncio.ensure_future(self._close_page(page), loop=self.loop)
+                continue
+            page.retired = True
+            asyncio.ensure_future(self._close_page(page), loop=self.loop)
+            count -= 1
+        for page in tuple(self._pages):
+            if count <= 0:
+                break
+            if not page.retired:
+                page.retired = True
+                count -= 1
+
+    async def _autoscale(self) -> None:
+        '''Grow the pool while renders wait for pages, shrink it after it has been idle for a while'''
+        while True:
+            await asyncio.sleep(POOL_SCALE_INTERVAL)
+            try:
+                size = self.size
+                if self._waiting > 0 and size < self.max_size:
+                    latency = self.host_stats.durations.quantile(0.9)
+                    if POOL_SCALE_MAX_LATENCY > 0 and latency is not None and latency > POOL_SCALE_MAX_LATENCY:
+                        # Rendering already slows down, more pages would only make Chrome slower
+                        continue
+                    count = min(self._waiting, POOL_SCALE_UP_STEP, self.max_size - size)
+                    logger.info('%d renders waiting for pages, opening %d pages', self._waiting, count)
+                    await self._open_pages(count)
+                elif size > self.min_size and self._waiting == 0 and self.idle_size > 0 \
+                        and time.time() - self._last_busy_time >= POOL_SCALE_DOWN_COOLDOWN:
+                    logger.info('Pool idle for %ds, closing 1 page', POOL_SCALE_DOWN_COOLDOWN)
+                    self._retire_pages(1)
+            except Exception:
+                logger.exception('Error autoscaling pages pool')
+
     async def shutdown(self) -> None:
-        for page in self._pages:
-            await page.close()
-        await self._rdp.shutdown()
+        if self._autoscale_task is not None:
+            self._autoscale_task.cancel()
+        if self._rebalance_task is not None:
+            self._rebalance_task.cancel()
+        if self._workers is not None:
+            self._workers.unregister()
+        if self._save_stats_task is not None:
+            self._save_stats_task.cancel()
+            await self._save_stats()
+        for page in tuple(self._pages):
+            await self._close_page(page)
+        for debugger in self._debuggers:
+            await debugger.shutdown()
 
-    async def render(self, url: str, format: str = 'html', proxy: str = '') -> str:
-        if not self._pages:
+    async def _save_stats(self) -> None:
+        try:
+            await self.loop.run_in_executor(None, self.host_stats.save, HOST_STATS_FILE)
+        except Exception:
+            logger.exception('Error saving host stats to %s', HOST_STATS_FILE)
+
+    async def _save_stats_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(HOST_STATS_SAVE_INTERVAL)
+            await self._save_stats()
+
+    async def render(self, url: str, format: str = 'html', proxy: str = '') -> Tuple[AnyStr, int, bool]:
+        '''Render ``url``, returns rendered data, status code and whether it is a partial render'''
+        outputs, status_code, partial = await self.render_many(url, (format,), proxy)
+        return outputs[format], status_code, partial
+
+    async def render_many(self, url: str, formats: Sequence[str] = ('html',),
+                          proxy: str = '') -> Tuple[Dict[str, AnyStr], int, bool]:
+        '''Render ``url`` in every one of ``formats`` from a single page load'''
+        if not self._pages and self.bootstrapped:
             raise RuntimeError('No browser available')
 
+        if self._idle_pages.empty():
+            self._last_busy_time = time.time()
+        self._waiting += 1
         try:
-            page = await asyncio.wait_for(self._idle_pages.get(), timeout=10)
+            page = await asyncio.wait_for(self._get_idle_page(), timeout=10)
         except asyncio.TimeoutError:
             raise TemporaryBrowserFailure('No Chrome page available in 10s')
+        finally:
+            self._waiting -= 1
+        page = self._prefer_allowed_page(page)
+
+        if ENABLE_HEDGING:
+            return await self._hedged_render(page, url, formats, proxy)
+        return await self._render_page(page, url, formats, proxy)
+
+    async def _get_idle_page(self) -> Page:
+        while True:
+            page = await self._idle_pages.get()
+            if not page.retired:
+                return page
+            self._idle_pages.task_done()
+            asyncio.ensure_future(self._close_page(page), loop=self.loop)
+
+    def _prefer_allowed_page(self, page: Page) -> Page:
+        '''Swap ``page`` for an idle page of another Chrome when renders should avoid its Chrome'''
+        if self.endpoint_allowed is None or self.endpoint_allowed(page.debugger.endpoint):
+            return page
+        other = self._get_idle_page_nowait(page)
+        if other is None:
+            return page
+        if not self.endpoint_allowed(other.debugger.endpoint):
+            page, other = other, page
+        self._idle_pages.put_nowait(other)
+        self._idle_pages.task_done()
+        return page
 
+    def _hedge_delay(self, host: str) -> Optional[float]:
+        self._hedge_tokens = min(self._hedge_tokens + HEDGE_BUDGET, HEDGE_BURST)
+        latency = self.host_stats.latency(host, HEDGE_QUANTILE)
+        if latency is None:
+            return None
+        return max(latency / 1000, HEDGE_MIN_DELAY)
+
+    def _get_idle_page_nowait(self, avoid: Page) -> Optional[Page]:
+        '''Get an idle page without waiting, preferring one from another Chrome than ``avoid``'''
+        fallback = None
+        for _ in range(self._idle_pages.qsize()):
+            page = self._idle_pages.get_nowait()
+            if page.retired:
+                self._idle_pages.task_done()
+                asyncio.ensure_future(self._close_page(page), loop=self.loop)
+                continue
+            if page.debugger is not avoid.debugger:
+                if fallback is not None:
+                    self._idle_pages.put_nowait(fallback)
+                    self._idle_pages.task_done()
+                return page
+            if fallback is None:
+                fallback = page
+            else:
+                self._idle_pages.put_nowait(page)
+                self._idle_pages.task_done()
+        return fallback
+
+    async def _hedged_render(self, page: Page, url: str, formats: Sequence[str],
+                             proxy: str) -> Tuple[Dict[str, AnyStr], int, bool]:
+        '''Start a second render of ``url`` on another page when the first one is slower than usual,
+        the first to finish wins.'''
+        tasks = [asyncio.ensure_future(self._render_page(page, url, formats, proxy), loop=self.loop)]
+        try:
+            delay = self._hedge_delay(urlparse(url).hostname)
+            if delay is not None:
+                done, _pending = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._hedge_tokens >= 1:
+                    hedge_page = self._get_idle_page_nowait(page)
+                    if hedge_page is not None:
+                        self._hedge_tokens -= 1
+                        metrics.incr('renders_hedged')
+                        logger.info('Rendering %s on page %s slower than %.1fs, hedging on page %s',
+                                    url, page.id, delay, hedge_page.id)
+                        tasks.append(asyncio.ensure_future(self._render_page(hedge_page, url, formats, proxy),
+                                                           loop=self.loop))
+            pending = tasks
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            metrics.incr('hedges_won')
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+    async def _render_page(self, page: Page, url: str, formats: Sequence[str],
+                           proxy: str) -> Tuple[Dict[str, AnyStr], int, bool]:
         reopen = False
+        cancelled = False
+        rendered = False
+        lease = None
         try:
+            if self._leases is not None:
+                try:
+                    lease = await self._leases.acquire(page.debugger.endpoint, timeout=10)
+                except asyncio.TimeoutError:
+                    metrics.incr('page_lease_timeouts')
+                    raise TemporaryBrowserFailure('No Chrome render slot available in 10s')
+            blocked_hosts, timeboxed_hosts = self.blocklist.actions()
             try:
-                await page.attach(proxy)
+                await page.attach(proxy, BLOCKED_URLS + blocked_hosts)
             except asyncio.TimeoutError:
                 logger.error('Attach to Chrome page %s timed out, page is likely closed', page.id)
                 reopen = True
                 raise TemporaryBrowserFailure('Attach to Chrome page timed out')
-            data = await asyncio.wait_for(page.render(url, format), timeout=PRERENDER_TIMEOUT)
-            return data
+            host = urlparse(url).hostname
+            start_time = time.time()
+            timeout = self.host_stats.timeout(host)
+            if not ENABLE_PARTIAL_RENDER:
+                outputs, status_code = await asyncio.wait_for(
+                    page.render_many(url, formats, idle_timeout=self.host_stats.idle_timeout(host),
+                                     timeboxed_hosts=timeboxed_hosts, timebox=BLOCKLIST_TIMEBOX),
+                    timeout=timeout
+                )
+                partial = False
+            else:
+                outputs, status_code, partial = await self._render_with_soft_timeout(
+                    page, url, formats, host, min(PRERENDER_SOFT_TIMEOUT, timeout), timeboxed_hosts
+                )
+            if status_code < 400 and self.blocklist.learn:
+                self.blocklist.record(host, page.host_activity())
+            if not partial and status_code < 400:
+                self.host_stats.record(host, time.time() - start_time, page.max_idle_gap)
+            rendered = True
+            return outputs, status_code, partial
+        except asyncio.CancelledError:
+            logger.info('Rendering %s on page %s cancelled', url, page.id)
+            metrics.incr('renders_cancelled')
+            cancelled = True
+            raise
         except InvalidHandshake:
             logger.error('Chrome invalid handshake for page %s', page.id)
             reopen = True
@@ -91,24 +489,106 @@ class Prerender:
             else:
                 raise
         finally:
-            await asyncio.shield(self._manage_page(page, reopen))
+            if lease is not None:
+                lease.release()
+            # Pages are reopened exactly when Chrome failed the render
+            if self.on_render_result is not None and (rendered or reopen):
+                self.on_render_result(page.debugger.endpoint, reopen)
+            await asyncio.shield(self._manage_page(page, reopen, cancelled))
 
-    async def _manage_page(self, page: Page, reopen: bool = False) -> None:
+    async def _render_with_soft_timeout(self, page: Page, url: str, formats: Sequence[str], host: str,
+                                        timeout: float, timeboxed_hosts: Optional[Set[str]] = None
+                                        ) -> Tuple[Dict[str, AnyStr], int, bool]:
+        '''Capture whatever the page shows when it is not ready within ``timeout``'''
+        task = asyncio.ensure_future(
+            page.render_many(url, formats, idle_timeout=self.host_stats.idle_timeout(host),
+                             timeboxed_hosts=timeboxed_hosts, timebox=BLOCKLIST_TIMEBOX),
+            loop=self.loop
+        )
+        try:
+            done, _pending = await asyncio.wait([task], timeout=timeout)
+            if done:
+                outputs, status_code = task.result()
+                return outputs, status_code, False
+            logger.warning('Page %s not ready in %.1fs, capturing partial %s of %s',
+                           page.id, timeout, ','.join(formats), url)
+            outputs, status_code = await asyncio.wait_for(page.capture_many(formats), timeout=PARTIAL_CAPTURE_TIMEOUT)
+            return outputs, status_code, True
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.wait([task])
+
+    async def _manage_page(self, page: Page, reopen: bool = False, cancelled: bool = False) -> None:
         self._idle_pages.task_done()
         if page.websocket:
+            if cancelled and not reopen:
+                # Stop the abandoned navigation so that the page can be reused right away
+                try:
+                    await asyncio.wait_for(page.stop_loading(), timeout=5)
+                except (asyncio.TimeoutError, ConnectionClosed):
+                    logger.warning('Stop loading Chrome page %s failed, reopening it', page.id)
+                    reopen = True
             if not reopen:
                 await page.navigate('about:blank')  # Saves memory
+                if not page.retiring and PAGE_MEMORY_CHECK_INTERVAL > 0 \
+                        and page.iteration % PAGE_MEMORY_CHECK_INTERVAL == 0:
+                    await self._check_page_memory(page)
             await page.detach()
 
-        if not reopen and page.iteration < MAX_ITERATIONS:
+        if page.retired:
+            await self._close_page(page)
+            return
+
+        if not reopen:
+            if not page.retiring and page.iteration >= MAX_ITERATIONS:
+                logger.info('Page %s reached %d iterations, recycling it', page.id, page.iteration)
+                self._recycle_page(page)
             await self._idle_pages.put(page)
             return
 
-        await page.close()
-        self._pages.remove(page)
-        page = await self._rdp.new_page()
-        # wait until Chrome is ready
-        await asyncio.sleep(0.1)
+        await self._close_page(page)
+        page = await self._new_page()
         await self._idle_pages.put(page)
-        self._pages.add(page)
         logger.info('Page %s added to idle pages queue', page.id)
+
+    async def _check_page_memory(self, page: Page) -> None:
+        try:
+            page_metrics = await asyncio.wait_for(page.get_metrics(), timeout=5)
+        except Exception as e:
+            logger.warning('Error getting metrics of page %s: %s', page.id, str(e))
+            return
+        heap_size = page_metrics.get('JSHeapUsedSize', 0)
+        nodes = page_metrics.get('Nodes', 0)
+        documents = page_metrics.get('Documents', 0)
+        if (PAGE_MAX_JS_HEAP_SIZE > 0 and heap_size > PAGE_MAX_JS_HEAP_SIZE) \
+                or (PAGE_MAX_NODES > 0 and nodes > PAGE_MAX_NODES) \
+                or (PAGE_MAX_DOCUMENTS > 0 and documents > PAGE_MAX_DOCUMENTS):
+            logger.info('Page %s uses too much memory (JS heap %dMB, %d nodes, %d documents), recycling it',
+                        page.id, heap_size / 2 ** 20, nodes, documents)
+            metrics.incr('pages_memory_exceeded')
+            self._recycle_page(page)
+
+    def _recycle_page(self, page: Page) -> None:
+        '''Replace ``page`` in the background, it keeps serving until its replacement is ready.'''
+        page.retiring = True
+        asyncio.ensure_future(self._replace_page(page), loop=self.loop)
+
+    async def _replace_page(self, old_page: Page) -> None:
+        try:
+            page = await self._new_page()
+        except Exception:
+            logger.exception('Error opening replacement for page %s', old_page.id)
+            old_page.retiring = False
+            return
+        await self._idle_pages.put(page)
+        old_page.retired = True
+        metrics.incr('pages_recycled')
+        logger.info('Page %s replaced by page %s', old_page.id, page.id)
+
+    async def _close_page(self, page: Page) -> None:
+        self._pages.discard(page)
+        try:
+            await page.close()
+        except Exception:
+            logger.exception('Error closing page %s', page.id)
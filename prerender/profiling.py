@@ -0,0 +1,214 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+from .utils import is_yesish
+from .metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+ENABLE_LOOP_MONITOR: bool = is_yesish(os.environ.get('ENABLE_LOOP_MONITOR', '1'))
+# Seconds between event loop heartbeats
+LOOP_MONITOR_INTERVAL: float = float(os.environ.get('LOOP_MONITOR_INTERVAL', 0.1))
+# Milliseconds the event loop must be blocked for its stack to be captured
+SLOW_CALLBACK_DURATION: float = float(os.environ.get('SLOW_CALLBACK_DURATION', 100))
+# Milliseconds between stack samples of the sampling profiler
+PROFILE_INTERVAL: float = float(os.environ.get('PROFILE_INTERVAL', 5))
+PROFILE_MAX_DURATION: float = float(os.environ.get('PROFILE_MAX_DURATION', 300))
+# Loop lag samples kept to compute recent maximum and percentiles, one minute by default
+_LAG_WINDOW = 60
+
+
+def _format_stack(stack: traceback.StackSummary) -> List[str]:
+    return ['{}:{} in {}'.format(entry.filename, entry.lineno, entry.name) for entry in stack]
+
+
+def _frame_stack(frame, limit: int = 50) -> List[str]:
+    return _format_stack(traceback.extract_stack(frame, limit=limit))
+
+
+class LoopMonitor:
+    '''Always-on event loop lag and slow callback monitor.
+
+    A task wakes up every ``LOOP_MONITOR_INTERVAL`` seconds and records how late it woke up. A watchdog thread
+    captures the stack of the event loop thread while it is blocked for more than ``SLOW_CALLBACK_DURATION``
+    milliseconds, so that whatever blocks it, regular expressions, JSON decoding or compression, shows up
+    in the logs and at ``/debug/loop``. Works with any event loop implementation, uvloop included.
+    '''
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL,
+                 slow_callback_duration: float = SLOW_CALLBACK_DURATION) -> None:
+        self.interval = interval
+        self.slow_callback_duration = slow_callback_duration
+        self.loop = None
+        self.lags: deque = deque(maxlen=max(int(_LAG_WINDOW / interval), 1))
+        self.slow_callbacks: deque = deque(maxlen=20)
+        self._task: Optional[asyncio.Future] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._thread_id: Optional[int] = None
+        # Time of the last heartbeat, written by the loop and read by the watchdog thread
+        self._heartbeat: float = 0
+        # Stack of the loop thread captured by the watchdog during the current block
+        self._blocked_stack: Optional[List[str]] = None
+
+    def start(self, loop) -> None:
+        self.loop = loop
+        self._thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self._beat(), loop=loop)
+        self._thread = threading.Thread(target=self._watch, name='loop-monitor', daemon=True)
+        self._thread.start()
+        metrics.gauge('loop_lag_ms', lambda: round(self.lags[-1] * 1000, 1) if self.lags else 0)
+        metrics.gauge('loop_lag_max_ms', lambda: round(max(self.lags, default=0) * 1000, 1))
+
+    def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        self._stopped.set()
+        self._thread = None
+
+    async def _beat(self) -> None:
+        while True:
+            start_time = time.monotonic()
+            self._heartbeat = start_time
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - start_time - self.interval, 0)
+            self.lags.append(lag)
+            stack, self._blocked_stack = self._blocked_stack, None
+            if lag * 1000 >= self.slow_callback_duration:
+                metrics.incr('loop_blocked')
+                self.slow_callbacks.append({
+                    'time': time.time(),
+                    'duration': round(lag * 1000, 1),
+                    'stack': stack,
+                })
+                logger.warning('Event loop blocked for %dms%s', lag * 1000,
+                               ':\n' + '\n'.join(stack) if stack else '')
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stopped.wait(self.slow_callback_duration / 2000):
+            heartbeat = self._heartbeat
+            if heartbeat == reported:
+                continue
+            if (time.monotonic() - heartbeat - self.interval) * 1000 >= self.slow_callback_duration:
+                frame = sys._current_frames().get(self._thread_id)
+                if frame is not None:
+                    self._blocked_stack = _frame_stack(frame)
+                reported = heartbeat
+
+    def to_dict(self) -> Dict:
+        '''Loop lag of the last heartbeat and over the last minute in milliseconds, and recent slow callbacks'''
+        lags = sorted(self.lags) or [0]
+        return {
+            'lag': round(self.lags[-1] * 1000 if self.lags else 0, 1),
+            'lag_p50': round(lags[len(lags) // 2] * 1000, 1),
+            'lag_p99': round(lags[min(int(len(lags) * 0.99), len(lags) - 1)] * 1000, 1),
+            'lag_max': round(lags[-1] * 1000, 1),
+            'slow_callbacks': list(self.slow_callbacks),
+        }
+
+
+class SamplingProfiler:
+    '''Statistical profiler sampling the stacks of every thread from a background thread.
+
+    Results are in collapsed stack format, one ``thread;outer;...;inner count`` line per distinct stack,
+    readable by flamegraph.pl and speedscope.
+    '''
+
+    def __init__(self) -> None:
+        self.started_at: Optional[float] = None
+        self.duration: float = 0
+        self.interval: float = PROFILE_INTERVAL
+        self.samples: int = 0
+        self._stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float, interval: float = PROFILE_INTERVAL) -> None:
+        if self.running:
+            raise RuntimeError('A profile is already running')
+        self.started_at = time.time()
+        self.duration = min(duration, PROFILE_MAX_DURATION)
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        deadline = time.monotonic() + self.duration
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{} ({}:{})'.format(code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(names.get(thread_id, str(thread_id)))
+                self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval / 1000)
+
+    def collapsed(self) -> str:
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in self._stacks.most_common())
+
+    def to_dict(self) -> Dict:
+        return {
+            'running': self.running,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'interval': self.interval,
+            'samples': self.samples,
+        }
+
+
+def _await_stack(task: asyncio.Task, limit: int = 50) -> List[str]:
+    '''Frames of the coroutines awaited by ``task``, outermost first'''
+    frames = []
+    coro = task._coro
+    while coro is not None and len(frames) < limit:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is not None:
+            frames.append(frame)
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return _format_stack(traceback.StackSummary.extract(((frame, frame.f_lineno) for frame in frames),
+                                                        lookup_lines=False))
+
+
+def dump_tasks(loop=None) -> List[Dict]:
+    '''Every asyncio task of ``loop`` with the stack of coroutines it is suspended in'''
+    all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+    tasks = []
+    for task in all_tasks(loop):
+        coro = task._coro
+        tasks.append({
+            'coroutine': getattr(coro, '__qualname__', repr(coro)),
+            'state': 'cancelled' if task.cancelled() else 'done' if task.done() else 'pending',
+            'stack': _await_stack(task),
+        })
+    return sorted(tasks, key=lambda task: task['coroutine'])
+
+
+loop_monitor = LoopMonitor()
+profiler = SamplingProfiler()
@@ -0,0 +1,82 @@
+import os
+import asyncio
+import logging
+from typing import Dict, Optional
+
+import aiohttp
+import ujson as json
+
+from .utils import is_yesish
+from .metrics import metrics
+from .httpclient import http_clients
+from .network import VALIDATORS_FORMAT
+from .cache import cache, cache_writer
+
+
+logger = logging.getLogger(__name__)
+
+ENABLE_ORIGIN_REVALIDATION: bool = is_yesish(os.environ.get('ENABLE_ORIGIN_REVALIDATION', '0'))
+ORIGIN_REVALIDATION_TIMEOUT: float = float(os.environ.get('ORIGIN_REVALIDATION_TIMEOUT', 5))
+
+
+class Revalidator:
+    '''Check with a conditional GET whether the origin document of a cached render changed.
+
+    Validators (``ETag`` and ``Last-Modified``) are taken from the main document response Chrome received
+    and recorded with every render, a cached render is still valid when the origin answers ``304``
+    or the same ``ETag``.
+    '''
+
+    async def _fetch(self, url: str, proxy: str, validators: Dict) -> Optional[Dict]:
+        '''Conditional GET of origin document, reads headers only.
+
+        Returns current validators, ``validators`` themselves on ``304`` and ``None`` when the origin failed.
+        '''
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        try:
+            async with http_clients.get(proxy).get(url, headers=headers, proxy=proxy or None,
+                                                   timeout=ORIGIN_REVALIDATION_TIMEOUT) as res:
+                if res.status == 304:
+                    return validators
+                if res.status != 200:
+                    return None
+                return {
+                    'etag': res.headers.get('ETag'),
+                    'last_modified': res.headers.get('Last-Modified'),
+                }
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.info('Fetching origin document %s failed: %r', url, e)
+            return None
+
+    async def record(self, url: str, validators: Optional[Dict], ttl: Optional[int] = None) -> None:
+        '''Record ``validators`` of the origin document of ``url``, just rendered'''
+        if not validators or not validators.get('etag') and not validators.get('last_modified'):
+            # Nothing to revalidate with, the render is rendered again once stale
+            return
+        await cache_writer.put(url, json.dumps(validators).encode('utf-8'), ttl, VALIDATORS_FORMAT)
+
+    async def unchanged(self, url: str, proxy: str = '', ttl: Optional[int] = None) -> bool:
+        '''Whether the origin document of ``url`` did not change since it was rendered'''
+        try:
+            data = await cache.get(url, VALIDATORS_FORMAT)
+            validators = json.loads(data) if data is not None else None
+        except Exception:
+            logger.exception('Error reading origin validators of %s', url)
+            validators = None
+        if validators is None:
+            return False
+
+        current = await self._fetch(url, proxy, validators)
+        if current is None:
+            return False
+        # Origins ignoring conditional requests still answer with the same strong ETag
+        if current is validators or validators.get('etag') and current['etag'] == validators['etag']:
+            metrics.incr('origin_revalidations_unchanged')
+            await cache_writer.put(url, json.dumps(validators).encode('utf-8'), ttl, VALIDATORS_FORMAT)
+            return True
+        metrics.incr('origin_revalidations_changed')
+        return False
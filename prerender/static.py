@@ -0,0 +1,151 @@
+import os
+import re
+import time
+import random
+import asyncio
+import difflib
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Pattern
+
+import aiohttp
+
+from .utils import is_yesish
+from .metrics import metrics
+from .httpclient import http_clients
+
+
+logger = logging.getLogger(__name__)
+
+ENABLE_STATIC_RENDER: bool = is_yesish(os.environ.get('ENABLE_STATIC_RENDER', '0'))
+# Hosts always served without Chrome, other hosts are classified automatically
+STATIC_HOSTS: List[str] = [host.strip() for host in
+                           os.environ.get('STATIC_HOSTS', '').split(',') if host.strip()]
+STATIC_FETCH_TIMEOUT: float = float(os.environ.get('STATIC_FETCH_TIMEOUT', 10))
+STATIC_REQUIRED_SELECTOR: str = os.environ.get('STATIC_REQUIRED_SELECTOR', '')
+STATIC_MIN_TEXT_LENGTH: int = int(os.environ.get('STATIC_MIN_TEXT_LENGTH', 200))
+STATIC_SPA_MARKERS: List[str] = [marker.strip() for marker in os.environ.get(
+    'STATIC_SPA_MARKERS',
+    r'<div[^>]+id=["\'](root|app|__next|__nuxt)["\'][^>]*>\s*</div>,<app-root[^>]*>\s*</app-root>'
+).split(',') if marker.strip()]
+STATIC_SAMPLE_RATE: float = float(os.environ.get('STATIC_SAMPLE_RATE', 0.05))
+STATIC_SIMILARITY: float = float(os.environ.get('STATIC_SIMILARITY', 0.9))
+STATIC_MIN_AGREEMENTS: int = int(os.environ.get('STATIC_MIN_AGREEMENTS', 3))
+STATIC_MAX_HOSTS: int = int(os.environ.get('STATIC_MAX_HOSTS', 10000))
+
+_SPA_MARKER_RES = [re.compile(marker, re.I) for marker in STATIC_SPA_MARKERS]
+_INVISIBLE_RE = re.compile(r'<(script|style|noscript|template)\b.*?</\1\s*>', re.I | re.S)
+_TAG_RE = re.compile(r'<[^>]+>')
+_WORD_RE = re.compile(r'\w+', re.U)
+
+
+def _selector_re(selector: str) -> Optional[Pattern]:
+    '''Regex matching an element by ``#id``, ``.class`` or tag name selector'''
+    if not selector:
+        return None
+    if selector.startswith('#'):
+        return re.compile(r'<[a-z][^>]*\bid=["\']{}["\']'.format(re.escape(selector[1:])), re.I)
+    if selector.startswith('.'):
+        return re.compile(r'<[a-z][^>]*\bclass=["\'][^"\']*\b{}\b'.format(re.escape(selector[1:])), re.I)
+    return re.compile(r'<{}[\s>]'.format(re.escape(selector)), re.I)
+
+
+_REQUIRED_SELECTOR_RE = _selector_re(STATIC_REQUIRED_SELECTOR)
+
+
+def visible_words(html: str) -> List[str]:
+    return _WORD_RE.findall(_TAG_RE.sub(' ', _INVISIBLE_RE.sub(' ', html)))
+
+
+def is_complete(html: str) -> bool:
+    '''Whether ``html`` looks fully rendered by the server'''
+    if _REQUIRED_SELECTOR_RE is not None and not _REQUIRED_SELECTOR_RE.search(html):
+        return False
+    if any(marker.search(html) for marker in _SPA_MARKER_RES):
+        return False
+    return len(' '.join(visible_words(html))) >= STATIC_MIN_TEXT_LENGTH
+
+
+def similarity(html: str, other: str) -> float:
+    return difflib.SequenceMatcher(None, visible_words(html), visible_words(other), autojunk=False).quick_ratio()
+
+
+class HostClass:
+    __slots__ = ('static', 'agreements', 'updated_at')
+
+    def __init__(self) -> None:
+        self.static: bool = False
+        # Consecutive sampled renders where fetched HTML matched Chrome's
+        self.agreements: int = 0
+        self.updated_at: float = 0
+
+
+class StaticRenderer:
+    '''Serve HTML of server-rendered hosts by fetching documents without Chrome.
+
+    Hosts are learned: while a host is not known to be static, a sample of Chrome renders is
+    compared with the fetched document and the host becomes static after ``STATIC_MIN_AGREEMENTS``
+    matching samples in a row. A sample of fast path results of static hosts is compared with Chrome
+    renders as well, a mismatch makes the host dynamic again.
+    '''
+
+    def __init__(self) -> None:
+        self._hosts: OrderedDict = OrderedDict()
+
+    def is_static(self, host: str) -> bool:
+        if host in STATIC_HOSTS:
+            return True
+        host_class = self._hosts.get(host)
+        return host_class is not None and host_class.static
+
+    def should_sample(self) -> bool:
+        return random.random() < STATIC_SAMPLE_RATE
+
+    async def fetch(self, url: str, proxy: str = '', user_agent: Optional[str] = None) -> Optional[Tuple[str, int]]:
+        '''Fetch document at ``url`` as ``user_agent``, ``None`` unless it is a complete HTML document.
+
+        Chrome's user agent should be used, origins may serve other documents to other clients.
+        '''
+        headers = {'User-Agent': user_agent} if user_agent else None
+        try:
+            async with http_clients.get(proxy).get(url, proxy=proxy or None, headers=headers,
+                                                   timeout=STATIC_FETCH_TIMEOUT) as res:
+                if res.status != 200 or 'html' not in res.headers.get('Content-Type', ''):
+                    return None
+                html = await res.text()
+        except (aiohttp.ClientError, UnicodeDecodeError) as e:
+            logger.info('Fetching %s without Chrome failed: %r', url, e)
+            return None
+        except asyncio.TimeoutError:
+            logger.info('Fetching %s without Chrome timed out', url)
+            return None
+        if not is_complete(html):
+            metrics.incr('static_renders_incomplete')
+            return None
+        return html, res.status
+
+    def learn(self, host: str, html: Optional[str], chrome_html: str) -> None:
+        '''Compare fetched document ``html`` of ``host``, if any, with ``chrome_html`` rendered by Chrome'''
+        host_class = self._hosts.get(host)
+        if host_class is None:
+            host_class = self._hosts[host] = HostClass()
+            while len(self._hosts) > STATIC_MAX_HOSTS:
+                self._hosts.popitem(last=False)
+        else:
+            self._hosts.move_to_end(host)
+        host_class.updated_at = time.time()
+        if html is not None and similarity(html, chrome_html) >= STATIC_SIMILARITY:
+            host_class.agreements += 1
+            if not host_class.static and host_class.agreements >= STATIC_MIN_AGREEMENTS:
+                logger.info('Host %s classified as static, rendering it without Chrome', host)
+                host_class.static = True
+        else:
+            host_class.agreements = 0
+            if host_class.static:
+                logger.info('Host %s classified as dynamic, rendering it with Chrome', host)
+                host_class.static = False
+
+    def to_dict(self) -> Dict:
+        return {host: {'static': host_class.static, 'agreements': host_class.agreements,
+                       'updated_at': host_class.updated_at}
+                for host, host_class in self._hosts.items()}
@@ -0,0 +1,206 @@
+import os
+import math
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import ujson as json
+
+from .utils import is_yesish
+from .chromerdp import PAGE_DONE_CHECK_TIMEOUT
+
+
+logger = logging.getLogger(__name__)
+
+HOST_STATS_FILE: str = os.environ.get('HOST_STATS_FILE', '/tmp/prerender-host-stats.json')
+HOST_STATS_SAVE_INTERVAL: int = int(os.environ.get('HOST_STATS_SAVE_INTERVAL', 60))
+HOST_STATS_MAX_HOSTS: int = int(os.environ.get('HOST_STATS_MAX_HOSTS', 10000))
+HOST_STATS_MAX_SAMPLES: int = int(os.environ.get('HOST_STATS_MAX_SAMPLES', 1000))
+ENABLE_ADAPTIVE_TIMEOUT: bool = is_yesish(os.environ.get('ENABLE_ADAPTIVE_TIMEOUT', '0'))
+ADAPTIVE_MIN_SAMPLES: int = int(os.environ.get('ADAPTIVE_MIN_SAMPLES', 20))
+ADAPTIVE_TIMEOUT_QUANTILE: float = float(os.environ.get('ADAPTIVE_TIMEOUT_QUANTILE', 0.99))
+ADAPTIVE_TIMEOUT_FACTOR: float = float(os.environ.get('ADAPTIVE_TIMEOUT_FACTOR', 2))
+ADAPTIVE_TIMEOUT_MIN: float = float(os.environ.get('ADAPTIVE_TIMEOUT_MIN', 5))
+ADAPTIVE_IDLE_QUANTILE: float = float(os.environ.get('ADAPTIVE_IDLE_QUANTILE', 0.9))
+# Headroom over the idle gap quantile, lets the threshold grow past the gaps it cuts renders at
+ADAPTIVE_IDLE_FACTOR: float = float(os.environ.get('ADAPTIVE_IDLE_FACTOR', 2))
+ADAPTIVE_IDLE_MIN: int = int(os.environ.get('ADAPTIVE_IDLE_MIN', 50))
+ADAPTIVE_IDLE_MAX: int = int(os.environ.get('ADAPTIVE_IDLE_MAX', 1000))
+
+
+class QuantileSketch:
+    '''Streaming quantile sketch using logarithmic buckets, quantiles have bounded relative error.
+
+    Counts are halved once more than ``max_samples`` values were added so that the sketch
+    follows recent behaviour.
+    '''
+
+    def __init__(self, relative_accuracy: float = 0.02, max_samples: int = HOST_STATS_MAX_SAMPLES) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.max_samples = max_samples
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets: Dict[int, int] = {}
+        self.count: int = 0
+
+    def add(self, value: float) -> None:
+        key = math.ceil(math.log(max(value, 1)) / self._log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        self.count += 1
+        if self.count > self.max_samples:
+            self._decay()
+
+    def _decay(self) -> None:
+        self.buckets = {key: count // 2 for key, count in self.buckets.items() if count // 2}
+        self.count = sum(self.buckets.values())
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.count += other.count
+        while self.count > self.max_samples:
+            self._decay()
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                break
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def to_dict(self) -> Dict:
+        return {'buckets': dict(self.buckets), 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, obj: Dict) -> 'QuantileSketch':
+        sketch = cls()
+        sketch.buckets = {int(key): count for key, count in obj['buckets'].items()}
+        sketch.count = obj['count']
+        return sketch
+
+
+class HostStat:
+    def __init__(self, durations: QuantileSketch = None, idle_gaps: QuantileSketch = None) -> None:
+        # Render durations and longest idle gaps of successful renders, in milliseconds
+        self.durations = durations or QuantileSketch()
+        self.idle_gaps = idle_gaps or QuantileSketch()
+
+    def timeout(self, max_timeout: float) -> float:
+        if not ENABLE_ADAPTIVE_TIMEOUT or self.durations.count < ADAPTIVE_MIN_SAMPLES:
+            return max_timeout
+        learned = self.durations.quantile(ADAPTIVE_TIMEOUT_QUANTILE) * ADAPTIVE_TIMEOUT_FACTOR / 1000
+        return min(max(learned, ADAPTIVE_TIMEOUT_MIN), max_timeout)
+
+    def idle_timeout(self) -> int:
+        if not ENABLE_ADAPTIVE_TIMEOUT or self.idle_gaps.count < ADAPTIVE_MIN_SAMPLES:
+            return PAGE_DONE_CHECK_TIMEOUT
+        # Recorded gaps are censored by the threshold in use, a gap reaching it ends the render and is never
+        # recorded. Taken as is the quantile could only go down, with headroom it grows as soon as renders
+        # get close to being cut off.
+        learned = self.idle_gaps.quantile(ADAPTIVE_IDLE_QUANTILE) * ADAPTIVE_IDLE_FACTOR
+        return int(min(max(learned, ADAPTIVE_IDLE_MIN), ADAPTIVE_IDLE_MAX))
+
+    def to_dict(self) -> Dict:
+        return {'durations': self.durations.to_dict(), 'idle_gaps': self.idle_gaps.to_dict()}
+
+    @classmethod
+    def from_dict(cls, obj: Dict) -> 'HostStat':
+        return cls(QuantileSketch.from_dict(obj['durations']), QuantileSketch.from_dict(obj['idle_gaps']))
+
+    def summary(self, max_timeout: float) -> Dict:
+        return {
+            'samples': self.durations.count,
+            'duration_p50': self.durations.quantile(0.5),
+            'duration_p90': self.durations.quantile(0.9),
+            'duration_p99': self.durations.quantile(0.99),
+            'idle_gap_p90': self.idle_gaps.quantile(0.9),
+            'timeout': self.timeout(max_timeout),
+            'idle_timeout': self.idle_timeout(),
+        }
+
+
+class HostStats:
+    '''Per-host render statistics used to derive render deadlines and page idle thresholds'''
+
+    def __init__(self, max_timeout: float, max_hosts: int = HOST_STATS_MAX_HOSTS) -> None:
+        self.max_timeout = max_timeout
+        self.max_hosts = max_hosts
+        self._hosts: OrderedDict = OrderedDict()
+        # Render durations of all hosts, in milliseconds
+        self.durations = QuantileSketch()
+
+    def timeout(self, host: str) -> float:
+        '''Render deadline of ``host`` in seconds'''
+        stat = self._hosts.get(host)
+        return stat.timeout(self.max_timeout) if stat is not None else self.max_timeout
+
+    def idle_timeout(self, host: str) -> int:
+        '''Page idle threshold of ``host`` in milliseconds'''
+        stat = self._hosts.get(host)
+        return stat.idle_timeout() if stat is not None else PAGE_DONE_CHECK_TIMEOUT
+
+    def latency(self, host: str, q: float) -> Optional[float]:
+        '''Recent render latency quantile of ``host`` in milliseconds, falls back to all hosts'''
+        stat = self._hosts.get(host)
+        if stat is not None and stat.durations.count >= ADAPTIVE_MIN_SAMPLES:
+            return stat.durations.quantile(q)
+        if self.durations.count >= ADAPTIVE_MIN_SAMPLES:
+            return self.durations.quantile(q)
+        return None
+
+    def record(self, host: str, duration: float, idle_gap: float) -> None:
+        '''Record a successful render, ``duration`` and ``idle_gap`` are in seconds'''
+        stat = self._hosts.get(host)
+        if stat is None:
+            stat = self._hosts[host] = HostStat()
+            while len(self._hosts) > self.max_hosts:
+                self._hosts.popitem(last=False)
+        else:
+            self._hosts.move_to_end(host)
+        stat.durations.add(duration * 1000)
+        stat.idle_gaps.add(idle_gap * 1000)
+        self.durations.add(duration * 1000)
+
+    def summary(self) -> Dict:
+        return {host: stat.summary(self.max_timeout) for host, stat in self._hosts.items()}
+
+    def load(self, path: str = HOST_STATS_FILE) -> None:
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                obj = json.load(f)
+            durations = None
+            if isinstance(obj.get('version'), int):
+                hosts, durations = obj['hosts'], obj['durations']
+            else:
+                # Written by earlier versions, hosts only
+                hosts = obj
+            # Least recently used first, as saved
+            for host, stat in list(hosts.items())[-self.max_hosts:] if self.max_hosts > 0 else ():
+                self._hosts[host] = HostStat.from_dict(stat)
+            if durations is not None:
+                self.durations = QuantileSketch.from_dict(durations)
+            else:
+                self.durations = QuantileSketch()
+                for stat in self._hosts.values():
+                    self.durations.merge(stat.durations)
+        except Exception:
+            logger.exception('Error loading host stats from %s', path)
+
+    def save(self, path: str = HOST_STATS_FILE) -> None:
+        if not path:
+            return
+        obj = {
+            'version': 2,
+            'hosts': {host: stat.to_dict() for host, stat in tuple(self._hosts.items())},
+            'durations': self.durations.to_dict(),
+        }
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,235 @@
+import os
+import time
+import shlex
+import shutil
+import socket
+import asyncio
+import logging
+import tempfile
+from typing import List, Dict, Tuple, Optional, Callable, Awaitable
+
+import aiohttp
+
+from .metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+CHROME_PROCESSES: int = int(os.environ.get('CHROME_PROCESSES', 0))
+CHROME_EXECUTABLE: str = os.environ.get('CHROME_EXECUTABLE', 'google-chrome')
+CHROME_ARGS: List[str] = shlex.split(os.environ.get('CHROME_ARGS', ''))
+CHROME_MAX_RSS: int = int(os.environ.get('CHROME_MAX_RSS', 2048)) * 2 ** 20
+CHROME_MONITOR_INTERVAL: float = float(os.environ.get('CHROME_MONITOR_INTERVAL', 5))
+CHROME_START_TIMEOUT: float = float(os.environ.get('CHROME_START_TIMEOUT', 30))
+
+_DEFAULT_ARGS: List[str] = [
+    '--headless',
+    '--disable-gpu',
+    '--no-first-run',
+    '--no-default-browser-check',
+    '--disable-dev-shm-usage',
+    '--disable-extensions',
+    '--disable-sync',
+    '--disable-translate',
+    '--disable-background-networking',
+    '--disable-default-apps',
+    '--mute-audio',
+    '--hide-scrollbars',
+    '--remote-debugging-address=127.0.0.1',
+]
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _process_tree_rss(pid: int) -> int:
+    '''Resident memory of process ``pid`` and all its descendants in bytes, 0 when /proc is unavailable'''
+    children: Dict[int, List[int]] = {}
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return 0
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry)) as f:
+                # comm may contain spaces, fields after it are space separated
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    rss = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open('/proc/{}/statm'.format(current)) as f:
+                rss += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            pass
+        pids.extend(children.get(current, ()))
+    return rss
+
+
+class ChromeProcess:
+    def __init__(self, session: aiohttp.ClientSession, host: str = '127.0.0.1', port: int = 0) -> None:
+        self.host = host
+        self.port = port or _free_port()
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts: int = 0
+        self.rss: int = 0
+        self.started_at: float = 0
+        self.available: bool = False
+        self._session = session
+        self._user_data_dir: Optional[str] = None
+
+    @property
+    def endpoint(self) -> Tuple[str, int]:
+        return self.host, self.port
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self) -> None:
+        self._user_data_dir = tempfile.mkdtemp(prefix='prerender-chrome-')
+        args = _DEFAULT_ARGS + CHROME_ARGS + [
+            '--remote-debugging-port={}'.format(self.port),
+            '--user-data-dir={}'.format(self._user_data_dir),
+            'about:blank',
+        ]
+        logger.info('Starting Chrome on port %d', self.port)
+        self.process = await asyncio.create_subprocess_exec(
+            CHROME_EXECUTABLE,
+            *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        self.started_at = time.time()
+        deadline = time.time() + CHROME_START_TIMEOUT
+        while not await self.ping():
+            if not self.alive:
+                raise RuntimeError('Chrome exited with code {} on start'.format(self.process.returncode))
+            if time.time() >= deadline:
+                await self.stop()
+                raise RuntimeError('Chrome not ready in {}s'.format(CHROME_START_TIMEOUT))
+            await asyncio.sleep(0.1)
+        self.available = True
+        logger.info('Chrome %d started on port %d', self.process.pid, self.port)
+
+    async def stop(self) -> None:
+        self.available = False
+        if self.alive:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+        if self._user_data_dir:
+            shutil.rmtree(self._user_data_dir, ignore_errors=True)
+            self._user_data_dir = None
+
+    async def ping(self) -> bool:
+        try:
+            url = 'http://{}:{}/json/version'.format(self.host, self.port)
+            async with self._session.get(url, timeout=5) as res:
+                return res.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    def to_dict(self) -> Dict:
+        return {
+            'pid': self.process.pid if self.process else None,
+            'port': self.port,
+            'alive': self.alive,
+            'available': self.available,
+            'rss': self.rss,
+            'restarts': self.restarts,
+            'started_at': self.started_at,
+        }
+
+
+class ChromeSupervisor:
+    '''Launch headless Chrome processes and restart them when they crash, hang or use too much memory.
+
+    ``on_availability_change`` is called with the endpoint and whether it is available,
+    so that rendering can move away from a Chrome while it restarts.
+    '''
+
+    def __init__(self, processes: int = CHROME_PROCESSES, loop=None) -> None:
+        self.loop = loop
+        self._session = aiohttp.ClientSession(loop=loop)
+        self.processes = [ChromeProcess(self._session) for _ in range(processes)]
+        self.on_availability_change: Optional[Callable[[Tuple[str, int], bool], Awaitable[None]]] = None
+        self._monitor_task: Optional[asyncio.Future] = None
+
+    @property
+    def endpoints(self) -> List[Tuple[str, int]]:
+        return [process.endpoint for process in self.processes]
+
+    async def start(self) -> List[Tuple[str, int]]:
+        results = await asyncio.gather(*[process.start() for process in self.processes], return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # Do not leave the Chromes that did start running without a supervisor
+            await asyncio.gather(*[process.stop() for process in self.processes])
+            raise errors[0]
+        self._monitor_task = asyncio.ensure_future(self._monitor(), loop=self.loop)
+        return self.endpoints
+
+    async def stop(self) -> None:
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+        await asyncio.gather(*[process.stop() for process in self.processes])
+        await self._session.close()
+
+    async def _monitor(self) -> None:
+        unresponsive: Dict[int, int] = {}
+        while True:
+            await asyncio.sleep(CHROME_MONITOR_INTERVAL)
+            for process in self.processes:
+                reason = None
+                if not process.alive:
+                    reason = 'crashed'
+                else:
+                    process.rss = await self.loop.run_in_executor(None, _process_tree_rss, process.process.pid)
+                    if CHROME_MAX_RSS > 0 and process.rss > CHROME_MAX_RSS:
+                        reason = 'using {}MB memory'.format(process.rss // 2 ** 20)
+                    elif not await process.ping():
+                        unresponsive[process.port] = unresponsive.get(process.port, 0) + 1
+                        if unresponsive[process.port] >= 3:
+                            reason = 'unresponsive'
+                    else:
+                        unresponsive.pop(process.port, None)
+                if reason is not None:
+                    unresponsive.pop(process.port, None)
+                    try:
+                        await self.restart(process, reason)
+                    except Exception:
+                        logger.exception('Error restarting Chrome on port %d', process.port)
+
+    async def restart(self, process: ChromeProcess, reason: str = '') -> None:
+        logger.warning('Restarting Chrome on port %d: %s', process.port, reason)
+        metrics.incr('chrome_restarts')
+        process.restarts += 1
+        await self._notify(process, False)
+        await process.stop()
+        await process.start()
+        await self._notify(process, True)
+
+    async def _notify(self, process: ChromeProcess, available: bool) -> None:
+        if self.on_availability_change is not None:
+            try:
+                await self.on_availability_change(process.endpoint, available)
+            except Exception:
+                logger.exception('Error handling Chrome availability change on port %d', process.port)
+
+    def to_dict(self) -> List[Dict]:
+        return [process.to_dict() for process in self.processes]
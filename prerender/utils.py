@@ -24,3 +24,22 @@ def remove_meta_fragment_tag(html: str) -> str:
 
 def is_yesish(value: str) -> bool:
     return value.lower() in ('1', 'true', 'yes', 'y', 'on', 't')
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    '''Whether an ``Accept-Encoding`` header accepts ``encoding``, honouring q-values and ``*``'''
+    qvalues = {}
+    for token in accept_encoding.lower().split(','):
+        name, *params = [part.strip() for part in token.split(';')]
+        if not name:
+            continue
+        qvalue = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0
+        qvalues[name] = qvalue
+    return qvalues.get(encoding.lower(), qvalues.get('*', 0)) > 0
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+'''Stand-in for a headless Chrome executable, serving ``/json/version`` on ``--remote-debugging-port``.
+
+``FAKE_CHROME_MODE`` selects how it misbehaves once it served its first request:
+``ok`` keeps serving, ``crash`` exits and ``hang`` stops accepting connections while staying alive.
+With ``FAKE_CHROME_ONCE`` set to a path, only the first process misbehaves and the next ones keep serving.
+'''
+import os
+import sys
+import time
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+MODE = os.environ.get('FAKE_CHROME_MODE', 'ok')
+ONCE = os.environ.get('FAKE_CHROME_ONCE')
+if ONCE:
+    if os.path.exists(ONCE):
+        MODE = 'ok'
+    else:
+        open(ONCE, 'w').close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps({'Browser': 'FakeChrome/1.0', 'pid': os.getpid()}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if MODE != 'ok':
+            threading.Thread(target=misbehave, args=(self.server,), daemon=True).start()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def misbehave(server):
+    time.sleep(0.2)
+    if MODE == 'crash':
+        os._exit(1)
+    server.shutdown()
+    server.server_close()
+
+
+def main():
+    port = next(int(arg.split('=', 1)[1]) for arg in sys.argv if arg.startswith('--remote-debugging-port='))
+    server = HTTPServer(('127.0.0.1', port), Handler)
+    server.serve_forever()
+    # Hung: alive but unreachable
+    while True:
+        time.sleep(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from prerender import blocklist
+from prerender.blocklist import LearnedBlocklist, site, BLOCK, TIMEBOX, ALLOW
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(blocklist, 'BLOCKLIST_MIN_DELAY', 500)
+    monkeypatch.setattr(blocklist, 'BLOCKLIST_THRESHOLD', 3)
+    monkeypatch.setattr(blocklist, 'BLOCKLIST_HALF_LIFE', 3600)
+
+
+@pytest.mark.parametrize('host, expected', [
+    ('example.com', 'example.com'),
+    ('www.example.com', 'example.com'),
+    ('cdn.static.Example.COM.', 'example.com'),
+    ('www.example.co.uk', 'example.co.uk'),
+    ('shop.example.com.cn', 'example.com.cn'),
+    # Not a second-level label, the country code TLD is the suffix
+    ('a.example.io', 'example.io'),
+    ('localhost', 'localhost'),
+    ('192.168.0.1', '192.168.0.1'),
+    ('::1', '::1'),
+])
+def test_site(host, expected):
+    assert site(host) == expected
+
+
+def _delayed_by(host: str, resource_types=('Script',), delay: float = 1):
+    now = time.time()
+    return {'www.example.com': (now, {'Document'}), host: (now + delay, set(resource_types))}
+
+
+def test_learns_delaying_host():
+    learned = LearnedBlocklist(learn=True)
+    for _ in range(2):
+        learned.record('www.example.com', _delayed_by('tracker.net'))
+    assert learned.action('tracker.net') is None
+    learned.record('www.example.com', _delayed_by('tracker.net'))
+    assert learned.action('tracker.net') == TIMEBOX
+    assert learned.actions() == ([], {'tracker.net'})
+
+
+def test_blocks_hosts_requested_for_non_dom_resources_only():
+    learned = LearnedBlocklist(learn=True)
+    for _ in range(3):
+        learned.record('www.example.com', _delayed_by('pixels.net', ('Image', 'Ping')))
+    assert learned.action('pixels.net') == BLOCK
+
+
+def test_ignores_short_delays_first_parties_and_overridden_hosts():
+    learned = LearnedBlocklist(learn=True)
+    learned.set_override('allowed.net', ALLOW)
+    for _ in range(3):
+        learned.record('www.example.com', _delayed_by('slow.net', delay=0.1))
+        learned.record('www.example.com', _delayed_by('static.example.com'))
+        learned.record('www.example.com', _delayed_by('allowed.net'))
+    assert learned.to_dict()['learned'] == {}
+    assert learned.action('allowed.net') is None
+
+
+def test_not_learning():
+    learned = LearnedBlocklist(learn=False)
+    for _ in range(3):
+        learned.record('www.example.com', _delayed_by('tracker.net'))
+    assert learned.action('tracker.net') is None
+
+
+def test_score_decays():
+    learned = LearnedBlocklist(learn=True)
+    for _ in range(3):
+        learned.record('www.example.com', _delayed_by('tracker.net'))
+    # Listed until the score decays below half the threshold
+    assert learned.action('tracker.net', time.time() + 3000) == TIMEBOX
+    assert learned.action('tracker.net', time.time() + 2 * 3600) is None
+    assert learned.action('tracker.net') is None
+
+
+def test_overrides():
+    learned = LearnedBlocklist(learn=True)
+    learned.set_override('ads.net', BLOCK)
+    learned.set_override('widgets.net', TIMEBOX)
+    assert learned.actions() == (['ads.net'], {'widgets.net'})
+    learned.set_override('ads.net', None)
+    assert learned.actions() == ([], {'widgets.net'})
+    with pytest.raises(ValueError):
+        learned.set_override('ads.net', 'drop')
+
+
+def test_max_hosts():
+    learned = LearnedBlocklist(learn=True, max_hosts=2)
+    for host in ('a.net', 'b.net', 'c.net'):
+        learned.record('www.example.com', _delayed_by(host))
+    assert sorted(learned.to_dict()['learned']) == ['b.net', 'c.net']
@@ -0,0 +1,92 @@
+import time
+
+from prerender.breaker import CircuitBreaker, CircuitBreakers
+
+
+def _open(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.maximum_failures):
+        breaker.record_failure()
+
+
+def _expire(breaker: CircuitBreaker) -> None:
+    breaker.opened_at = time.time() - breaker.reset_timeout
+
+
+def test_opens_after_maximum_failures():
+    breaker = CircuitBreaker('example.com', maximum_failures=3, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allows_execution()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allows_execution()
+    assert 1 <= breaker.retry_after <= 61
+
+
+def test_success_resets_failures():
+    breaker = CircuitBreaker('example.com', maximum_failures=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_a_single_trial_through():
+    breaker = CircuitBreaker('example.com', maximum_failures=1, reset_timeout=60)
+    _open(breaker)
+    _expire(breaker)
+    assert breaker.allows_execution()
+    assert breaker.acquire_trial()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allows_execution()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allows_execution()
+
+
+def test_failed_trial_opens_again():
+    breaker = CircuitBreaker('example.com', maximum_failures=1, reset_timeout=60)
+    _open(breaker)
+    _expire(breaker)
+    assert breaker.acquire_trial()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allows_execution()
+
+
+def test_released_trial_lets_another_request_try():
+    breaker = CircuitBreaker('example.com', maximum_failures=1, reset_timeout=60)
+    _open(breaker)
+    _expire(breaker)
+    assert breaker.acquire_trial()
+    breaker.release_trial()
+    assert breaker.allows_execution()
+    assert breaker.acquire_trial()
+
+
+def test_closed_breaker_has_no_trial():
+    assert not CircuitBreaker('example.com').acquire_trial()
+
+
+def test_transitions_are_recorded():
+    breakers = CircuitBreakers()
+    breaker = breakers['example.com']
+    _open(breaker)
+    _expire(breaker)
+    assert breaker.acquire_trial()
+    breaker.record_success()
+    assert [(t['from'], t['to']) for t in breakers.transitions] == [
+        (CircuitBreaker.CLOSED, CircuitBreaker.OPEN),
+        (CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN),
+        (CircuitBreaker.HALF_OPEN, CircuitBreaker.CLOSED),
+    ]
+    assert breakers.to_dict()['breakers'] == {}
+
+
+def test_only_closed_breakers_are_evicted():
+    breakers = CircuitBreakers(max_entries=2)
+    _open(breakers['a.com'])
+    breakers['b.com']
+    breakers['c.com']
+    assert set(breakers.to_dict()['breakers']) == {'a.com'}
+    assert len(breakers._breakers) == 2
@@ -0,0 +1,194 @@
+import time
+import socket
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from prerender.cluster import Cluster, HashRing, HotEntry, canonical_url, FORWARDED_HEADER
+from prerender.httpclient import http_clients
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _owned_by(cluster: Cluster, node: str) -> str:
+    return next(url for url in ('http://example.com/{}'.format(i) for i in range(1000))
+                if cluster.owner(url) == node)
+
+
+def test_canonical_url():
+    assert canonical_url('HTTP://Example.COM') == 'http://example.com/'
+    assert canonical_url('http://example.com/Path?b=1&a=2#top') == 'http://example.com/Path?b=1&a=2'
+
+
+def test_hash_ring_is_deterministic_and_balanced():
+    nodes = ['http://a:8000', 'http://b:8000', 'http://c:8000']
+    keys = ['http://example.com/{}'.format(i) for i in range(3000)]
+    ring = HashRing(nodes)
+    assert [ring.get_node(key) for key in keys] == [HashRing(list(reversed(nodes))).get_node(key) for key in keys]
+    counts = {node: 0 for node in nodes}
+    for key in keys:
+        counts[ring.get_node(key)] += 1
+    assert all(count > len(keys) / len(nodes) / 2 for count in counts.values())
+
+
+def test_hash_ring_only_moves_keys_of_removed_node():
+    nodes = ['http://a:8000', 'http://b:8000', 'http://c:8000']
+    ring = HashRing(nodes)
+    smaller = HashRing(nodes[:2])
+    for key in ('http://example.com/{}'.format(i) for i in range(1000)):
+        if ring.get_node(key) != nodes[2]:
+            assert smaller.get_node(key) == ring.get_node(key)
+
+
+def test_empty_hash_ring():
+    assert HashRing([]).get_node('http://example.com/') is None
+
+
+def test_self_must_be_a_peer():
+    with pytest.raises(ValueError):
+        Cluster(['http://a:8000'], 'http://b:8000')
+
+
+def test_should_forward():
+    peers = ['http://a:8000', 'http://b:8000']
+    cluster = Cluster(peers, peers[0])
+    mine = _owned_by(cluster, peers[0])
+    theirs = _owned_by(cluster, peers[1])
+    assert not cluster.should_forward(mine, {})
+    assert cluster.should_forward(theirs, {})
+    assert cluster.should_forward(theirs.replace('http://example.com', 'HTTP://EXAMPLE.COM'), {})
+    # Forwarded by a peer, never forwarded again
+    assert not cluster.should_forward(theirs, {FORWARDED_HEADER: peers[1]})
+
+
+class Node:
+    '''A cluster node serving renders the way the app does: forward when not the owner, else "render"'''
+
+    def __init__(self, me: str, peers) -> None:
+        self.cluster = Cluster(peers, me)
+        self.rendered = []
+        self.forwarded_by = []
+        self.purged = []
+
+    async def handle(self, request):
+        url = request.match_info['url']
+        if self.cluster.should_forward(url, request.headers):
+            owner, entry = await self.cluster.forward(url, 'html')
+            return web.Response(body=entry.body, status=entry.status, headers={'X-Prerender-Peer': owner})
+        self.rendered.append(url)
+        self.forwarded_by.append(request.headers.get(FORWARDED_HEADER))
+        return web.Response(text='rendered by {}'.format(self.cluster.me))
+
+    async def purge(self, request):
+        self.purged.append((dict(request.query), request.headers.get(FORWARDED_HEADER)))
+        deleted = self.cluster.invalidate_hot(request.query.get('url'), request.query.get('format'),
+                                              request.query.get('host'))
+        return web.json_response({'deleted': deleted})
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.run_until_complete(http_clients.close())
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def _run_nodes(loop, peer_lists, scenario):
+    '''Run one local HTTP node per peer list, ``peer_lists[i]`` being the peers node ``i`` knows about'''
+    ports = [_free_port() for _ in peer_lists]
+    urls = ['http://127.0.0.1:{}'.format(port) for port in ports]
+    # A peer is the index of a node, or a (host, index) pair to name that node by another host
+    peer_lists = [[urls[peer] if isinstance(peer, int) else 'http://{}:{}'.format(peer[0], ports[peer[1]])
+                   for peer in peers] for peers in peer_lists]
+
+    async def run():
+        runners = []
+        nodes = []
+        try:
+            for url, port, peers in zip(urls, ports, peer_lists):
+                node = Node(url, peers)
+                app = web.Application()
+                app.router.add_get('/html/{url:.*}', node.handle)
+                app.router.add_delete('/cache', node.purge)
+                runner = web.AppRunner(app)
+                await runner.setup()
+                await web.TCPSite(runner, '127.0.0.1', port).start()
+                runners.append(runner)
+                nodes.append(node)
+            return await scenario(nodes, urls)
+        finally:
+            for runner in runners:
+                await runner.cleanup()
+
+    return loop.run_until_complete(run())
+
+
+def test_forward_to_owner(loop):
+    async def scenario(nodes, urls):
+        url = _owned_by(nodes[0].cluster, urls[1])
+        owner, entry = await nodes[0].cluster.forward(url, 'html')
+        assert owner == urls[1]
+        assert entry.status == 200
+        assert entry.body == 'rendered by {}'.format(urls[1]).encode('utf-8')
+        assert nodes[1].rendered == [url]
+        assert nodes[1].forwarded_by == [urls[0]]
+        assert nodes[0].cluster.get_hot(url, 'html') is not None
+        assert nodes[0].rendered == []
+
+    _run_nodes(loop, [[0, 1], [0, 1]], scenario)
+
+
+def test_forwarded_requests_do_not_bounce(loop):
+    '''Nodes disagreeing on the owner render forwarded requests themselves instead of forwarding them back'''
+    async def scenario(nodes, urls):
+        # Node 1 names node 0 differently, the nodes disagree on the owner of this URL
+        other = nodes[1].cluster.ring.nodes[0]
+        url = next(url for url in ('http://example.com/{}'.format(i) for i in range(1000))
+                   if nodes[0].cluster.owner(url) == urls[1] and nodes[1].cluster.owner(url) == other)
+        owner, entry = await nodes[0].cluster.forward(url, 'html')
+        assert entry.status == 200
+        assert nodes[1].rendered == [url]
+        assert nodes[0].rendered == []
+
+    _run_nodes(loop, [[0, 1], [('localhost', 0), 1]], scenario)
+
+
+def test_invalidate_hot():
+    peers = ['http://a:8000', 'http://b:8000']
+    cluster = Cluster(peers, peers[0])
+    for url, format in (('http://example.com/a', 'html'), ('http://example.com/a', 'pdf'),
+                        ('http://example.com/b', 'html'), ('http://other.com/a', 'html')):
+        cluster._set_hot(url, format, HotEntry(200, b'', 'text/html', {}, time.time() + 60))
+    assert cluster.invalidate_hot('HTTP://EXAMPLE.COM/a', 'pdf') == 1
+    assert cluster.get_hot('http://example.com/a', 'html') is not None
+    assert cluster.invalidate_hot('http://example.com/a') == 1
+    assert cluster.invalidate_hot(host='Example.com') == 1
+    assert cluster.get_hot('http://other.com/a', 'html') is not None
+
+
+def test_purge_peers(loop):
+    async def scenario(nodes, urls):
+        url = _owned_by(nodes[0].cluster, urls[1])
+        await nodes[0].cluster.forward(url, 'html')
+        assert nodes[0].cluster.get_hot(url, 'html') is not None
+        assert await nodes[1].cluster.purge_peers(url) == 1
+        assert nodes[0].cluster.get_hot(url, 'html') is None
+        assert nodes[0].purged == [({'url': url}, urls[1])]
+        assert nodes[1].purged == []
+
+    _run_nodes(loop, [[0, 1], [0, 1]], scenario)
+
+
+def test_purge_unreachable_peer(loop):
+    peers = ['http://127.0.0.1:{}'.format(_free_port()) for _ in range(2)]
+    cluster = Cluster(peers, peers[0])
+    # Logged, not raised, so that the local purge still succeeds
+    assert loop.run_until_complete(cluster.purge_peers(host='example.com')) == 0
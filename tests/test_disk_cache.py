@@ -0,0 +1,50 @@
+import os
+import time
+import asyncio
+
+import pytest
+
+from prerender.cache import disk
+from prerender.cache.disk import DiskCache
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture(params=[False, True], ids=['plain', 'dedup'])
+def cache(request, monkeypatch, tmp_path):
+    monkeypatch.setattr(disk, 'CACHE_ROOT_DIR', str(tmp_path))
+    monkeypatch.setattr(disk, 'ENABLE_CACHE_DEDUP', request.param)
+    return DiskCache()
+
+
+@pytest.mark.parametrize('payload', [b'<html></html>', os.urandom(256 * 1024)], ids=['inline', 'file'])
+def test_modified_since_is_the_time_stored(loop, cache, payload):
+    before = time.time()
+    cache.set('http://example.com/', payload, 60)
+    assert loop.run_until_complete(cache.get('http://example.com/')) == payload
+    modified_since = loop.run_until_complete(cache.modified_since('http://example.com/'))
+    assert before <= modified_since <= time.time()
+
+
+def test_missing_entry(loop, cache):
+    assert loop.run_until_complete(cache.get('http://example.com/')) is None
+    assert loop.run_until_complete(cache.modified_since('http://example.com/')) is None
+    assert loop.run_until_complete(cache.etag('http://example.com/')) is None
+
+
+def test_set_many_and_purge_host(loop, cache):
+    cache.set_many([('http://a.com/{}'.format(i), str(i).encode(), 60, 'html') for i in range(20)]
+                   + [('http://b.com/', b'b', None, 'pdf')])
+    assert loop.run_until_complete(cache.get('http://a.com/7')) == b'7'
+    assert loop.run_until_complete(cache.get('http://b.com/', 'pdf')) == b'b'
+    assert cache.purge_host('a.com') == 20
+    assert loop.run_until_complete(cache.get('http://a.com/7')) is None
+    assert cache.delete('http://b.com/') == 1
+    assert loop.run_until_complete(cache.get('http://b.com/', 'pdf')) is None
@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from prerender.cache import negative
+from prerender.cache.negative import NegativeCache, outcome_class
+
+
+URL = 'http://example.com/'
+
+
+@pytest.fixture(autouse=True)
+def ttls(monkeypatch):
+    monkeypatch.setattr(negative, 'NEGATIVE_CACHE_TTLS', {
+        'timeout': 30,
+        'unavailable': 30,
+        'redirect': 300,
+        'not_found': 300,
+        'client_error': 0,
+        'server_error': 30,
+    })
+    monkeypatch.setattr(negative, 'NEGATIVE_CACHE_BACKOFF', 2)
+    monkeypatch.setattr(negative, 'NEGATIVE_CACHE_MAX_TTL', 100)
+
+
+def _expire(cache: NegativeCache, key: str, ago: float = 0, format: str = 'html') -> None:
+    cache._entries[key + format].expires_at = time.time() - ago
+
+
+@pytest.mark.parametrize('status_code, outcome', [
+    (200, None), (301, 'redirect'), (404, 'not_found'), (410, 'client_error'),
+    (500, 'server_error'), (503, 'unavailable'), (504, 'timeout'),
+])
+def test_outcome_class(status_code, outcome):
+    assert outcome_class(status_code) == outcome
+
+
+def test_ttl_per_outcome():
+    cache = NegativeCache()
+    cache.set(URL, 504)
+    assert 29 <= cache.get(URL).ttl <= 30
+    # Disabled outcomes and successes are not cached
+    cache.set('http://example.com/gone', 410)
+    cache.set('http://example.com/ok', 200)
+    assert cache.get('http://example.com/gone') is None
+    assert cache.get('http://example.com/ok') is None
+    assert cache.get(URL, 'pdf') is None
+
+
+def test_payload_kept_for_not_found_and_redirects_only():
+    cache = NegativeCache()
+    cache.set(URL, 404, b'not found')
+    cache.set(URL, 500, b'error', format='pdf')
+    assert cache.get(URL).payload == b'not found'
+    assert cache.get(URL, 'pdf').payload is None
+
+
+def test_ttl_backs_off_up_to_max_ttl():
+    cache = NegativeCache()
+    ttls = []
+    for _ in range(4):
+        cache.set(URL, 504)
+        ttls.append(cache.get(URL).ttl)
+        _expire(cache, URL)
+    for ttl, expected in zip(ttls, (30, 60, 100, 100)):
+        assert expected - 1 <= ttl <= expected
+
+
+def test_failure_history_is_forgotten():
+    cache = NegativeCache()
+    cache.set(URL, 504)
+    cache.set(URL, 504)
+    assert cache.get(URL).failures == 2
+    _expire(cache, URL, ago=100)
+    cache.set(URL, 504)
+    assert cache.get(URL).failures == 1
+    _expire(cache, URL, ago=100)
+    assert cache.get(URL) is None
+    assert len(cache) == 0
+
+
+def test_max_entries():
+    cache = NegativeCache(max_entries=2)
+    for i in range(3):
+        cache.set('http://example.com/{}'.format(i), 504)
+    assert cache.get('http://example.com/0') is None
+    assert len(cache) == 2
+
+
+def test_delete_and_purge_host():
+    cache = NegativeCache()
+    cache.set(URL, 504)
+    cache.set(URL, 504, format='pdf')
+    cache.set('http://other.com/', 504)
+    cache.delete(URL, 'pdf')
+    assert cache.get(URL, 'pdf') is None
+    cache.purge_host('example.com')
+    assert cache.get(URL) is None
+    assert cache.get('http://other.com/') is not None
@@ -0,0 +1,95 @@
+from prerender.network import NetworkLog
+
+
+def _sent(log: NetworkLog, request_id: str, url: str, now: float, type: str = 'Script', timeboxed: bool = False):
+    return log.request_will_be_sent({'requestId': request_id, 'request': {'url': url}, 'type': type}, now,
+                                    timeboxed=timeboxed)
+
+
+def _received(log: NetworkLog, request_id: str, url: str, now: float, status: int = 200,
+              headers=None, document_url=None):
+    response = {'url': url, 'status': status, 'mimeType': 'text/html', 'headers': headers or {}}
+    return log.response_received({'requestId': request_id, 'response': response}, now, document_url)
+
+
+def _failed(log: NetworkLog, request_id: str, now: float, **params):
+    return log.response_received(dict(params, requestId=request_id), now)
+
+
+def test_counts_finished_and_succeeded_requests():
+    log = NetworkLog()
+    _sent(log, '1', 'http://example.com/', 0, 'Document')
+    _sent(log, '2', 'http://example.com/app.js', 1)
+    _sent(log, '3', 'http://example.com/missing.js', 1)
+    _sent(log, '4', 'http://ads.net/ad.js', 1)
+    assert log.success_rate() == 1
+    _received(log, '1', 'http://example.com/', 2)
+    _received(log, '2', 'http://example.com/app.js', 2)
+    _received(log, '3', 'http://example.com/missing.js', 2, status=404)
+    # Blocked by the page itself, counts as success
+    _failed(log, '4', 2, blockedReason='inspector')
+    assert len(log) == 4
+    assert log.succeeded == 3
+    assert log.success_rate() == 0.75
+
+
+def test_last_event_wins():
+    log = NetworkLog()
+    _sent(log, '1', 'http://example.com/app.js', 0)
+    _received(log, '1', 'http://example.com/app.js', 1)
+    request = _failed(log, '1', 2, errorText='net::ERR_ABORTED')
+    assert request.status is None
+    assert (len(log), log.succeeded) == (1, 0)
+
+
+def test_redirects_keep_the_request():
+    log = NetworkLog()
+    _sent(log, '1', 'http://example.com/', 0, 'Document')
+    request = _sent(log, '1', 'https://example.com/', 1, 'Document')
+    assert request.url == 'https://example.com/'
+    assert request.started_at == 0
+    assert len(log.requests) == 1
+
+
+def test_document_status_and_validators():
+    log = NetworkLog()
+    url = 'https://example.com/'
+    _sent(log, '1', url, 0, 'Document')
+    _received(log, '1', url, 1, status=203, headers={'ETag': '"v1"', 'Last-Modified': 'Sat, 01 Jan 2022 00:00:00 GMT'},
+              document_url=url)
+    # Another response of the same URL does not replace the main document one
+    _sent(log, '2', url, 2, 'XHR')
+    _received(log, '2', url, 3, status=500, document_url=url)
+    assert log.document_status(url) == 203
+    assert log.document_validators(url) == {'etag': '"v1"', 'last_modified': 'Sat, 01 Jan 2022 00:00:00 GMT'}
+    assert log.document_status('https://example.com/other') is None
+    assert log.document_validators('https://example.com/other') is None
+
+
+def test_expired_timeboxed_requests():
+    log = NetworkLog(timeboxed_hosts=['slow.net'], timebox=1000)
+    _sent(log, '1', 'http://slow.net/widget.js', 10, timeboxed=True)
+    _sent(log, '2', 'http://example.com/app.js', 10, timeboxed=True)
+    _sent(log, '3', 'http://slow.net/other.js', 10)
+    assert log.expired_timeboxed(10.5) == 0
+    assert log.expired_timeboxed(11) == 1
+    _received(log, '1', 'http://slow.net/widget.js', 11.5)
+    assert log.expired_timeboxed(12) == 0
+
+
+def test_host_activity():
+    log = NetworkLog()
+    _sent(log, '1', 'http://example.com/', 0, 'Document')
+    _sent(log, '2', 'http://cdn.net/a.png', 0, 'Image')
+    _sent(log, '3', 'http://cdn.net/b.js', 0, 'Script')
+    _sent(log, '4', 'data:image/png;base64,', 0, 'Image')
+    _received(log, '1', 'http://example.com/', 1)
+    _received(log, '2', 'http://cdn.net/a.png', 3)
+    _received(log, '3', 'http://cdn.net/b.js', 2)
+    assert log.host_activity(5) == {
+        'example.com': (1, {'Document'}),
+        'cdn.net': (3, {'Image', 'Script'}),
+    }
+    # Pending requests count as now
+    _sent(log, '5', 'http://example.com/late.js', 4)
+    assert log.host_activity(5)['example.com'] == (5, {'Document', 'Script'})
@@ -0,0 +1,49 @@
+import socket
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from prerender.static import StaticRenderer
+from prerender.httpclient import http_clients
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.run_until_complete(http_clients.close())
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_fetch_as_chrome(loop):
+    user_agents = []
+
+    async def handle(request):
+        user_agents.append(request.headers.get('User-Agent'))
+        return web.Response(text='<html><body><p>{}</p></body></html>'.format(' word' * 100),
+                            content_type='text/html')
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        port = _free_port()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        try:
+            return await StaticRenderer().fetch('http://127.0.0.1:{}/'.format(port), user_agent='Prerender Chrome/1.0')
+        finally:
+            await runner.cleanup()
+
+    html, status_code = loop.run_until_complete(run())
+    assert status_code == 200
+    assert user_agents == ['Prerender Chrome/1.0']
@@ -0,0 +1,100 @@
+import ujson as json
+
+import pytest
+
+from prerender import stats
+from prerender.stats import QuantileSketch, HostStats
+
+
+@pytest.fixture(autouse=True)
+def adaptive(monkeypatch):
+    monkeypatch.setattr(stats, 'ENABLE_ADAPTIVE_TIMEOUT', True)
+    monkeypatch.setattr(stats, 'ADAPTIVE_MIN_SAMPLES', 20)
+
+
+def test_quantile_sketch_relative_accuracy():
+    sketch = QuantileSketch(relative_accuracy=0.02, max_samples=100000)
+    for value in range(1, 10001):
+        sketch.add(value)
+    for q in (0.5, 0.9, 0.99):
+        assert sketch.quantile(q) == pytest.approx(q * 10000, rel=0.03)
+
+
+def test_quantile_sketch_decays_to_recent_values():
+    sketch = QuantileSketch(max_samples=100)
+    for _ in range(100):
+        sketch.add(100)
+    for _ in range(400):
+        sketch.add(5000)
+    assert sketch.count <= 100
+    assert sketch.quantile(0.5) == pytest.approx(5000, rel=0.03)
+
+
+def test_empty_sketch():
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_host_timeout_is_learned_once_enough_samples():
+    host_stats = HostStats(max_timeout=30)
+    for _ in range(19):
+        host_stats.record('example.com', 4, 0.05)
+    assert host_stats.timeout('example.com') == 30
+    host_stats.record('example.com', 4, 0.05)
+    assert host_stats.timeout('example.com') == pytest.approx(4 * stats.ADAPTIVE_TIMEOUT_FACTOR, rel=0.03)
+    assert host_stats.timeout('other.com') == 30
+    assert host_stats.idle_timeout('example.com') == pytest.approx(50 * stats.ADAPTIVE_IDLE_FACTOR, rel=0.03)
+
+
+def test_host_timeout_is_bounded():
+    host_stats = HostStats(max_timeout=30)
+    for _ in range(20):
+        host_stats.record('fast.com', 0.1, 0.001)
+        host_stats.record('slow.com', 60, 10)
+    assert host_stats.timeout('fast.com') == stats.ADAPTIVE_TIMEOUT_MIN
+    assert host_stats.timeout('slow.com') == 30
+    assert host_stats.idle_timeout('fast.com') == stats.ADAPTIVE_IDLE_MIN
+    assert host_stats.idle_timeout('slow.com') == stats.ADAPTIVE_IDLE_MAX
+
+
+def test_latency_falls_back_to_all_hosts():
+    host_stats = HostStats(max_timeout=30)
+    for i in range(20):
+        host_stats.record('host{}.com'.format(i), 1, 0.05)
+    assert host_stats.latency('host0.com', 0.5) == pytest.approx(1000, rel=0.03)
+    assert host_stats.latency('other.com', 0.5) == pytest.approx(1000, rel=0.03)
+
+
+def test_least_recently_used_hosts_are_evicted():
+    host_stats = HostStats(max_timeout=30, max_hosts=2)
+    host_stats.record('a.com', 1, 0.05)
+    host_stats.record('b.com', 1, 0.05)
+    host_stats.record('a.com', 1, 0.05)
+    host_stats.record('c.com', 1, 0.05)
+    assert list(host_stats.summary()) == ['a.com', 'c.com']
+
+
+def test_save_and_load_restore_global_durations_and_bound(tmp_path):
+    path = str(tmp_path / 'stats.json')
+    host_stats = HostStats(max_timeout=30)
+    for i in range(30):
+        host_stats.record('host{}.com'.format(i), 1, 0.05)
+    host_stats.save(path)
+
+    loaded = HostStats(max_timeout=30, max_hosts=10)
+    loaded.load(path)
+    assert list(loaded.summary()) == ['host{}.com'.format(i) for i in range(20, 30)]
+    assert loaded.durations.count == 30
+    assert loaded.latency('other.com', 0.5) == pytest.approx(1000, rel=0.03)
+
+
+def test_load_hosts_only_file(tmp_path):
+    path = tmp_path / 'stats.json'
+    host_stats = HostStats(max_timeout=30)
+    for _ in range(20):
+        host_stats.record('example.com', 1, 0.05)
+    path.write_text(json.dumps({host: stat.to_dict() for host, stat in host_stats._hosts.items()}))
+
+    loaded = HostStats(max_timeout=30)
+    loaded.load(str(path))
+    assert loaded.timeout('example.com') == host_stats.timeout('example.com')
+    assert loaded.durations.count == 20
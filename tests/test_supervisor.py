@@ -0,0 +1,113 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+from prerender import supervisor
+from prerender.supervisor import ChromeSupervisor
+
+
+FAKE_CHROME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_chrome.py')
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture(autouse=True)
+def fake_chrome(monkeypatch, tmp_path):
+    monkeypatch.setattr(supervisor, 'CHROME_EXECUTABLE', sys.executable)
+    monkeypatch.setattr(supervisor, '_DEFAULT_ARGS', [FAKE_CHROME])
+    monkeypatch.setattr(supervisor, 'CHROME_ARGS', [])
+    monkeypatch.setattr(supervisor, 'CHROME_MONITOR_INTERVAL', 0.1)
+    monkeypatch.setattr(supervisor, 'CHROME_START_TIMEOUT', 5)
+    monkeypatch.setattr(supervisor, 'CHROME_MAX_RSS', 0)
+    monkeypatch.setenv('FAKE_CHROME_ONCE', str(tmp_path / 'misbehaved'))
+
+
+async def _wait_for(condition, timeout: float = 10) -> None:
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_event_loop().time() < deadline, 'condition not met in {}s'.format(timeout)
+        await asyncio.sleep(0.05)
+
+
+def _run_supervisor(loop, mode: str, monkeypatch):
+    monkeypatch.setenv('FAKE_CHROME_MODE', mode)
+    changes = []
+
+    async def on_availability_change(endpoint, available):
+        changes.append((endpoint, available))
+
+    async def run():
+        chrome = ChromeSupervisor(1, loop=loop)
+        chrome.on_availability_change = on_availability_change
+        try:
+            endpoints = await chrome.start()
+            process = chrome.processes[0]
+            first_pid = process.process.pid
+            if mode != 'ok':
+                await _wait_for(lambda: process.restarts >= 1 and process.available)
+            assert await process.ping()
+            return endpoints, process, first_pid
+        finally:
+            await chrome.stop()
+
+    endpoints, process, first_pid = loop.run_until_complete(run())
+    return endpoints, process, first_pid, changes
+
+
+def test_start_and_stop(loop, monkeypatch):
+    endpoints, process, first_pid, changes = _run_supervisor(loop, 'ok', monkeypatch)
+    assert endpoints == [('127.0.0.1', process.port)]
+    assert process.restarts == 0
+    assert changes == []
+    assert not process.alive
+
+
+def test_restart_crashed_chrome(loop, monkeypatch):
+    endpoints, process, first_pid, changes = _run_supervisor(loop, 'crash', monkeypatch)
+    assert process.restarts == 1
+    assert process.process.pid != first_pid
+    assert changes == [(endpoints[0], False), (endpoints[0], True)]
+
+
+def test_restart_hung_chrome(loop, monkeypatch):
+    endpoints, process, first_pid, changes = _run_supervisor(loop, 'hang', monkeypatch)
+    assert process.restarts == 1
+    assert process.process.pid != first_pid
+    assert changes == [(endpoints[0], False), (endpoints[0], True)]
+
+
+def test_start_fails_when_chrome_exits(loop, monkeypatch):
+    monkeypatch.setattr(supervisor, '_DEFAULT_ARGS', ['-c', 'import sys; sys.exit(3)'])
+    chrome = ChromeSupervisor(1, loop=loop)
+    with pytest.raises(RuntimeError, match='exited with code 3'):
+        loop.run_until_complete(chrome.start())
+    loop.run_until_complete(chrome.stop())
+
+
+def test_start_stops_started_chromes_when_one_fails(loop, monkeypatch, tmp_path):
+    # The first Chrome starts, the next ones exit straight away
+    script = tmp_path / 'chrome.py'
+    script.write_text(
+        'import os, sys, runpy\n'
+        'marker = {!r}\n'
+        'if os.path.exists(marker):\n'
+        '    sys.exit(3)\n'
+        'open(marker, "w").close()\n'
+        'runpy.run_path({!r}, run_name="__main__")\n'.format(str(tmp_path / 'started'), FAKE_CHROME)
+    )
+    monkeypatch.setattr(supervisor, '_DEFAULT_ARGS', [str(script)])
+    chrome = ChromeSupervisor(2, loop=loop)
+    with pytest.raises(RuntimeError, match='exited with code 3'):
+        loop.run_until_complete(chrome.start())
+    assert any(process.process is not None for process in chrome.processes)
+    assert not any(process.alive for process in chrome.processes)
+    loop.run_until_complete(chrome.stop())
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from prerender.cache.base import CacheBackend
+from prerender.cache.writer import WriteBehindQueue
+
+
+class MemoryBackend(CacheBackend):
+    def __init__(self) -> None:
+        self.data = {}
+        self.writes = []
+
+    def set(self, key, payload, ttl=None, format='html'):
+        self.data[(key, format)] = payload
+        self.writes.append((key, payload, ttl, format))
+
+
+@pytest.fixture
+def loop(monkeypatch):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # Conditions no longer take a loop argument
+    condition = asyncio.Condition
+    monkeypatch.setattr(asyncio, 'Condition', lambda loop=None: condition())
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def _run(loop, scenario, **kwargs):
+    backend = MemoryBackend()
+
+    async def run():
+        queue = WriteBehindQueue(backend, **kwargs)
+        queue.start(loop)
+        try:
+            await scenario(queue)
+        finally:
+            await queue.close(timeout=5)
+
+    loop.run_until_complete(run())
+    return backend
+
+
+def test_writes_in_background(loop):
+    async def scenario(queue):
+        await queue.put('http://example.com/', b'page')
+        await queue.put('http://example.com/', b'shot', format='png', wait=True)
+
+    backend = _run(loop, scenario)
+    assert backend.data == {('http://example.com/', 'html'): b'page', ('http://example.com/', 'png'): b'shot'}
+
+
+def test_queued_writes_coalesce(loop):
+    async def scenario(queue):
+        await queue.put('http://example.com/', b'old')
+        await queue.put('http://example.com/', b'new')
+        assert queue.size == 3
+
+    backend = _run(loop, scenario)
+    assert backend.writes == [('http://example.com/', b'new', None, 'html')]
+
+
+def test_unchanged_payload_is_skipped(loop):
+    async def scenario(queue):
+        await queue.put('http://example.com/', b'page', wait=True)
+        await queue.put('http://example.com/', b'page', wait=True)
+        # Another TTL is written again
+        await queue.put('http://example.com/', b'page', ttl=10, wait=True)
+
+    backend = _run(loop, scenario)
+    assert [write[2] for write in backend.writes] == [None, 10]
+
+
+def test_drop_oldest(loop):
+    async def scenario(queue):
+        await queue.put('http://example.com/a', b'aaaaaa')
+        await queue.put('http://example.com/b', b'bbbbbb')
+
+    backend = _run(loop, scenario, max_bytes=10, policy='drop-oldest')
+    assert backend.data == {('http://example.com/b', 'html'): b'bbbbbb'}
+
+
+def test_drop_new_keeps_queued_write_of_the_same_key(loop):
+    async def scenario(queue):
+        await queue.put('http://example.com/a', b'aaaaaa')
+        await queue.put('http://example.com/b', b'bbbb')
+        # No room for the larger payload, the queued one is still written
+        await queue.put('http://example.com/a', b'AAAAAAAA', wait=True)
+        assert queue.size == 10
+
+    backend = _run(loop, scenario, max_bytes=10, policy='drop-new')
+    assert backend.data == {('http://example.com/a', 'html'): b'aaaaaa', ('http://example.com/b', 'html'): b'bbbb'}
+
+
+def test_invalidate(loop):
+    async def scenario(queue):
+        await queue.put('http://example.com/a', b'a')
+        await queue.put('http://example.com/a', b'a', format='pdf')
+        await queue.put('http://example.com/b', b'b')
+        await queue.put('http://other.com/', b'c')
+        await queue.invalidate('http://example.com/a', 'pdf')
+        await queue.invalidate(host='other.com')
+
+    backend = _run(loop, scenario)
+    assert set(backend.data) == {('http://example.com/a', 'html'), ('http://example.com/b', 'html')}
+
+
+def test_invalidate_forgets_written_payloads(loop):
+    async def scenario(queue):
+        await queue.put('http://example.com/', b'page', wait=True)
+        await queue.invalidate('http://example.com/')
+        await queue.put('http://example.com/', b'page', wait=True)
+
+    backend = _run(loop, scenario)
+    assert len(backend.writes) == 2
+
+
+def test_not_started_writes_synchronously(loop):
+    backend = MemoryBackend()
+    queue = WriteBehindQueue(backend)
+    loop.run_until_complete(queue.put('http://example.com/', b'page'))
+    assert backend.data == {('http://example.com/', 'html'): b'page'}
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        WriteBehindQueue(MemoryBackend(), policy='drop-all')